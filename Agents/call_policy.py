@@ -0,0 +1,226 @@
+"""
+Call Policy - Timeouts, retries and hedged requests for model calls
+
+A single slow Gemini response used to stall a whole complete-plan workflow
+for minutes. ResilientChatCompletionClient bounds the tail latency of each
+model call:
+- every attempt has a timeout
+- transient failures (timeouts, connection errors, 429, 5xx) are retried
+  with jittered exponential backoff, honouring Retry-After when present
+- optional hedging: if an attempt has not finished after the hedge delay
+  (fixed, or the observed p95 latency) a second request is fired and the
+  first valid result wins; for structured output "valid" means the content
+  parses into the requested output_content_type
+- around a RateLimitedChatCompletionClient, the timeout and the hedge delay
+  start once the limiter lets the call through, and no hedge is sent while
+  calls are queued in the limiter or all its slots are taken
+
+Configuration (environment variables):
+- MODEL_CALL_TIMEOUT: seconds per attempt (default 180)
+- MODEL_MAX_RETRIES: retries after the first attempt (default 3)
+- MODEL_RETRY_BASE_DELAY / MODEL_RETRY_MAX_DELAY: backoff bounds in seconds (default 1 / 30)
+- MODEL_HEDGE_ENABLED: "true" to enable hedging (default "false")
+- MODEL_HEDGE_DELAY: fixed hedge delay in seconds, 0 = use observed p95 (default 0)
+- MODEL_HEDGE_MIN_SAMPLES: latencies needed before the p95 is trusted (default 20)
+- TEAM_RUN_TIMEOUT: seconds allowed for a whole agent team run (default 900)
+"""
+
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import httpx
+import openai
+from autogen_core.models import CreateResult
+from pydantic import BaseModel
+
+from Agents.metrics import Counter
+from Agents.model_clients import DelegatingChatCompletionClient
+from Agents.rate_limiter import RateLimitedChatCompletionClient
+
+CALL_TIMEOUT = float(os.environ.get("MODEL_CALL_TIMEOUT", "180"))
+MAX_RETRIES = int(os.environ.get("MODEL_MAX_RETRIES", "3"))
+RETRY_BASE_DELAY = float(os.environ.get("MODEL_RETRY_BASE_DELAY", "1"))
+RETRY_MAX_DELAY = float(os.environ.get("MODEL_RETRY_MAX_DELAY", "30"))
+HEDGE_ENABLED = os.environ.get("MODEL_HEDGE_ENABLED", "false").lower() == "true"
+HEDGE_DELAY = float(os.environ.get("MODEL_HEDGE_DELAY", "0"))
+HEDGE_MIN_SAMPLES = int(os.environ.get("MODEL_HEDGE_MIN_SAMPLES", "20"))
+TEAM_RUN_TIMEOUT = float(os.environ.get("TEAM_RUN_TIMEOUT", "900"))
+
+TRANSIENT_ERRORS = (
+    asyncio.TimeoutError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+    httpx.TransportError,
+)
+
+model_retries = Counter("nutrifit_model_retries_total", "Model call retries by error type")
+model_hedges = Counter("nutrifit_model_hedged_requests_total", "Hedged model requests by winner")
+
+
+def backoff_delay(attempt: int, error: Optional[BaseException] = None) -> float:
+    """Full-jitter exponential backoff, or the provider's Retry-After when it sent one"""
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), RETRY_MAX_DELAY)
+        except ValueError:
+            pass
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+
+
+def is_valid_result(result: CreateResult, json_output) -> bool:
+    """True when the result is usable; structured output must parse into its model"""
+    if isinstance(json_output, type) and issubclass(json_output, BaseModel):
+        if not isinstance(result.content, str):
+            return False
+        try:
+            json_output.model_validate_json(result.content)
+        except Exception:
+            return False
+    return True
+
+
+class ResilientChatCompletionClient(DelegatingChatCompletionClient):
+    """Per-attempt timeout, jittered retries and optional hedging around a model client"""
+
+    def __init__(
+        self,
+        client,
+        timeout: float = CALL_TIMEOUT,
+        max_retries: int = MAX_RETRIES,
+        hedge: bool = HEDGE_ENABLED,
+        hedge_delay: float = HEDGE_DELAY,
+    ):
+        super().__init__(client)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.hedge = hedge
+        self.hedge_delay = hedge_delay
+        self._latencies = deque(maxlen=200)
+
+    def _current_hedge_delay(self) -> Optional[float]:
+        if not self.hedge:
+            return None
+        if self.hedge_delay > 0:
+            return self.hedge_delay
+        if len(self._latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+    @asynccontextmanager
+    async def _slot(self, messages, **kwargs):
+        """Wait for the rate limiter, if any, and yield the client to make the call with"""
+        if isinstance(self._client, RateLimitedChatCompletionClient):
+            async with self._client.slot(messages, **kwargs) as client:
+                yield client
+        else:
+            yield self._client
+
+    def _limiter_congested(self) -> bool:
+        return isinstance(self._client, RateLimitedChatCompletionClient) and self._client.congested
+
+    async def _attempt(self, messages, acquired: Optional[asyncio.Event] = None, **kwargs) -> CreateResult:
+        # The timeout starts once the rate limiter has let the call through
+        async with self._slot(messages, **kwargs) as client:
+            if acquired is not None:
+                acquired.set()
+            start = time.monotonic()
+            result = await asyncio.wait_for(client.create(messages, **kwargs), timeout=self.timeout)
+        self._latencies.append(time.monotonic() - start)
+        return result
+
+    async def _hedged_attempt(self, messages, **kwargs) -> CreateResult:
+        delay = self._current_hedge_delay()
+        if delay is None:
+            return await self._attempt(messages, **kwargs)
+        acquired = asyncio.Event()
+        primary = asyncio.create_task(self._attempt(messages, acquired, **kwargs))
+        pending = {primary}
+        try:
+            # The hedge clock also starts once the primary holds its slot
+            slot_wait = asyncio.create_task(acquired.wait())
+            try:
+                await asyncio.wait({primary, slot_wait}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                slot_wait.cancel()
+            if not primary.done():
+                await asyncio.wait({primary}, timeout=delay)
+            if primary.done():
+                pending = set()
+                return primary.result()
+            if self._limiter_congested():
+                # A hedge would only queue behind the calls waiting for the limiter
+                model_hedges.inc(winner="skipped")
+                pending = set()
+                return await primary
+
+            hedge = asyncio.create_task(self._attempt(messages, **kwargs))
+            pending = {primary, hedge}
+            fallback_result = None
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    result = task.result()
+                    if is_valid_result(result, kwargs.get("json_output")):
+                        model_hedges.inc(winner="primary" if task is primary else "hedge")
+                        return result
+                    fallback_result = fallback_result or result
+            if fallback_result is not None:
+                return fallback_result
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def create(self, messages, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                return await self._hedged_attempt(messages, **kwargs)
+            except TRANSIENT_ERRORS as e:
+                if attempt >= self.max_retries:
+                    raise
+                model_retries.inc(error=type(e).__name__)
+                await asyncio.sleep(backoff_delay(attempt, e))
+                attempt += 1
+
+    async def create_stream(self, messages, **kwargs):
+        # Streams are retried only while nothing has been yielded yet; the
+        # timeout applies to the first chunk and to every gap between chunks,
+        # counted from when the rate limiter lets the call through.
+        attempt = 0
+        while True:
+            yielded = False
+            try:
+                async with self._slot(messages, **kwargs) as client:
+                    stream = client.create_stream(messages, **kwargs).__aiter__()
+                    try:
+                        while True:
+                            try:
+                                chunk = await asyncio.wait_for(stream.__anext__(), timeout=self.timeout)
+                            except StopAsyncIteration:
+                                return
+                            yielded = True
+                            yield chunk
+                    finally:
+                        if hasattr(stream, "aclose"):
+                            await stream.aclose()
+            except TRANSIENT_ERRORS as e:
+                if yielded or attempt >= self.max_retries:
+                    raise
+                model_retries.inc(error=type(e).__name__)
+                await asyncio.sleep(backoff_delay(attempt, e))
+                attempt += 1
@@ -0,0 +1,133 @@
+"""
+Calorie Engine - Deterministic daily calorie target from InBody data
+
+The nutrition step used to wait for the whole gym team only to read the
+GymTrainingPlan.daily_calories the trainer model came up with. The target is
+now computed locally, so the gym and nutrition teams can run concurrently
+and both plans use the same number:
+
+1. BMR: the InBody-measured basal metabolic rate when present, otherwise
+   Katch-McArdle from fat-free mass (370 + 21.6 * FFM), otherwise
+   Mifflin-St Jeor from weight, height, age and gender
+2. TDEE: BMR * activity factor from the number of gym days per week
+3. goal adjustment: deficit for fat loss, surplus for muscle gain, a small
+   deficit when both are asked for (recomposition)
+4. never below a gender-specific floor (or the BMR), rounded to 50 kcal
+
+Configuration (environment variables):
+- CALORIE_ENGINE_ENABLED: "false" restores calories from the gym plan (default "true")
+- CALORIE_DEFICIT: fraction removed for fat loss (default 0.20)
+- CALORIE_SURPLUS: fraction added for muscle gain (default 0.10)
+- CALORIE_RECOMP_DEFICIT: fraction removed for recomposition (default 0.10)
+"""
+
+import os
+import re
+from typing import Optional
+
+CALORIE_ENGINE_ENABLED = os.environ.get("CALORIE_ENGINE_ENABLED", "true").lower() == "true"
+DEFICIT = float(os.environ.get("CALORIE_DEFICIT", "0.20"))
+SURPLUS = float(os.environ.get("CALORIE_SURPLUS", "0.10"))
+RECOMP_DEFICIT = float(os.environ.get("CALORIE_RECOMP_DEFICIT", "0.10"))
+
+# Gym days per week -> activity multiplier
+ACTIVITY_FACTORS = [(0, 1.2), (2, 1.375), (4, 1.55), (6, 1.725), (7, 1.9)]
+CALORIE_FLOORS = {"male": 1500, "female": 1200}
+
+# Whole English words ("again" is not a gain, "fatigue" not a fat loss goal);
+# Arabic stems at the start of a word, after an optional و/ف/ب/ل and ال
+ARABIC_WORD = r"\b[وفبل]?(?:ال)?(?:{})"
+LOSS_KEYWORDS = (
+    r"\b(?:lose|losing|loss|fat|cut|cutting|slim|slimming|shred|shredding|shredded)\b|"
+    + ARABIC_WORD.format("خسار|تخسيس|انقاص|إنقاص|حرق|تنشيف|رجيم")
+)
+GAIN_KEYWORDS = (
+    r"\b(?:gain|gaining|bulk|bulking|muscles?|muscular|build|building|mass|strength|stronger)\b|"
+    + ARABIC_WORD.format("زياد|بناء|تضخيم|عضل")
+)
+
+
+def _number(value) -> Optional[float]:
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if number > 0 else None
+
+
+def normalize_gender(gender) -> Optional[str]:
+    text = str(gender or "").strip().lower()
+    if text in ("m", "male", "man", "ذكر", "رجل"):
+        return "male"
+    if text in ("f", "female", "woman", "أنثى", "انثى", "امرأة"):
+        return "female"
+    return None
+
+
+def goal_type(goals) -> str:
+    """Goal category from free-text goals: loss, gain, recomposition or maintenance"""
+    text = str(goals or "").lower()
+    loss = re.search(LOSS_KEYWORDS, text) is not None
+    gain = re.search(GAIN_KEYWORDS, text) is not None
+    if loss and gain:
+        return "recomposition"
+    if loss:
+        return "loss"
+    if gain:
+        return "gain"
+    return "maintenance"
+
+
+def activity_factor(number_of_gym_days) -> float:
+    days = _number(number_of_gym_days) or 0
+    for max_days, factor in ACTIVITY_FACTORS:
+        if days <= max_days:
+            return factor
+    return ACTIVITY_FACTORS[-1][1]
+
+
+def basal_metabolic_rate(inbody: dict, age, gender) -> Optional[tuple]:
+    """(BMR, method) from the best data available, or None"""
+    measured = _number(inbody.get("basal_metabolic_rate"))
+    if measured:
+        return measured, "inbody"
+    weight = _number(inbody.get("weight"))
+    fat_free_mass = _number(inbody.get("fat_free_mass"))
+    body_fat_percentage = _number(inbody.get("body_fat_percentage"))
+    if not fat_free_mass and weight and body_fat_percentage:
+        fat_free_mass = weight * (1 - body_fat_percentage / 100)
+    if fat_free_mass:
+        return 370 + 21.6 * fat_free_mass, "katch_mcardle"
+    height, years, sex = _number(inbody.get("height")), _number(age), normalize_gender(gender)
+    if weight and height and years and sex:
+        return 10 * weight + 6.25 * height - 5 * years + (5 if sex == "male" else -161), "mifflin_st_jeor"
+    return None
+
+
+def daily_calorie_target(inbody_data, age, gender, goals, number_of_gym_days) -> Optional[dict]:
+    """Daily calorie target and how it was derived; None when the InBody data is insufficient"""
+    if hasattr(inbody_data, "model_dump"):
+        inbody_data = inbody_data.model_dump()
+    if not isinstance(inbody_data, dict):
+        return None
+    bmr = basal_metabolic_rate(inbody_data, age, gender)
+    if bmr is None:
+        return None
+    bmr, method = bmr
+
+    factor = activity_factor(number_of_gym_days)
+    tdee = bmr * factor
+    goal = goal_type(goals)
+    adjustment = {"loss": -DEFICIT, "gain": SURPLUS, "recomposition": -RECOMP_DEFICIT}.get(goal, 0.0)
+    floor = max(CALORIE_FLOORS.get(normalize_gender(gender), 1200), bmr)
+    calories = max(tdee * (1 + adjustment), floor)
+
+    return {
+        "daily_calories": int(round(calories / 50) * 50),
+        "bmr": round(bmr),
+        "bmr_method": method,
+        "activity_factor": factor,
+        "tdee": round(tdee),
+        "goal": goal,
+        "adjustment": adjustment,
+    }
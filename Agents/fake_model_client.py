@@ -0,0 +1,197 @@
+"""
+Fake Model Client - Deterministic local stand-in for the LLM providers
+
+Lets us benchmark and profile the agent pipelines (execute_complete_workflow,
+the gym/nutrition teams, the InBody specialist) offline without burning quota.
+Select it with MODEL_PROVIDER=fake; every agent then gets a
+FakeChatCompletionClient instead of Gemini/Azure.
+
+Responses:
+- structured output (output_content_type): a recorded response for the model
+  class name if FAKE_MODEL_RECORDINGS provides one, otherwise an instance
+  synthesized from the pydantic schema (a full 4-week FourWeekDietPlan,
+  a 7-day GymTrainingPlan, a successful ImageResponse, ...)
+- evaluator agents: "approved"
+- any other text agent (summarizer): a short summary
+
+Configuration (environment variables):
+- FAKE_MODEL_LATENCY: "fixed:<s>", "uniform:<low>,<high>" or "lognormal:<mu>,<sigma>" (default "fixed:0")
+- FAKE_MODEL_SEED: seed for the latency distribution (default 0)
+- FAKE_MODEL_RECORDINGS: JSON file mapping model class names (or "text") to responses
+"""
+
+import asyncio
+import json
+import os
+import random
+import typing
+from typing import Any, Dict, Optional
+
+from autogen_core.models import ChatCompletionClient, CreateResult, ModelInfo, RequestUsage, SystemMessage
+from pydantic import BaseModel
+
+FAKE_MODEL_INFO = ModelInfo(vision=True, function_calling=True, json_output=True, family="unknown", structured_output=True)
+
+MEAL_TYPES = ["breakfast", "lunch", "snack", "dinner"]
+
+# How many items to synthesize for list fields (4 weeks * 7 days * 4 meals for the diet plan)
+LIST_LENGTHS = {"plan": 112, "weekly_plan": 7, "exercises": 6, "ingredients": 3}
+
+# Index-aware values so synthesized plans look like real ones
+FIELD_VALUES = {
+    ("DayPlan", "week"): lambda i: f"Week {i // 28 + 1}",
+    ("DayPlan", "day"): lambda i: f"Day {(i // 4) % 7 + 1}",
+    ("DayPlan", "meal_type"): lambda i: MEAL_TYPES[i % 4],
+    ("DailyWorkout", "day"): lambda i: f"Day {i + 1}",
+    ("ImageResponse", "status"): lambda i: "success",
+    ("GymTrainingPlan", "daily_calories"): lambda i: 2200,
+    ("Exercise", "sets"): lambda i: 3,
+    ("Exercise", "reps"): lambda i: "10-12",
+    ("Exercise", "rest"): lambda i: "60 sec",
+}
+
+
+def _unwrap_optional(annotation):
+    if typing.get_origin(annotation) is typing.Union:
+        args = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+        if len(args) == 1:
+            return args[0]
+    return annotation
+
+
+def _synthesize_value(owner: str, field: str, annotation, index: int, rng: random.Random):
+    generator = FIELD_VALUES.get((owner, field))
+    if generator is not None:
+        return generator(index)
+    annotation = _unwrap_optional(annotation)
+    origin = typing.get_origin(annotation)
+    if origin in (list, typing.List):
+        (item_type,) = typing.get_args(annotation) or (str,)
+        return [_synthesize_value(owner, field, item_type, i, rng) for i in range(LIST_LENGTHS.get(field, 2))]
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return synthesize_model(annotation, rng, index)
+    if annotation is int:
+        return rng.randint(1, 100)
+    if annotation is float:
+        return round(rng.uniform(1, 100), 1)
+    if annotation is bool:
+        return True
+    if origin in (dict, typing.Dict):
+        return {}
+    return f"{field} {index + 1}"
+
+
+def synthesize_model(model_cls, rng: Optional[random.Random] = None, index: int = 0) -> dict:
+    """Build a plausible instance (as a dict) of a pydantic model from its schema"""
+    rng = rng or random.Random(0)
+    return {
+        name: _synthesize_value(model_cls.__name__, name, field.annotation, index, rng)
+        for name, field in model_cls.model_fields.items()
+    }
+
+
+def parse_latency(spec: str):
+    """Turn a FAKE_MODEL_LATENCY spec into a sampler taking a random.Random"""
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v]
+    if kind == "uniform":
+        low, high = values
+        return lambda rng: rng.uniform(low, high)
+    if kind == "lognormal":
+        mu, sigma = values
+        return lambda rng: rng.lognormvariate(mu, sigma)
+    delay = values[0] if values else 0.0
+    return lambda rng: delay
+
+
+def _message_text(message) -> str:
+    content = message.content
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return " ".join(part if isinstance(part, str) else "<image>" for part in content)
+    return str(content)
+
+
+class FakeChatCompletionClient(ChatCompletionClient):
+    """ChatCompletionClient returning recorded or schema-synthesized responses after a sampled delay"""
+
+    def __init__(self, latency: str = "fixed:0", seed: int = 0, recordings: Optional[Dict[str, Any]] = None, model: str = "fake"):
+        self.model = model
+        self._raw_config = {"model": model}
+        self._sample_latency = parse_latency(latency)
+        self._rng = random.Random(seed)
+        self._recordings = recordings or {}
+        self._usage = RequestUsage(prompt_tokens=0, completion_tokens=0)
+
+    def _respond(self, messages, json_output) -> str:
+        if isinstance(json_output, type) and issubclass(json_output, BaseModel):
+            recorded = self._recordings.get(json_output.__name__)
+            if recorded is None:
+                recorded = synthesize_model(json_output)
+            return recorded if isinstance(recorded, str) else json.dumps(recorded, ensure_ascii=False)
+        system = " ".join(_message_text(m) for m in messages if isinstance(m, SystemMessage)).lower()
+        if "evaluator" in system:
+            return "approved"
+        return self._recordings.get("text", "Previous plan: 4-day split with moderate calorie deficit, high-protein meals.")
+
+    def _result(self, messages, content: str) -> CreateResult:
+        prompt_tokens = sum(len(_message_text(m)) for m in messages) // 4
+        usage = RequestUsage(prompt_tokens=prompt_tokens, completion_tokens=len(content) // 4)
+        self._usage = RequestUsage(
+            prompt_tokens=self._usage.prompt_tokens + usage.prompt_tokens,
+            completion_tokens=self._usage.completion_tokens + usage.completion_tokens,
+        )
+        return CreateResult(finish_reason="stop", content=content, usage=usage, cached=False)
+
+    async def create(self, messages, **kwargs) -> CreateResult:
+        await asyncio.sleep(self._sample_latency(self._rng))
+        return self._result(messages, self._respond(messages, kwargs.get("json_output")))
+
+    async def create_stream(self, messages, **kwargs):
+        content = self._respond(messages, kwargs.get("json_output"))
+        chunk_size = 256
+        chunks = [content[i:i + chunk_size] for i in range(0, len(content), chunk_size)] or [""]
+        delay = self._sample_latency(self._rng) / len(chunks)
+        for chunk in chunks:
+            await asyncio.sleep(delay)
+            yield chunk
+        yield self._result(messages, content)
+
+    async def close(self) -> None:
+        pass
+
+    def actual_usage(self) -> RequestUsage:
+        return self._usage
+
+    def total_usage(self) -> RequestUsage:
+        return self._usage
+
+    def count_tokens(self, messages, **kwargs) -> int:
+        return sum(len(_message_text(m)) for m in messages) // 4
+
+    def remaining_tokens(self, messages, **kwargs) -> int:
+        return 1_000_000 - self.count_tokens(messages)
+
+    @property
+    def capabilities(self):
+        return FAKE_MODEL_INFO
+
+    @property
+    def model_info(self) -> ModelInfo:
+        return FAKE_MODEL_INFO
+
+
+def create_fake_client(model: Optional[str] = None) -> FakeChatCompletionClient:
+    """Build the fake client from FAKE_MODEL_* environment variables"""
+    recordings = None
+    recordings_path = os.environ.get("FAKE_MODEL_RECORDINGS")
+    if recordings_path:
+        with open(recordings_path, encoding="utf-8") as f:
+            recordings = json.load(f)
+    return FakeChatCompletionClient(
+        latency=os.environ.get("FAKE_MODEL_LATENCY", "fixed:0"),
+        seed=int(os.environ.get("FAKE_MODEL_SEED", "0")),
+        recordings=recordings,
+        model=model or "fake",
+    )
@@ -0,0 +1,219 @@
+"""
+Idempotency - Run each plan request once, however often it is submitted
+
+A user double-tapping "generate" used to start two full workflows, with two
+plan saves and two increment_used_requests calls. Plan requests are now
+keyed:
+- by the Idempotency-Key header when the client sends one (scoped to the user)
+- otherwise by user_id + InBody image (bytes hash, or URL) + plan inputs
+
+run_idempotent() runs a request once per key:
+- concurrent duplicates in the same process await the same running task
+- duplicates in another uvicorn worker wait for the owner's stored result
+  (a SQLite claim shared by the workers on the host marks the running key;
+  its lease is renewed while the run lasts and lapses if the worker dies)
+- late duplicates get the stored result of a successful run, within
+  IDEMPOTENCY_WINDOW for derived keys (regenerating the same plan later is a
+  new request) and within the cache TTL for explicit keys
+Failed runs are not stored, so a retry after an error runs again.
+
+Results live in the "idempotency" cache (SQLite disk tier by default, see
+llm_cache.build_cache for the IDEMPOTENCY_CACHE_* settings).
+
+Configuration (environment variables):
+- IDEMPOTENCY_ENABLED: "false" disables deduplication (default "true")
+- IDEMPOTENCY_WINDOW: seconds a derived key replays its result (default 600)
+- IDEMPOTENCY_CLAIM_PATH: SQLite file of running keys (default data/idempotency_claims.sqlite3)
+- IDEMPOTENCY_CLAIM_SECONDS: claim lease, renewed every third while the run lasts (default 120)
+- IDEMPOTENCY_POLL_INTERVAL: seconds between checks for another worker's result (default 1)
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi.encoders import jsonable_encoder
+
+from Agents.llm_cache import build_cache
+from Agents.metrics import Counter
+
+IDEMPOTENCY_ENABLED = os.environ.get("IDEMPOTENCY_ENABLED", "true").lower() == "true"
+IDEMPOTENCY_WINDOW = float(os.environ.get("IDEMPOTENCY_WINDOW", "600"))
+CLAIM_PATH = os.environ.get("IDEMPOTENCY_CLAIM_PATH", os.path.join("data", "idempotency_claims.sqlite3"))
+CLAIM_SECONDS = float(os.environ.get("IDEMPOTENCY_CLAIM_SECONDS", "120"))
+POLL_INTERVAL = float(os.environ.get("IDEMPOTENCY_POLL_INTERVAL", "1"))
+
+idempotent_requests = Counter(
+    "nutrifit_idempotent_requests_total",
+    "Keyed requests by outcome (executed/coalesced/replayed)",
+)
+
+idempotency_cache = build_cache("idempotency", "IDEMPOTENCY", default_backend="disk", default_ttl=86400)
+
+_inflight: Dict[str, asyncio.Task] = {}
+
+
+def request_key(user_id, explicit_key: Optional[str] = None, image_bytes: Optional[bytes] = None,
+                inputs: Optional[dict] = None) -> str:
+    """Idempotency key of a request: the client's key, or one derived from its content"""
+    if explicit_key:
+        material = {"user_id": user_id, "key": explicit_key}
+    else:
+        material = {
+            "user_id": user_id,
+            "image": hashlib.sha256(image_bytes).hexdigest() if image_bytes is not None else None,
+            "inputs": inputs or {},
+        }
+    prefix = "explicit" if explicit_key else "derived"
+    digest = hashlib.sha256(json.dumps(material, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    return f"{prefix}:{digest}"
+
+
+class ClaimStore:
+    """Keys being run, shared by the uvicorn workers on the host"""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS claims (key TEXT PRIMARY KEY, expires_at REAL NOT NULL)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def _claim(self, key: str) -> bool:
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM claims WHERE key = ? AND expires_at < ?", (key, now))
+            claimed = conn.execute(
+                "INSERT OR IGNORE INTO claims (key, expires_at) VALUES (?, ?)", (key, now + CLAIM_SECONDS)
+            ).rowcount == 1
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return claimed
+
+    def _renew(self, key: str) -> None:
+        with self._connect() as conn:
+            conn.execute("UPDATE claims SET expires_at = ? WHERE key = ?", (time.time() + CLAIM_SECONDS, key))
+
+    def _release(self, key: str) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM claims WHERE key = ?", (key,))
+
+    async def claim(self, key: str) -> bool:
+        return await asyncio.to_thread(self._claim, key)
+
+    async def renew(self, key: str) -> None:
+        await asyncio.to_thread(self._renew, key)
+
+    async def release(self, key: str) -> None:
+        await asyncio.to_thread(self._release, key)
+
+
+_claim_store: Optional[ClaimStore] = None
+_claim_store_error: Optional[str] = None
+
+
+def get_claim_store() -> Optional[ClaimStore]:
+    """The shared ClaimStore, opened on first use; None when its path is unusable"""
+    global _claim_store, _claim_store_error
+    if _claim_store is None and _claim_store_error is None:
+        try:
+            _claim_store = ClaimStore(CLAIM_PATH)
+        except Exception as e:
+            _claim_store_error = str(e)
+            print(f"Idempotency claims unavailable at {CLAIM_PATH}, deduplicating within this process only: {e}")
+    return _claim_store
+
+
+async def get_stored_result(key: str) -> Optional[dict]:
+    cached = await idempotency_cache.get(key)
+    if not cached:
+        return None
+    entry = json.loads(cached)
+    if key.startswith("derived:") and time.time() - entry["stored_at"] > IDEMPOTENCY_WINDOW:
+        return None
+    return entry["result"]
+
+
+async def store_result(key: str, result: dict) -> None:
+    await idempotency_cache.set(key, json.dumps({"stored_at": time.time(), "result": jsonable_encoder(result)}))
+
+
+async def _keep_claim(claims: ClaimStore, key: str) -> None:
+    while True:
+        await asyncio.sleep(CLAIM_SECONDS / 3)
+        try:
+            await claims.renew(key)
+        except Exception as e:
+            print(f"Error renewing idempotency claim: {e}")
+
+
+async def _execute(key: str, run: Callable[[], Awaitable[dict]], claims: Optional[ClaimStore]) -> dict:
+    heartbeat = asyncio.create_task(_keep_claim(claims, key)) if claims is not None else None
+    try:
+        result = await run()
+        if result.get("status") == "success":
+            await store_result(key, result)
+        return result
+    finally:
+        _inflight.pop(key, None)
+        if heartbeat is not None:
+            heartbeat.cancel()
+            try:
+                await claims.release(key)
+            except Exception as e:
+                print(f"Error releasing idempotency claim: {e}")
+
+
+async def run_idempotent(key: str, run: Callable[[], Awaitable[dict]]) -> Tuple[dict, str]:
+    """
+    Result of run() for this key and how it was obtained: "executed",
+    "coalesced" (awaited a running duplicate) or "replayed" (stored result).
+
+    The run is not cancelled when the caller goes away, since duplicates may
+    be waiting on it.
+    """
+    if not IDEMPOTENCY_ENABLED:
+        return await run(), "executed"
+    while True:
+        task = _inflight.get(key)
+        if task is not None:
+            idempotent_requests.inc(outcome="coalesced")
+            return await asyncio.shield(task), "coalesced"
+        stored = await get_stored_result(key)
+        if stored is not None:
+            idempotent_requests.inc(outcome="replayed")
+            return stored, "replayed"
+        if key in _inflight:
+            continue
+        claims = get_claim_store()
+        claimed = True
+        if claims is not None:
+            try:
+                claimed = await claims.claim(key)
+            except Exception as e:
+                print(f"Error claiming idempotency key, deduplicating within this process only: {e}")
+                claims = None
+        if key in _inflight:
+            # Started by another request of this process while claiming
+            continue
+        if claimed:
+            task = _inflight[key] = asyncio.ensure_future(_execute(key, run, claims))
+            idempotent_requests.inc(outcome="executed")
+            return await asyncio.shield(task), "executed"
+        # Running in another worker process: wait for its result (or its claim to go)
+        await asyncio.sleep(POLL_INTERVAL)
@@ -0,0 +1,103 @@
+"""
+Image Classifier - Local gate that rejects obvious non-InBody images
+
+The InBody specialist used to be the only check, so a selfie or a food photo
+cost a full vision call before the workflow learned it was "not valid image".
+looks_like_document() scores an image in a few milliseconds with NumPy, from
+a 256px thumbnail:
+- paper: share of bright, near-neutral pixels (white sheet background)
+- colourfulness: mean saturation (printed sheets are mostly black on white)
+- text density: share of strong luminance edges (printed text and tables)
+- aspect ratio: extreme panoramas/strips are penalized
+
+Only images scoring below the threshold are rejected; anything that could be
+a document still goes to the vision model, so the threshold should stay
+conservative.
+
+Configuration (environment variables):
+- INBODY_PRECHECK_ENABLED: "false" bypasses the gate (default "true")
+- INBODY_PRECHECK_THRESHOLD: minimum score 0-1 to forward an image (default 0.35)
+"""
+
+import asyncio
+import os
+import time
+from dataclasses import dataclass, asdict
+
+import numpy as np
+from PIL import Image
+
+from Agents.metrics import Counter, Histogram
+
+PRECHECK_ENABLED = os.environ.get("INBODY_PRECHECK_ENABLED", "true").lower() == "true"
+PRECHECK_THRESHOLD = float(os.environ.get("INBODY_PRECHECK_THRESHOLD", "0.35"))
+THUMBNAIL_EDGE = 256
+
+precheck_results = Counter("nutrifit_inbody_precheck_total", "Local InBody pre-check decisions (accepted/rejected)")
+precheck_seconds = Histogram("nutrifit_inbody_precheck_seconds", "Time spent in the local InBody pre-check")
+
+
+@dataclass
+class DocumentScore:
+    score: float
+    paper: float
+    saturation: float
+    edge_density: float
+    aspect_ratio: float
+
+    @property
+    def accepted(self) -> bool:
+        return self.score >= PRECHECK_THRESHOLD
+
+    def to_dict(self) -> dict:
+        return {**asdict(self), "accepted": self.accepted}
+
+
+def _clip(value: float) -> float:
+    return float(min(1.0, max(0.0, value)))
+
+
+def document_score(image: Image.Image) -> DocumentScore:
+    """Score 0-1 of how much an image looks like a printed document (blocking)"""
+    thumbnail = image.copy()
+    thumbnail.thumbnail((THUMBNAIL_EDGE, THUMBNAIL_EDGE), reducing_gap=2.0)
+    rgb = np.asarray(thumbnail.convert("RGB"), dtype=np.float32) / 255.0
+
+    luminance = rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    high, low = rgb.max(axis=2), rgb.min(axis=2)
+    pixel_saturation = np.where(high > 0, (high - low) / np.maximum(high, 1e-6), 0.0)
+    saturation = float(np.mean(pixel_saturation))
+
+    # Bright, near-neutral pixels close to the brightest tone (skin and walls are not neutral)
+    paper_tone = np.percentile(luminance, 95)
+    paper = float(np.mean((luminance >= max(paper_tone - 0.15, 0.5)) & (pixel_saturation < 0.25)))
+
+    gradient = np.abs(np.diff(luminance, axis=1))[:-1, :] + np.abs(np.diff(luminance, axis=0))[:, :-1]
+    edge_density = float(np.mean(gradient > 0.15))
+
+    height, width = luminance.shape
+    aspect_ratio = min(width, height) / max(width, height)
+
+    score = (
+        0.35 * _clip((paper - 0.2) / 0.4)
+        + 0.35 * _clip((0.35 - saturation) / 0.25)
+        + 0.30 * _clip((edge_density - 0.01) / 0.06)
+    )
+    if aspect_ratio < 0.3:
+        score *= 0.5
+    return DocumentScore(round(score, 3), round(paper, 3), round(saturation, 3), round(edge_density, 3), round(aspect_ratio, 3))
+
+
+async def looks_like_document(image: Image.Image) -> DocumentScore:
+    """Run the pre-check off the event loop; always accepts when the gate is disabled or fails"""
+    if not PRECHECK_ENABLED:
+        return DocumentScore(1.0, 0.0, 0.0, 0.0, 0.0)
+    start = time.monotonic()
+    try:
+        result = await asyncio.to_thread(document_score, image)
+    except Exception as e:
+        print(f"Error in InBody pre-check, forwarding image: {e}")
+        return DocumentScore(1.0, 0.0, 0.0, 0.0, 0.0)
+    precheck_seconds.observe(time.monotonic() - start)
+    precheck_results.inc(decision="accepted" if result.accepted else "rejected")
+    return result
@@ -0,0 +1,162 @@
+"""
+Image Fetcher - Async, pooled download of InBody/food images
+
+process_inbody_image used to call the blocking requests.get inside an async
+function, freezing the event loop (and every other request on the uvicorn
+worker) for the whole download, and create_complete_plan hit each image twice
+(requests.head, then requests.get). All image downloads now go through one
+shared httpx.AsyncClient:
+- a single GET both validates the URL and downloads the image
+- connections are pooled and reused across requests
+- timeouts are configurable
+- the body is streamed with a hard byte cap and non-image content types are
+  rejected from the headers, before anything is buffered
+- PIL verify/decode runs in a small bounded thread pool, off the event loop,
+  with a pixel cap against decompression bombs
+
+A few huge uploads can no longer spike worker memory (the container is capped
+at 2G) or stall concurrent requests.
+
+Configuration (environment variables):
+- IMAGE_FETCH_TIMEOUT: read/write timeout in seconds (default 15)
+- IMAGE_FETCH_CONNECT_TIMEOUT: connect timeout in seconds (default 5)
+- IMAGE_FETCH_MAX_CONNECTIONS: pool size (default 50)
+- IMAGE_FETCH_MAX_BYTES: largest accepted image in bytes (default 15 MB)
+- IMAGE_MAX_PIXELS: largest accepted image in pixels (default 50 million)
+- IMAGE_DECODE_WORKERS: decode thread pool size (default 2)
+"""
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Optional
+
+import httpx
+from autogen_core import Image as AGImage
+from PIL import Image
+
+FETCH_TIMEOUT = float(os.environ.get("IMAGE_FETCH_TIMEOUT", "15"))
+FETCH_CONNECT_TIMEOUT = float(os.environ.get("IMAGE_FETCH_CONNECT_TIMEOUT", "5"))
+FETCH_MAX_CONNECTIONS = int(os.environ.get("IMAGE_FETCH_MAX_CONNECTIONS", "50"))
+FETCH_MAX_BYTES = int(os.environ.get("IMAGE_FETCH_MAX_BYTES", str(15 * 1024 * 1024)))
+MAX_PIXELS = int(os.environ.get("IMAGE_MAX_PIXELS", "50000000"))
+DECODE_WORKERS = int(os.environ.get("IMAGE_DECODE_WORKERS", "2"))
+
+# Generic types some object stores serve images with; the decoder has the final say
+GENERIC_CONTENT_TYPES = {"", "application/octet-stream", "binary/octet-stream"}
+UNSUPPORTED_IMAGE_TYPES = {"image/svg+xml"}
+
+_decode_executor = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix="image-decode")
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+class ImageFetchError(Exception):
+    """The image URL is invalid, unreachable or did not return an image"""
+
+
+@dataclass
+class FetchedImage:
+    url: str
+    content: bytes
+    content_type: str
+    etag: Optional[str] = None
+    not_modified: bool = False
+
+
+def get_http_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(FETCH_TIMEOUT, connect=FETCH_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=FETCH_MAX_CONNECTIONS),
+            follow_redirects=True,
+        )
+    return _client
+
+
+async def close_image_fetcher() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def check_content_type(content_type: str) -> None:
+    media_type = content_type.split(";")[0].strip().lower()
+    if media_type in GENERIC_CONTENT_TYPES:
+        return
+    if not media_type.startswith("image/") or media_type in UNSUPPORTED_IMAGE_TYPES:
+        raise ImageFetchError(f"Unsupported content type: {media_type}")
+
+
+async def fetch_image(url: str, etag: Optional[str] = None) -> FetchedImage:
+    """
+    Download an image with a single streamed GET; raises ImageFetchError on any
+    failure, on a non-image content type or when the body exceeds FETCH_MAX_BYTES.
+
+    When `etag` is given the GET is conditional: if the image is unchanged the
+    server answers 304 and the result has not_modified=True and no content.
+    """
+    if not url:
+        raise ImageFetchError("No image URL provided")
+    headers = {"If-None-Match": etag} if etag else None
+    try:
+        async with get_http_client().stream("GET", url, headers=headers) as response:
+            if response.status_code == 304 and etag:
+                return FetchedImage(url=url, content=b"", content_type="", etag=etag, not_modified=True)
+            response.raise_for_status()
+            content_type = response.headers.get("content-type", "")
+            check_content_type(content_type)
+            declared = response.headers.get("content-length")
+            if declared and declared.isdigit() and int(declared) > FETCH_MAX_BYTES:
+                raise ImageFetchError(f"Image is too large ({declared} bytes, limit {FETCH_MAX_BYTES})")
+            body = bytearray()
+            async for chunk in response.aiter_bytes():
+                body.extend(chunk)
+                if len(body) > FETCH_MAX_BYTES:
+                    raise ImageFetchError(f"Image is too large (over {FETCH_MAX_BYTES} bytes)")
+            return FetchedImage(
+                url=url,
+                content=bytes(body),
+                content_type=content_type,
+                etag=response.headers.get("etag"),
+            )
+    except httpx.HTTPError as e:
+        raise ImageFetchError(f"Invalid or inaccessible image URL: {e}") from e
+
+
+def decode_image(content: bytes) -> Image.Image:
+    """Verify and decode image bytes (blocking, use load_ag_image from async code)"""
+    try:
+        with Image.open(BytesIO(content)) as probe:
+            if probe.width * probe.height > MAX_PIXELS:
+                raise ImageFetchError(f"Image is too large ({probe.width}x{probe.height} pixels)")
+            probe.verify()
+        image = Image.open(BytesIO(content))
+        image.load()
+    except ImageFetchError:
+        raise
+    except Exception as e:
+        raise ImageFetchError(f"Downloaded file is not a valid image: {e}") from e
+    # Kept so preprocessing can report bytes saved
+    image.info["source_bytes"] = len(content)
+    return image
+
+
+def _decode_ag_image(content: bytes) -> AGImage:
+    return AGImage(decode_image(content))
+
+
+async def load_ag_image(content: bytes) -> AGImage:
+    """Decode image bytes for AutoGen in the bounded decode pool, off the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_decode_executor, _decode_ag_image, content)
+
+
+async def fetch_ag_image(url: str) -> AGImage:
+    """Download an image and wrap it for AutoGen multimodal messages"""
+    fetched = await fetch_image(url)
+    return await load_ag_image(fetched.content)
@@ -0,0 +1,178 @@
+"""
+Image Hashing - Perceptual near-duplicate detection for InBody scans
+
+The exact content-hash cache (inbody_cache) misses a scan that was
+photographed again or re-compressed by a chat app. Each analyzed scan is
+indexed per user with three 64-bit perceptual hashes computed with Pillow +
+NumPy:
+- aHash: 8x8 mean threshold
+- dHash: 9x8 horizontal gradient signs
+- pHash: low 8x8 frequencies of a 32x32 DCT, thresholded at their median
+
+A new scan is a near duplicate when the mean of the three Hamming distances
+is within the threshold (a single hash flips bits on flat, blank regions).
+Different InBody sheets share the same printed layout, so the threshold is
+tight and only recent scans of the same user are compared: a new monthly
+scan must not be mistaken for last month's.
+
+Configuration (environment variables):
+- INBODY_PHASH_ENABLED: "false" disables near-duplicate reuse (default "true")
+- INBODY_PHASH_THRESHOLD: max mean Hamming distance out of 64 bits (default 3)
+- INBODY_PHASH_MAX_AGE_HOURS: only scans indexed this recently match (default 72)
+- INBODY_PHASH_MAX_PER_USER: scans kept per user (default 20)
+- INBODY_PHASH_PATH: SQLite index path (default data/inbody_phash.sqlite3),
+  opened on first use
+"""
+
+import asyncio
+import os
+import sqlite3
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+
+from Agents.metrics import Counter
+
+PHASH_ENABLED = os.environ.get("INBODY_PHASH_ENABLED", "true").lower() == "true"
+PHASH_THRESHOLD = float(os.environ.get("INBODY_PHASH_THRESHOLD", "3"))
+PHASH_MAX_AGE = float(os.environ.get("INBODY_PHASH_MAX_AGE_HOURS", "72")) * 3600
+PHASH_MAX_PER_USER = int(os.environ.get("INBODY_PHASH_MAX_PER_USER", "20"))
+PHASH_PATH = os.environ.get("INBODY_PHASH_PATH", os.path.join("data", "inbody_phash.sqlite3"))
+
+near_duplicate_lookups = Counter("nutrifit_inbody_near_duplicate_total", "Perceptual-hash lookups by result (hit/miss)")
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    value = 0
+    for bit in bits.flatten():
+        value = (value << 1) | int(bit)
+    return value
+
+
+def _dct_matrix(size: int) -> np.ndarray:
+    """Orthonormal DCT-II basis, so dct2(x) = D @ x @ D.T"""
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    matrix = np.cos(np.pi * (2 * n + 1) * k / (2 * size)) * np.sqrt(2 / size)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+_DCT_32 = _dct_matrix(32)
+
+
+def _pixels(image: Image.Image, width: int, height: int) -> np.ndarray:
+    return np.asarray(image.convert("L").resize((width, height), Image.LANCZOS), dtype=np.float64)
+
+
+def average_hash(image: Image.Image) -> int:
+    pixels = _pixels(image, 8, 8)
+    return _bits_to_int(pixels > pixels.mean())
+
+
+def difference_hash(image: Image.Image) -> int:
+    pixels = _pixels(image, 9, 8)
+    return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+def perceptual_hash(image: Image.Image) -> int:
+    pixels = _pixels(image, 32, 32)
+    low = (_DCT_32 @ pixels @ _DCT_32.T)[:8, :8].flatten()
+    # The DC term only carries overall brightness
+    return _bits_to_int(low > np.median(low[1:]))
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+@dataclass
+class ImageHashes:
+    ahash: int
+    dhash: int
+    phash: int
+
+    @classmethod
+    def of(cls, image: Image.Image) -> "ImageHashes":
+        return cls(average_hash(image), difference_hash(image), perceptual_hash(image))
+
+    def distance(self, other: "ImageHashes") -> float:
+        """Mean of the three Hamming distances"""
+        return (hamming(self.ahash, other.ahash) + hamming(self.dhash, other.dhash) + hamming(self.phash, other.phash)) / 3
+
+
+class PerceptualIndex:
+    """Per-user SQLite index of the perceptual hashes of analyzed scans"""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS scans ("
+                "user_id TEXT NOT NULL, content_hash TEXT NOT NULL, ahash TEXT NOT NULL, dhash TEXT NOT NULL, "
+                "phash TEXT NOT NULL, indexed_at REAL NOT NULL, PRIMARY KEY (user_id, content_hash))"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _find(self, user_id: str, hashes: ImageHashes, threshold: float) -> Optional[str]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT content_hash, ahash, dhash, phash FROM scans WHERE user_id = ? AND indexed_at >= ?",
+                (user_id, time.time() - PHASH_MAX_AGE),
+            ).fetchall()
+        best, best_distance = None, threshold
+        for content_hash, ahash, dhash, phash in rows:
+            distance = hashes.distance(ImageHashes(int(ahash, 16), int(dhash, 16), int(phash, 16)))
+            if distance <= best_distance:
+                best, best_distance = content_hash, distance
+        return best
+
+    def _add(self, user_id: str, content_hash: str, hashes: ImageHashes) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO scans (user_id, content_hash, ahash, dhash, phash, indexed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (user_id, content_hash, f"{hashes.ahash:016x}", f"{hashes.dhash:016x}", f"{hashes.phash:016x}", time.time()),
+            )
+            conn.execute(
+                "DELETE FROM scans WHERE user_id = ? AND content_hash NOT IN ("
+                "SELECT content_hash FROM scans WHERE user_id = ? ORDER BY indexed_at DESC LIMIT ?)",
+                (user_id, user_id, PHASH_MAX_PER_USER),
+            )
+
+    async def find(self, user_id: str, hashes: ImageHashes, threshold: float = PHASH_THRESHOLD) -> Optional[str]:
+        """Content hash of the closest recent scan of the user within the threshold"""
+        match = await asyncio.to_thread(self._find, user_id, hashes, threshold)
+        near_duplicate_lookups.inc(result="hit" if match else "miss")
+        return match
+
+    async def add(self, user_id: str, content_hash: str, hashes: ImageHashes) -> None:
+        await asyncio.to_thread(self._add, user_id, content_hash, hashes)
+
+
+async def compute_hashes(image: Image.Image) -> ImageHashes:
+    return await asyncio.to_thread(ImageHashes.of, image)
+
+
+_index: Optional[PerceptualIndex] = None
+_index_error: Optional[str] = None
+
+
+def get_perceptual_index() -> Optional[PerceptualIndex]:
+    """The shared PerceptualIndex, opened on first use; None when disabled or its path is unusable"""
+    global _index, _index_error
+    if PHASH_ENABLED and _index is None and _index_error is None:
+        try:
+            _index = PerceptualIndex(PHASH_PATH)
+        except Exception as e:
+            _index_error = str(e)
+            print(f"Perceptual-hash index unavailable at {PHASH_PATH}, near-duplicate reuse disabled: {e}")
+    return _index
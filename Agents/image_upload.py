@@ -0,0 +1,99 @@
+"""
+Image Upload - Accept image bytes directly on the InBody/workflow endpoints
+
+The app used to upload every scan to storage so that we could download it
+back by URL. The endpoints now also take the image itself, either as:
+- multipart/form-data: the image as a file field, the other fields as form fields
+- JSON: the image as a base64 (or data URL) string field
+
+read_image_request() returns the request fields plus the uploaded bytes
+(None when the request only carries a URL); read_batch_image_request() does
+the same for requests carrying several files. Uploads are held to the same
+IMAGE_FETCH_MAX_BYTES cap and content-type rules as downloads. Multipart
+parsing needs the python-multipart package.
+"""
+
+import base64
+import binascii
+import json
+from typing import List, Optional, Tuple
+
+from fastapi import Request
+from starlette.datastructures import UploadFile
+
+from Agents.image_fetcher import FETCH_MAX_BYTES, ImageFetchError, check_content_type
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+def decode_base64_image(value: str) -> bytes:
+    """Decode a base64 image or data URL, enforcing the byte cap"""
+    if value.startswith("data:"):
+        header, _, value = value.partition(",")
+        check_content_type(header[5:].split(";")[0])
+    # base64 inflates by 4/3; reject before decoding anything oversized
+    if len(value) * 3 // 4 > FETCH_MAX_BYTES + 3:
+        raise ImageFetchError(f"Image is too large (limit {FETCH_MAX_BYTES} bytes)")
+    try:
+        return base64.b64decode(value, validate=True)
+    except (binascii.Error, ValueError) as e:
+        raise ImageFetchError(f"Invalid base64 image: {e}") from e
+
+
+async def read_upload(upload: UploadFile) -> bytes:
+    """Read an uploaded file in chunks, enforcing the byte cap"""
+    check_content_type(upload.content_type or "")
+    body = bytearray()
+    while True:
+        chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        body.extend(chunk)
+        if len(body) > FETCH_MAX_BYTES:
+            raise ImageFetchError(f"Image is too large (over {FETCH_MAX_BYTES} bytes)")
+    return bytes(body)
+
+
+async def read_image_request(request: Request, image_field: str) -> Tuple[dict, Optional[bytes]]:
+    """
+    Fields and uploaded image bytes of a JSON or multipart request.
+
+    The image is read from the `image_field` file (multipart) or from
+    `<image_field>_base64` (JSON or form field). Raises ImageFetchError for
+    an invalid or oversized image.
+    """
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        data, image = {}, None
+        for key, value in form.multi_items():
+            if isinstance(value, UploadFile):
+                if key == image_field:
+                    image = await read_upload(value)
+            else:
+                data[key] = value
+    else:
+        body = await request.body()
+        data = json.loads(body) if body else {}
+        image = None
+    encoded = data.pop(f"{image_field}_base64", None)
+    if image is None and encoded:
+        image = decode_base64_image(encoded)
+    return data, image
+
+
+async def read_batch_image_request(request: Request, image_field: str) -> Tuple[dict, List[bytes]]:
+    """Fields and uploaded image files (`image_field`, repeated) of a JSON or multipart request"""
+    content_type = request.headers.get("content-type", "")
+    if not content_type.startswith("multipart/form-data"):
+        body = await request.body()
+        return (json.loads(body) if body else {}), []
+    form = await request.form()
+    data, images = {}, []
+    for key, value in form.multi_items():
+        if isinstance(value, UploadFile):
+            if key == image_field:
+                images.append(await read_upload(value))
+        else:
+            data[key] = value
+    return data, images
@@ -0,0 +1,64 @@
+"""
+InBody Cache - Reuse InBody extraction results for repeated scans
+
+Users often resubmit the same scan (retries, regenerating a plan) and each
+submission used to pay a full vision call. Results of the InBody specialist
+are stored by:
+- SHA-256 of the normalized (preprocessed) image bytes
+- URL + ETag, so an unchanged image behind the same URL is recognised with a
+  conditional GET (304) without downloading it again
+
+The cache defaults to the SQLite disk tier (shared by all uvicorn workers on
+the host, kept across restarts; /app/data is a mounted volume). Its file is
+created on first use, not at import, and an unusable path leaves the cache
+in memory only. It can use Redis instead with INBODY_CACHE_BACKEND=redis. See llm_cache.build_cache for
+the INBODY_CACHE_* settings. Bump INBODY_CACHE_VERSION when the InBody prompt
+or model changes so stale extractions are not reused. INBODY_CACHE_ENABLED=false
+turns the cache off (e.g. for benchmarks that must run the extraction every time).
+"""
+
+import hashlib
+import json
+import os
+from typing import Optional
+
+from Agents.image_preprocessing import EncodedImage
+from Agents.llm_cache import build_cache
+
+INBODY_CACHE_VERSION = os.environ.get("INBODY_CACHE_VERSION", "1")
+INBODY_CACHE_ENABLED = os.environ.get("INBODY_CACHE_ENABLED", "true").lower() == "true"
+
+inbody_cache = build_cache("inbody", "INBODY", default_backend="disk", default_ttl=30 * 86400)
+
+
+def image_content_hash(image) -> str:
+    """SHA-256 of the bytes that are sent to the vision model"""
+    data = image.encoded if isinstance(image, EncodedImage) else image.to_base64().encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+async def get_cached_analysis(content_hash: str) -> Optional[dict]:
+    if not INBODY_CACHE_ENABLED:
+        return None
+    cached = await inbody_cache.get(f"v{INBODY_CACHE_VERSION}:image:{content_hash}")
+    return json.loads(cached) if cached else None
+
+
+async def store_analysis(content_hash: str, analysis: dict) -> None:
+    if not INBODY_CACHE_ENABLED:
+        return
+    await inbody_cache.set(f"v{INBODY_CACHE_VERSION}:image:{content_hash}", json.dumps(analysis))
+
+
+async def get_url_entry(url: str) -> Optional[dict]:
+    """Last known {"etag", "hash"} of the image behind a URL"""
+    if not INBODY_CACHE_ENABLED:
+        return None
+    cached = await inbody_cache.get(f"v{INBODY_CACHE_VERSION}:url:{url}")
+    return json.loads(cached) if cached else None
+
+
+async def store_url_entry(url: str, etag: str, content_hash: str) -> None:
+    if not INBODY_CACHE_ENABLED:
+        return
+    await inbody_cache.set(f"v{INBODY_CACHE_VERSION}:url:{url}", json.dumps({"etag": etag, "hash": content_hash}))
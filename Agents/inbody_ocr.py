@@ -0,0 +1,356 @@
+"""
+InBody OCR - Local template extraction for known InBody report layouts
+
+Most scans come from a few InBody devices whose result sheets have a fixed
+layout. extract_inbody_fields() reads the sheet with a local tesseract
+binary (TSV output, so every word carries its OCR confidence), identifies
+the layout from its markers and fills the InbodyData fields with that
+layout's label templates.
+
+A number next to a label is not trusted as is: the Muscle-Fat and Obesity
+bar charts print their scale (55 70 85 ...) on the same line as the value.
+A value is anchored when it sits in one of the sheet's value columns:
+- a table cell followed by its normal range: "Weight (kg) 78.5 ( 59.9 ~ 81.1 )"
+- the one number of a bar chart line that is off its ascending scale
+- the score column: "InBody Score 80/100"
+A field is verified when its value passes one of the CONSISTENCY_CHECKS
+(BMI vs weight/height, weight vs fat mass + fat-free mass, PBF vs fat mass,
+fat-free mass vs water + protein + minerals, BMR vs fat-free mass), or when
+it is anchored and fails none of them. Other values are left unverified.
+
+The result has a confidence score built from:
+- field coverage: share of the layout's expected fields that were verified
+- OCR confidence: mean word confidence of the lines the values came from
+
+Callers fall back to the vision agent when the confidence is below
+OCR_MIN_CONFIDENCE or a field was left unverified. Without a tesseract
+binary the extractor is a no-op. New layouts are added to LAYOUTS.
+
+Configuration (environment variables):
+- INBODY_OCR_ENABLED: "false" disables local extraction (default "true")
+- TESSERACT_CMD: tesseract binary (default: found on PATH)
+- INBODY_OCR_LANG: tesseract language (default "eng")
+- INBODY_OCR_MIN_CONFIDENCE: minimum confidence 0-1 to skip the vision agent (default 0.8)
+- INBODY_OCR_TIMEOUT: seconds per OCR run (default 10)
+- INBODY_OCR_MAX_CONCURRENCY: parallel OCR processes per worker (default 2)
+"""
+
+import asyncio
+import csv
+import os
+import re
+import shutil
+import time
+from dataclasses import dataclass, field
+from io import BytesIO, StringIO
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from Agents.metrics import Counter, Histogram
+
+OCR_ENABLED = os.environ.get("INBODY_OCR_ENABLED", "true").lower() == "true"
+TESSERACT_CMD = os.environ.get("TESSERACT_CMD") or shutil.which("tesseract")
+OCR_LANG = os.environ.get("INBODY_OCR_LANG", "eng")
+OCR_MIN_CONFIDENCE = float(os.environ.get("INBODY_OCR_MIN_CONFIDENCE", "0.8"))
+OCR_TIMEOUT = float(os.environ.get("INBODY_OCR_TIMEOUT", "10"))
+OCR_MAX_CONCURRENCY = int(os.environ.get("INBODY_OCR_MAX_CONCURRENCY", "2"))
+
+_semaphore = asyncio.Semaphore(OCR_MAX_CONCURRENCY)
+
+ocr_extractions = Counter("nutrifit_inbody_ocr_total", "Local InBody OCR extractions by layout and outcome (accepted/low_confidence/failed)")
+ocr_seconds = Histogram("nutrifit_inbody_ocr_seconds", "Time spent in local InBody OCR extraction")
+
+NUMBER = r"[^\d\n]{0,30}?(\d{1,4}(?:[.,]\d{1,2})?)"
+VALUE = r"\d{1,4}(?:[.,]\d{1,2})?"
+# Unit columns printed between a label and its value, e.g. "(kg/m2)"
+UNIT = re.compile(r"\(\s*(?:kg/m[2²]|[a-z%]+)\s*\)", re.IGNORECASE)
+# A table cell followed by its normal range
+RANGE_CELL = re.compile(rf"^\W*({VALUE})\s*[a-z%]*\s*\(\s*{VALUE}\s*[~-]\s*{VALUE}\s*\)", re.IGNORECASE)
+SCORE_CELL = re.compile(rf"^\W*({VALUE})\s*/\s*100\b")
+# Fewest numbers on a bar chart line: its scale ticks plus the value
+SCALE_MIN_NUMBERS = 5
+
+# Label templates shared by the layouts; a layout may override any of them
+FIELD_PATTERNS = {
+    "weight": r"\bweight\b",
+    "height": r"\bheight\b",
+    "body_fat_percentage": r"(?:\bPBF\b|percent\s+body\s+fat)",
+    "body_fat_mass": r"body\s+fat\s+mass",
+    "muscle_mass": r"(?:skeletal\s+muscle\s+mass|\bSMM\b)",
+    "fat_free_mass": r"fat\s+free\s+mass",
+    "bmi": r"(?:\bBMI\b|body\s+mass\s+index)",
+    "basal_metabolic_rate": r"(?:basal\s+metabolic\s+rate|\bBMR\b)",
+    "protein": r"\bprotein\b",
+    "minerals": r"\bminerals?\b",
+    "body_water": r"total\s+body\s+water",
+    "visceral_fat_level": r"visceral\s+fat\s+level",
+    "waist_hip_ratio": r"waist[\s-]+hip\s+ratio",
+    "obesity_degree": r"obesity\s+degree",
+    "inbody_score": r"inbody\s+score",
+}
+
+# Plausible adult values; anything outside is treated as an OCR misread
+FIELD_RANGES = {
+    "weight": (20, 300),
+    "height": (100, 230),
+    "body_fat_percentage": (2, 75),
+    "body_fat_mass": (1, 200),
+    "muscle_mass": (5, 120),
+    "fat_free_mass": (15, 200),
+    "bmi": (10, 80),
+    "basal_metabolic_rate": (600, 4500),
+    "protein": (2, 40),
+    "minerals": (0.5, 15),
+    "body_water": (10, 120),
+    "visceral_fat_level": (1, 30),
+    "waist_hip_ratio": (0.5, 1.5),
+    "obesity_degree": (50, 300),
+    "inbody_score": (20, 120),
+}
+
+INTEGER_FIELDS = {"metabolic_age", "inbody_score"}
+REQUIRED_FIELDS = ["weight", "body_fat_percentage", "muscle_mass"]
+
+
+@dataclass
+class Layout:
+    name: str
+    markers: List[str]
+    expected: List[str]
+    patterns: Dict[str, str] = field(default_factory=dict)
+
+    def pattern(self, name: str) -> str:
+        return self.patterns.get(name, FIELD_PATTERNS[name])
+
+
+LAYOUTS = [
+    Layout(
+        name="inbody_770",
+        markers=[r"inbody\s*770", r"\bECW\s*/\s*TBW\b"],
+        expected=["weight", "height", "body_fat_percentage", "body_fat_mass", "muscle_mass", "fat_free_mass", "bmi",
+                  "basal_metabolic_rate", "protein", "minerals", "body_water", "visceral_fat_level", "inbody_score"],
+    ),
+    Layout(
+        name="inbody_570",
+        markers=[r"inbody\s*570"],
+        expected=["weight", "height", "body_fat_percentage", "body_fat_mass", "muscle_mass", "fat_free_mass", "bmi",
+                  "basal_metabolic_rate", "protein", "minerals", "body_water", "visceral_fat_level", "inbody_score"],
+    ),
+    Layout(
+        name="inbody_270",
+        markers=[r"inbody\s*2[3-7]0"],
+        expected=["weight", "height", "body_fat_percentage", "body_fat_mass", "muscle_mass", "fat_free_mass", "bmi",
+                  "basal_metabolic_rate", "protein", "minerals", "body_water", "inbody_score"],
+    ),
+    Layout(
+        name="inbody_generic",
+        markers=[r"\binbody\b", r"body\s+composition\s+analysis"],
+        expected=["weight", "body_fat_percentage", "body_fat_mass", "muscle_mass", "bmi"],
+    ),
+]
+
+
+@dataclass
+class OcrLine:
+    text: str
+    confidence: float
+
+
+@dataclass
+class OcrExtraction:
+    layout: str
+    fields: Dict[str, float]
+    confidence: float
+    # Values read but not verified; the vision agent reads these
+    unverified: List[str] = field(default_factory=list)
+
+    @property
+    def accepted(self) -> bool:
+        return self.confidence >= OCR_MIN_CONFIDENCE and not self.unverified
+
+
+def parse_tsv(tsv: str) -> List[OcrLine]:
+    """Group tesseract TSV words into lines with their mean word confidence"""
+    lines: Dict[Tuple[str, str, str], List[Tuple[str, float]]] = {}
+    for row in csv.DictReader(StringIO(tsv), delimiter="\t", quoting=csv.QUOTE_NONE):
+        text = (row.get("text") or "").strip()
+        try:
+            confidence = float(row.get("conf") or -1)
+        except ValueError:
+            continue
+        if not text or confidence < 0:
+            continue
+        key = (row["block_num"], row["par_num"], row["line_num"])
+        lines.setdefault(key, []).append((text, confidence))
+    return [
+        OcrLine(" ".join(word for word, _ in words), sum(conf for _, conf in words) / len(words))
+        for words in lines.values()
+    ]
+
+
+def detect_layout(lines: List[OcrLine]) -> Optional[Layout]:
+    text = "\n".join(line.text for line in lines)
+    for layout in LAYOUTS:
+        if any(re.search(marker, text, re.IGNORECASE) for marker in layout.markers):
+            return layout
+    return None
+
+
+def _number(text: str) -> float:
+    return float(text.replace(",", "."))
+
+
+def _irregularity(ticks: List[float]) -> float:
+    gaps = [b - a for a, b in zip(ticks, ticks[1:])]
+    median = sorted(gaps)[len(gaps) // 2]
+    return round(sum(abs(gap - median) for gap in gaps), 6)
+
+
+def _scale_value(numbers: List[float]) -> Optional[float]:
+    """
+    The value of a bar chart line: the number off its ascending scale. A
+    value next to a tick ("33.0 38.0 38.4 43.0") could be either of them:
+    ticks are whole or half numbers, and failing that they are the numbers
+    that leave the more regular scale.
+    """
+    candidates = {}
+    for i in range(len(numbers)):
+        rest = numbers[:i] + numbers[i + 1:]
+        if all(a < b for a, b in zip(rest, rest[1:])):
+            tick = numbers[i] * 2 % 1 == 0
+            candidates.setdefault((tick, _irregularity(rest)), set()).add(numbers[i])
+    if not candidates:
+        return None
+    values = candidates[min(candidates)]
+    return values.pop() if len(values) == 1 else None
+
+
+def read_value(text: str) -> Optional[Tuple[float, bool]]:
+    """Value after a field label and whether it was read from a value column"""
+    text = UNIT.sub(" ", text)
+    for cell in (RANGE_CELL, SCORE_CELL):
+        match = cell.search(text)
+        if match:
+            return _number(match.group(1)), True
+    numbers = [_number(number) for number in re.findall(VALUE, text)]
+    if len(numbers) >= SCALE_MIN_NUMBERS and not re.search(r"[a-z]{2}", text, re.IGNORECASE):
+        value = _scale_value(numbers)
+        return (value, True) if value is not None else None
+    match = re.match(NUMBER, text)
+    return (_number(match.group(1)), False) if match else None
+
+
+def _close(value: float, expected: float, tolerance: float) -> bool:
+    return abs(value - expected) <= tolerance
+
+
+# Relations that hold on every InBody sheet, within the sheet's rounding
+CONSISTENCY_CHECKS = [
+    (("bmi", "weight", "height"),
+     lambda f: _close(f["bmi"], f["weight"] / (f["height"] / 100) ** 2, 0.03 * f["bmi"])),
+    (("weight", "body_fat_mass", "fat_free_mass"),
+     lambda f: _close(f["weight"], f["body_fat_mass"] + f["fat_free_mass"], max(0.3, 0.01 * f["weight"]))),
+    (("body_fat_percentage", "body_fat_mass", "weight"),
+     lambda f: _close(f["body_fat_percentage"], 100 * f["body_fat_mass"] / f["weight"], 1.0)),
+    (("fat_free_mass", "body_water", "protein", "minerals"),
+     lambda f: _close(f["fat_free_mass"], f["body_water"] + f["protein"] + f["minerals"], 0.02 * f["fat_free_mass"])),
+    # InBody's BMR is the Katch-McArdle formula on fat-free mass
+    (("basal_metabolic_rate", "fat_free_mass"),
+     lambda f: _close(f["basal_metabolic_rate"], 370 + 21.6 * f["fat_free_mass"], 0.03 * f["basal_metabolic_rate"])),
+]
+
+
+def verify_fields(values: Dict[str, float], anchored: set) -> set:
+    """Fields whose values pass a consistency check, or are anchored and fail none"""
+    passed: Dict[str, int] = {}
+    failed: Dict[str, int] = {}
+    for names, check in CONSISTENCY_CHECKS:
+        if not all(name in values for name in names):
+            continue
+        outcome = passed if check(values) else failed
+        for name in names:
+            outcome[name] = outcome.get(name, 0) + 1
+    return {
+        name for name in values
+        if passed.get(name) or (name in anchored and not failed.get(name))
+    }
+
+
+def extract_fields(lines: List[OcrLine]) -> Optional[OcrExtraction]:
+    """Fill InbodyData fields from OCR lines with the detected layout's templates"""
+    layout = detect_layout(lines)
+    if layout is None:
+        return None
+
+    values: Dict[str, float] = {}
+    anchored = set()
+    confidences: Dict[str, float] = {}
+    for name in layout.expected:
+        regex = re.compile(layout.pattern(name), re.IGNORECASE)
+        low, high = FIELD_RANGES.get(name, (float("-inf"), float("inf")))
+        candidates = []
+        for line in lines:
+            # The value follows the label closest to it ("SMM Skeletal Muscle Mass (kg) ...")
+            labels = list(regex.finditer(line.text))
+            read = read_value(line.text[labels[-1].end():]) if labels else None
+            if read is not None and low <= read[0] <= high:
+                candidates.append((read[1], line.confidence, read[0]))
+        if not candidates:
+            continue
+        # Value columns first, then the most confidently read line
+        is_anchored, confidence, value = max(candidates, key=lambda candidate: candidate[:2])
+        values[name] = int(value) if name in INTEGER_FIELDS else value
+        confidences[name] = confidence / 100
+        if is_anchored:
+            anchored.add(name)
+
+    verified = verify_fields(values, anchored)
+    fields = {name: value for name, value in values.items() if name in verified}
+    unverified = [name for name in values if name not in verified]
+    if not all(name in fields for name in REQUIRED_FIELDS):
+        return OcrExtraction(layout.name, fields, 0.0, unverified)
+    coverage = len(fields) / len(layout.expected)
+    ocr_confidence = sum(confidences[name] for name in fields) / len(fields)
+    return OcrExtraction(layout.name, fields, round(coverage * ocr_confidence, 3), unverified)
+
+
+async def _run_tesseract(image: Image.Image) -> str:
+    buffer = BytesIO()
+    await asyncio.to_thread(image.convert("L").save, buffer, format="PNG")
+    process = await asyncio.create_subprocess_exec(
+        TESSERACT_CMD, "stdin", "stdout", "-l", OCR_LANG, "--psm", "6", "tsv",
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(buffer.getvalue()), OCR_TIMEOUT)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        raise
+    if process.returncode != 0:
+        raise RuntimeError(stderr.decode("utf-8", "replace").strip())
+    return stdout.decode("utf-8", "replace")
+
+
+async def extract_inbody_fields(image: Image.Image) -> Optional[OcrExtraction]:
+    """Local OCR extraction of an InBody sheet; None when unavailable, failed or the layout is unknown"""
+    if not OCR_ENABLED or not TESSERACT_CMD:
+        return None
+    start = time.monotonic()
+    try:
+        async with _semaphore:
+            tsv = await _run_tesseract(image)
+        extraction = await asyncio.to_thread(extract_fields, parse_tsv(tsv))
+    except Exception as e:
+        print(f"Error in local InBody OCR, falling back to the vision agent: {e}")
+        ocr_extractions.inc(layout="unknown", outcome="failed")
+        return None
+    ocr_seconds.observe(time.monotonic() - start)
+    if extraction is None:
+        ocr_extractions.inc(layout="unknown", outcome="low_confidence")
+        return None
+    ocr_extractions.inc(layout=extraction.layout, outcome="accepted" if extraction.accepted else "low_confidence")
+    return extraction
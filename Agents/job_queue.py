@@ -0,0 +1,432 @@
+"""
+Job Queue - Persistent background jobs for long-running workflows
+
+/create_complete_plan held the HTTP connection open for the whole
+multi-minute agent run, tying up worker slots and failing behind proxies
+with 60s timeouts. Long runs can now be submitted as jobs:
+- POST enqueues the job in the JobStore and returns its id immediately
+- a pool of background workers (started in the app lifespan) claims queued
+  jobs and runs the registered handler
+- GET reads status, step progress and result back from the store
+
+Two stores implement the same interface (JOB_STORE_BACKEND):
+- "sqlite" (default, local runs and tests): data/jobs.sqlite3, shared by the
+  uvicorn workers of one host. On Cloud Run / Azure Container Apps the
+  filesystem belongs to one instance and is lost when it stops, so a job
+  submitted to one instance can't be read from another: use Firestore there.
+- "firestore": the JOB_FIRESTORE_COLLECTION collection of the app's Firebase
+  project, shared by every instance and kept across restarts
+The store is opened on first use (the app lifespan); when it can't be opened,
+job endpoints report that jobs are unavailable and the rest of the app runs
+normally. A running job holds a lease that its worker renews; a job whose
+lease expires (its worker died) is queued again, up to JOB_MAX_ATTEMPTS runs.
+
+Configuration (environment variables):
+- JOB_WORKERS: background workers per process, 0 disables them (default 2)
+- JOB_STORE_BACKEND: "sqlite" or "firestore" (default "sqlite")
+- JOB_STORE_PATH: SQLite path (default data/jobs.sqlite3)
+- JOB_FIRESTORE_COLLECTION: Firestore collection of the jobs (default "background_jobs")
+- JOB_POLL_INTERVAL: seconds between polls of an idle worker (default 1)
+- JOB_LEASE_SECONDS: lease of a running job, renewed every third (default 120)
+- JOB_MAX_ATTEMPTS: runs before a job whose worker keeps dying fails (default 2)
+- JOB_RETENTION_HOURS: finished jobs are deleted after this (default 72)
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from fastapi.encoders import jsonable_encoder
+
+from Agents.metrics import Counter, Gauge, Histogram
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+JOB_STORE_BACKEND = os.environ.get("JOB_STORE_BACKEND", "sqlite").lower()
+JOB_STORE_PATH = os.environ.get("JOB_STORE_PATH", os.path.join("data", "jobs.sqlite3"))
+JOB_FIRESTORE_COLLECTION = os.environ.get("JOB_FIRESTORE_COLLECTION", "background_jobs")
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", "1"))
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", "120"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "2"))
+JOB_RETENTION = float(os.environ.get("JOB_RETENTION_HOURS", "72")) * 3600
+# Unfinished jobs a Firestore claim looks at (oldest first); enough for the queue depths we run
+FIRESTORE_CLAIM_SCAN = 50
+ABANDONED_ERROR = "Worker stopped while running the job"
+
+jobs_total = Counter("nutrifit_jobs_total", "Background jobs by kind and final status")
+jobs_running = Gauge("nutrifit_jobs_running", "Background jobs running in this process")
+job_seconds = Histogram("nutrifit_job_seconds", "Background job run time by kind")
+job_queue_seconds = Histogram("nutrifit_job_queue_seconds", "Time background jobs waited in the queue by kind")
+
+# handler(payload, report_steps) -> result dict; a result with status "error" fails the job
+JobHandler = Callable[[dict, Callable[[list], None]], Awaitable[dict]]
+_handlers: Dict[str, JobHandler] = {}
+
+
+def register_job_handler(kind: str, handler: JobHandler) -> None:
+    _handlers[kind] = handler
+
+
+class JobStore:
+    """
+    Store of background jobs. Backends implement the blocking _create,
+    _claim, _update, _get and _purge; the async API runs them in a thread.
+    """
+
+    def _create(self, kind: str, payload: dict) -> str:
+        raise NotImplementedError
+
+    def _claim(self) -> Optional[dict]:
+        raise NotImplementedError
+
+    def _update(self, job_id: str, **fields) -> None:
+        raise NotImplementedError
+
+    def _get(self, job_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def _purge(self) -> None:
+        raise NotImplementedError
+
+    async def create(self, kind: str, payload: dict) -> str:
+        return await asyncio.to_thread(self._create, kind, payload)
+
+    async def claim(self) -> Optional[dict]:
+        return await asyncio.to_thread(self._claim)
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        return await asyncio.to_thread(self._get, job_id)
+
+    async def renew(self, job_id: str) -> None:
+        await asyncio.to_thread(self._update, job_id, lease_until=time.time() + JOB_LEASE_SECONDS)
+
+    async def set_steps(self, job_id: str, steps: list) -> None:
+        await asyncio.to_thread(self._update, job_id, steps=json.dumps(jsonable_encoder(steps)))
+
+    async def finish(self, job_id: str, status: str, result: Optional[dict] = None, error: Optional[str] = None) -> None:
+        await asyncio.to_thread(
+            self._update, job_id, status=status, result=json.dumps(jsonable_encoder(result)) if result is not None else None,
+            error=error, lease_until=None,
+        )
+
+    async def purge(self) -> None:
+        await asyncio.to_thread(self._purge)
+
+
+class SQLiteJobStore(JobStore):
+    """SQLite store of background jobs, shared by the workers of one host"""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, payload TEXT NOT NULL, "
+                "steps TEXT, result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0, "
+                "lease_until REAL, created_at REAL NOT NULL, started_at REAL, updated_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def _create(self, kind: str, payload: dict) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, status, payload, created_at, updated_at) VALUES (?, ?, 'queued', ?, ?, ?)",
+                (job_id, kind, json.dumps(payload), now, now),
+            )
+        return job_id
+
+    def _claim(self) -> Optional[dict]:
+        """Atomically move the oldest queued (or abandoned) job to running"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, updated_at = ? "
+                "WHERE status = 'running' AND lease_until < ? AND attempts >= ?",
+                (ABANDONED_ERROR, now, now, JOB_MAX_ATTEMPTS),
+            )
+            row = conn.execute(
+                "SELECT id, kind, payload, created_at FROM jobs "
+                "WHERE status = 'queued' OR (status = 'running' AND lease_until < ?) "
+                "ORDER BY created_at LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_until = ?, "
+                "started_at = ?, updated_at = ? WHERE id = ?",
+                (now + JOB_LEASE_SECONDS, now, now, row[0]),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return {"id": row[0], "kind": row[1], "payload": json.loads(row[2]), "created_at": row[3]}
+
+    def _update(self, job_id: str, **fields) -> None:
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def _get(self, job_id: str) -> Optional[dict]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT id, kind, status, steps, result, error, attempts, created_at, started_at, updated_at "
+                "FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "job_id": row[0],
+            "kind": row[1],
+            "status": row[2],
+            "workflow_steps": json.loads(row[3]) if row[3] else [],
+            "result": json.loads(row[4]) if row[4] else None,
+            "error": row[5],
+            "attempts": row[6],
+            "created_at": row[7],
+            "started_at": row[8],
+            "updated_at": row[9],
+        }
+
+    def _purge(self) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN ('completed', 'failed') AND updated_at < ?",
+                (time.time() - JOB_RETENTION,),
+            )
+
+
+class FirestoreJobStore(JobStore):
+    """Firestore store of background jobs, shared by every instance of the app"""
+
+    def __init__(self, collection: str):
+        from Agents.firebase_plans import get_firestore_client
+
+        self._db = get_firestore_client()
+        self._jobs = self._db.collection(collection)
+
+    def _create(self, kind: str, payload: dict) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._jobs.document(job_id).set({
+            "kind": kind, "status": "queued", "payload": json.dumps(payload), "steps": None, "result": None,
+            "error": None, "attempts": 0, "lease_until": None, "created_at": now, "started_at": None, "updated_at": now,
+        })
+        return job_id
+
+    def _try_claim(self, ref, now: float) -> Optional[dict]:
+        from google.cloud import firestore
+
+        @firestore.transactional
+        def claim(transaction):
+            job = ref.get(transaction=transaction).to_dict()
+            if job is None:
+                return None
+            abandoned = job["status"] == "running" and (job.get("lease_until") or 0) < now
+            if abandoned and job["attempts"] >= JOB_MAX_ATTEMPTS:
+                transaction.update(ref, {"status": "failed", "error": ABANDONED_ERROR, "updated_at": now})
+                return None
+            if job["status"] != "queued" and not abandoned:
+                return None
+            transaction.update(ref, {
+                "status": "running", "attempts": job["attempts"] + 1, "lease_until": now + JOB_LEASE_SECONDS,
+                "started_at": now, "updated_at": now,
+            })
+            return {"id": ref.id, "kind": job["kind"], "payload": json.loads(job["payload"]), "created_at": job["created_at"]}
+
+        return claim(self._db.transaction())
+
+    def _claim(self) -> Optional[dict]:
+        """Claim the oldest queued (or abandoned) job in a transaction, so only one worker gets it"""
+        now = time.time()
+        # An equality filter plus ordering would need a composite index: sort here instead
+        unfinished = self._jobs.where("status", "in", ["queued", "running"]).limit(FIRESTORE_CLAIM_SCAN).stream()
+        for snapshot in sorted(unfinished, key=lambda snapshot: snapshot.get("created_at")):
+            job = self._try_claim(snapshot.reference, now)
+            if job is not None:
+                return job
+        return None
+
+    def _update(self, job_id: str, **fields) -> None:
+        fields["updated_at"] = time.time()
+        self._jobs.document(job_id).update(fields)
+
+    def _get(self, job_id: str) -> Optional[dict]:
+        job = self._jobs.document(job_id).get().to_dict()
+        if job is None:
+            return None
+        return {
+            "job_id": job_id,
+            "kind": job["kind"],
+            "status": job["status"],
+            "workflow_steps": json.loads(job["steps"]) if job.get("steps") else [],
+            "result": json.loads(job["result"]) if job.get("result") else None,
+            "error": job.get("error"),
+            "attempts": job["attempts"],
+            "created_at": job["created_at"],
+            "started_at": job.get("started_at"),
+            "updated_at": job["updated_at"],
+        }
+
+    def _purge(self) -> None:
+        expired = self._jobs.where("updated_at", "<", time.time() - JOB_RETENTION).limit(500).stream()
+        batch = self._db.batch()
+        for snapshot in expired:
+            if snapshot.get("status") in ("completed", "failed"):
+                batch.delete(snapshot.reference)
+        batch.commit()
+
+
+_store: Optional[JobStore] = None
+_store_error: Optional[str] = None
+
+
+def get_job_store() -> Optional[JobStore]:
+    """The process's JobStore, opened on first use; None when it can't be opened"""
+    global _store, _store_error
+    if _store is None and _store_error is None:
+        try:
+            if JOB_STORE_BACKEND == "firestore":
+                _store = FirestoreJobStore(JOB_FIRESTORE_COLLECTION)
+            else:
+                _store = SQLiteJobStore(JOB_STORE_PATH)
+        except Exception as e:
+            _store_error = str(e)
+            print(f"Job store ({JOB_STORE_BACKEND}) unavailable, background jobs disabled: {e}")
+    return _store
+
+
+class JobWorkerPool:
+    """Background workers that claim jobs from the store and run their handlers"""
+
+    def __init__(self, store: JobStore, workers: int):
+        self.store = store
+        self.workers = workers
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._work(index)) for index in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _keep_lease(self, job_id: str) -> None:
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            try:
+                await self.store.renew(job_id)
+            except Exception as e:
+                print(f"Error renewing lease of background job {job_id}: {e}")
+
+    async def _work(self, index: int) -> None:
+        if index == 0:
+            try:
+                await self.store.purge()
+            except Exception as e:
+                print(f"Error purging finished background jobs: {e}")
+        while True:
+            try:
+                job = await self.store.claim()
+            except Exception as e:
+                print(f"Error claiming background job: {e}")
+                job = None
+            if job is None:
+                await asyncio.sleep(JOB_POLL_INTERVAL)
+                continue
+            try:
+                await self._run(job)
+            except Exception as e:
+                # Keep the worker alive; the job's lease expires and it is retried
+                print(f"Error finishing background job {job['id']}: {e}")
+
+    async def _run(self, job: dict) -> None:
+        job_id, kind = job["id"], job["kind"]
+        job_queue_seconds.observe(time.time() - job["created_at"], kind=kind)
+        handler = _handlers.get(kind)
+        if handler is None:
+            await self.store.finish(job_id, "failed", error=f"No handler for job kind '{kind}'")
+            jobs_total.inc(kind=kind, status="failed")
+            return
+
+        pending_steps: Dict[str, list] = {}
+
+        def report_steps(steps: list) -> None:
+            # Only the latest snapshot matters; written by the flusher below
+            pending_steps["latest"] = steps
+
+        async def flush_steps() -> None:
+            while True:
+                await asyncio.sleep(1)
+                steps = pending_steps.pop("latest", None)
+                if steps is not None:
+                    try:
+                        await self.store.set_steps(job_id, steps)
+                    except Exception as e:
+                        print(f"Error saving steps of background job {job_id}: {e}")
+
+        lease = asyncio.create_task(self._keep_lease(job_id))
+        flusher = asyncio.create_task(flush_steps())
+        jobs_running.inc()
+        start = time.monotonic()
+        try:
+            result = await handler(job["payload"], report_steps)
+            status = "failed" if result.get("status") == "error" else "completed"
+            error = (result.get("error") or result.get("message")) if status == "failed" else None
+        except asyncio.CancelledError:
+            # Shutting down: the lease expires and another worker picks the job up again
+            raise
+        except Exception as e:
+            print(f"Error running background job {job_id}: {e}")
+            result, status, error = None, "failed", str(e)
+        finally:
+            lease.cancel()
+            flusher.cancel()
+            jobs_running.dec()
+        job_seconds.observe(time.monotonic() - start, kind=kind)
+        if result is not None and result.get("workflow_steps") is not None:
+            await self.store.set_steps(job_id, result["workflow_steps"])
+        await self.store.finish(job_id, status, result=result, error=error)
+        jobs_total.inc(kind=kind, status=status)
+
+
+_pool: Optional[JobWorkerPool] = None
+
+
+def start_job_workers() -> None:
+    global _pool
+    if JOB_WORKERS <= 0 or _pool is not None:
+        return
+    store = get_job_store()
+    if store is not None:
+        _pool = JobWorkerPool(store, JOB_WORKERS)
+        _pool.start()
+
+
+async def stop_job_workers() -> None:
+    global _pool
+    if _pool is not None:
+        await _pool.stop()
+        _pool = None
@@ -0,0 +1,363 @@
+"""
+LLM Cache - Content-addressed cache for model responses
+
+Retries from the mobile app, the summarizer re-summarizing the same last plan
+and re-submitted InBody images used to cost a full LLM round trip each time.
+CachedChatCompletionClient wraps a model client and keys every request on:
+- the model name
+- the serialized messages (including the agent's system message)
+- the tools and the output_content_type JSON schema
+
+An answer is stored only when the keyed model served it: when escalation
+or failover moved the call to another model, storing it under the first
+model's key would replay (and report) it as that model's answer.
+
+Only agents whose answers are safe to replay are cached (the InBody
+extraction, the evaluators and the summarizer). The plan generators are not:
+a user who regenerates a plan must get a new one.
+
+Results live in a two-tier cache:
+1. In-memory LRU with TTL (per worker, always on)
+2. Optional shared tier: SQLite on disk or Redis (docker-compose provisions Redis)
+
+Configuration (environment variables):
+- LLM_CACHE_ENABLED: "false" disables the cache (default "true")
+- LLM_CACHE_AGENTS: comma-separated agents whose calls are cached
+  (default "inbody_specialist,evaluator,gym_evaluator,summarizer")
+- LLM_CACHE_MAX_ENTRIES: in-memory LRU size (default 512)
+- LLM_CACHE_TTL: entry lifetime in seconds (default 86400)
+- LLM_CACHE_BACKEND: "memory", "disk" or "redis" (default "memory")
+- LLM_CACHE_PATH: SQLite file for the disk tier (default data/llm_cache.sqlite3)
+- REDIS_URL: Redis connection URL for the redis tier (default redis://redis:6379/0)
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+from autogen_core.models import CreateResult, RequestUsage
+from pydantic import BaseModel
+
+from Agents.call_policy import is_valid_result
+from Agents.metrics import Counter
+from Agents.model_clients import DelegatingChatCompletionClient, model_name
+from Agents.usage_tracking import served_models
+
+REDIS_URL = os.environ.get("REDIS_URL", "redis://redis:6379/0")
+
+cache_requests = Counter("nutrifit_cache_requests_total", "Cache lookups by namespace, result and tier")
+
+_caches: List["TieredCache"] = []
+
+
+class MemoryCacheTier:
+    """Per-process LRU cache with TTL expiry"""
+
+    name = "memory"
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DiskCacheTier:
+    """SQLite cache shared by every worker on the host and kept across restarts, opened on first use"""
+
+    name = "disk"
+
+    def __init__(self, path: str, namespace: str, ttl: float):
+        self.path = path
+        self.namespace = namespace
+        self.ttl = ttl
+        self._opened = False
+        self._error: Optional[str] = None
+
+    def _open(self) -> bool:
+        """Create the file on first use (not at import); False when its path is unusable"""
+        if self._opened or self._error is not None:
+            return self._opened
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with self._connect() as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS cache ("
+                    "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL NOT NULL, "
+                    "PRIMARY KEY (namespace, key))"
+                )
+            self._opened = True
+        except Exception as e:
+            self._error = str(e)
+            print(f"{self.namespace} cache falling back to memory only, disk tier unavailable at {self.path}: {e}")
+        return self._opened
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _get(self, key: str) -> Optional[str]:
+        if not self._open():
+            return None
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+                (self.namespace, key),
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < time.time():
+                conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key))
+                return None
+            return row[0]
+
+    def _set(self, key: str, value: str) -> None:
+        if not self._open():
+            return
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (self.namespace, key, value, time.time() + self.ttl),
+            )
+
+    async def get(self, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: str) -> None:
+        await asyncio.to_thread(self._set, key, value)
+
+    async def close(self) -> None:
+        pass
+
+
+class RedisCacheTier:
+    """Redis cache shared by every worker and container"""
+
+    name = "redis"
+
+    def __init__(self, url: str, namespace: str, ttl: float):
+        import redis.asyncio as redis  # optional dependency
+
+        self.namespace = namespace
+        self.ttl = ttl
+        self._redis = redis.from_url(url)
+
+    def _key(self, key: str) -> str:
+        return f"nutrifit:{self.namespace}:{key}"
+
+    async def get(self, key: str) -> Optional[str]:
+        value = await self._redis.get(self._key(key))
+        if value is None:
+            return None
+        return value.decode("utf-8") if isinstance(value, bytes) else value
+
+    async def set(self, key: str, value: str) -> None:
+        await self._redis.set(self._key(key), value, ex=int(self.ttl))
+
+    async def close(self) -> None:
+        await self._redis.aclose()
+
+
+class TieredCache:
+    """In-memory LRU in front of an optional shared (disk/Redis) tier"""
+
+    def __init__(self, namespace: str, memory: MemoryCacheTier, shared=None):
+        self.namespace = namespace
+        self.memory = memory
+        self.shared = shared
+
+    async def get(self, key: str) -> Optional[str]:
+        value = self.memory.get(key)
+        if value is not None:
+            cache_requests.inc(namespace=self.namespace, result="hit", tier=self.memory.name)
+            return value
+        if self.shared is not None:
+            try:
+                value = await self.shared.get(key)
+            except Exception as e:
+                print(f"Error reading {self.namespace} cache: {e}")
+                value = None
+            if value is not None:
+                self.memory.set(key, value)
+                cache_requests.inc(namespace=self.namespace, result="hit", tier=self.shared.name)
+                return value
+        cache_requests.inc(namespace=self.namespace, result="miss", tier="")
+        return None
+
+    async def set(self, key: str, value: str) -> None:
+        self.memory.set(key, value)
+        if self.shared is not None:
+            try:
+                await self.shared.set(key, value)
+            except Exception as e:
+                print(f"Error writing {self.namespace} cache: {e}")
+
+    async def close(self) -> None:
+        if self.shared is not None:
+            await self.shared.close()
+
+    def stats(self) -> dict:
+        hits = sum(
+            cache_requests.value(namespace=self.namespace, result="hit", tier=tier)
+            for tier in ("memory", "disk", "redis")
+        )
+        misses = cache_requests.value(namespace=self.namespace, result="miss", tier="")
+        return {
+            "namespace": self.namespace,
+            "hits": hits,
+            "misses": misses,
+            "memory_entries": len(self.memory),
+            "shared_tier": self.shared.name if self.shared is not None else None,
+        }
+
+
+def build_cache(namespace: str, env_prefix: str, default_backend: str = "memory", default_ttl: float = 86400) -> TieredCache:
+    """Build a TieredCache configured from <env_prefix>_CACHE_* environment variables"""
+    max_entries = int(os.environ.get(f"{env_prefix}_CACHE_MAX_ENTRIES", "512"))
+    ttl = float(os.environ.get(f"{env_prefix}_CACHE_TTL", str(default_ttl)))
+    backend = os.environ.get(f"{env_prefix}_CACHE_BACKEND", default_backend).lower()
+    path = os.environ.get(f"{env_prefix}_CACHE_PATH", os.path.join("data", f"{namespace}_cache.sqlite3"))
+
+    shared = None
+    try:
+        if backend == "disk":
+            shared = DiskCacheTier(path, namespace, ttl)
+        elif backend == "redis":
+            shared = RedisCacheTier(REDIS_URL, namespace, ttl)
+    except Exception as e:
+        print(f"{namespace} cache falling back to memory only, {backend} tier unavailable: {e}")
+
+    cache = TieredCache(namespace, MemoryCacheTier(max_entries, ttl), shared)
+    _caches.append(cache)
+    return cache
+
+
+async def close_caches() -> None:
+    for cache in _caches:
+        try:
+            await cache.close()
+        except Exception as e:
+            print(f"Error closing {cache.namespace} cache: {e}")
+
+
+def _serialize_tool(tool):
+    return tool.schema if hasattr(tool, "schema") else tool
+
+
+def request_cache_key(model: str, messages, **kwargs) -> str:
+    """SHA-256 over everything that determines a model response"""
+    json_output = kwargs.get("json_output")
+    if isinstance(json_output, type) and issubclass(json_output, BaseModel):
+        json_output = json_output.model_json_schema()
+    payload = {
+        "model": model,
+        "messages": [message.model_dump(mode="json") for message in messages],
+        "tools": [_serialize_tool(tool) for tool in kwargs.get("tools", [])],
+        "tool_choice": str(kwargs.get("tool_choice", "auto")),
+        "json_output": json_output,
+        "extra_create_args": dict(kwargs.get("extra_create_args", {})),
+    }
+    serialized = json.dumps(payload, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+class CachedChatCompletionClient(DelegatingChatCompletionClient):
+    """Serve repeated model requests from a TieredCache instead of the provider"""
+
+    def __init__(self, client, cache: TieredCache):
+        super().__init__(client)
+        self._cache = cache
+
+    async def _lookup(self, key: str) -> Optional[CreateResult]:
+        cached = await self._cache.get(key)
+        if cached is None:
+            return None
+        try:
+            result = CreateResult.model_validate_json(cached)
+        except Exception:
+            return None
+        result.cached = True
+        result.usage = RequestUsage(prompt_tokens=0, completion_tokens=0)
+        return result
+
+    async def _store(self, key: str, result: CreateResult, json_output=None) -> None:
+        # Only complete text answers that pass validation are worth replaying;
+        # a cached malformed plan would turn every retry into the same failure
+        if (
+            result.finish_reason == "stop"
+            and isinstance(result.content, str)
+            and is_valid_result(result, json_output)
+        ):
+            await self._cache.set(key, result.model_dump_json())
+
+    async def create(self, messages, **kwargs):
+        model = model_name(self._client)
+        key = request_cache_key(model, messages, **kwargs)
+        cached = await self._lookup(key)
+        if cached is not None:
+            return cached
+        with served_models() as served:
+            result = await self._client.create(messages, **kwargs)
+        if served.get(id(result)) == model:
+            await self._store(key, result, kwargs.get("json_output"))
+        return result
+
+    async def create_stream(self, messages, **kwargs):
+        model = model_name(self._client)
+        key = request_cache_key(model, messages, **kwargs)
+        cached = await self._lookup(key)
+        if cached is not None:
+            yield cached.content
+            yield cached
+            return
+        with served_models() as served:
+            async for chunk in self._client.create_stream(messages, **kwargs):
+                if isinstance(chunk, CreateResult) and served.get(id(chunk)) == model:
+                    await self._store(key, chunk, kwargs.get("json_output"))
+                yield chunk
+
+
+llm_response_cache = build_cache("llm", "LLM")
+LLM_CACHE_ENABLED = os.environ.get("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_AGENTS = {
+    agent.strip()
+    for agent in os.environ.get("LLM_CACHE_AGENTS", "inbody_specialist,evaluator,gym_evaluator,summarizer").split(",")
+    if agent.strip()
+}
+
+
+def agent_response_cache(agent_name: str) -> Optional[TieredCache]:
+    """The response cache for an agent's calls, or None when they must not be replayed"""
+    if LLM_CACHE_ENABLED and agent_name in LLM_CACHE_AGENTS:
+        return llm_response_cache
+    return None
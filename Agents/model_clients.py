@@ -0,0 +1,218 @@
+"""
+Model Clients - Shared chat completion clients for all agents
+
+Every agent factory used to build its own OpenAI/Azure client, so a single
+complete plan opened 6+ HTTP connection pools and paid a TLS handshake for
+each of them. This module keeps one client per (provider, model) for the
+whole process:
+
+- Clients are created on first use (or at app startup) and reused by every agent
+- Each client owns one pooled httpx connection pool sized from the environment
+- All clients are closed together when the app shuts down
+
+Pool configuration (environment variables):
+- MODEL_POOL_MAX_CONNECTIONS: max open connections per client (default 100)
+- MODEL_POOL_MAX_KEEPALIVE: max idle keep-alive connections per client (default 20)
+- MODEL_POOL_KEEPALIVE_EXPIRY: seconds an idle connection is kept (default 30)
+- MODEL_HTTP_TIMEOUT: read/write timeout in seconds (default 600)
+- MODEL_HTTP_CONNECT_TIMEOUT: connect timeout in seconds (default 10)
+"""
+
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+import httpx
+from autogen_core.models import ChatCompletionClient, ModelInfo
+from autogen_ext.models.openai import AzureOpenAIChatCompletionClient, OpenAIChatCompletionClient
+
+POOL_MAX_CONNECTIONS = int(os.environ.get("MODEL_POOL_MAX_CONNECTIONS", "100"))
+POOL_MAX_KEEPALIVE = int(os.environ.get("MODEL_POOL_MAX_KEEPALIVE", "20"))
+POOL_KEEPALIVE_EXPIRY = float(os.environ.get("MODEL_POOL_KEEPALIVE_EXPIRY", "30"))
+HTTP_TIMEOUT = float(os.environ.get("MODEL_HTTP_TIMEOUT", "600"))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("MODEL_HTTP_CONNECT_TIMEOUT", "10"))
+
+GEMINI_MODEL = "gemini-2.5-flash"
+GEMINI_MODEL_INFO = ModelInfo(vision=True, function_calling=True, json_output=True, family="unknown", structured_output=True)
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """Create the pooled HTTP client a model client sends its requests through"""
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=POOL_MAX_KEEPALIVE,
+            keepalive_expiry=POOL_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+    )
+
+
+def _build_gemini_client(model: Optional[str]) -> ChatCompletionClient:
+    return OpenAIChatCompletionClient(
+        model=model or GEMINI_MODEL,
+        api_key=os.environ["GEMINI_API_KEY"],
+        model_info=GEMINI_MODEL_INFO,
+        http_client=create_http_client(),
+    )
+
+
+def _build_azure_client(model: Optional[str]) -> ChatCompletionClient:
+    deployment = model or os.environ["AZURE_OPENAI_DEPLOYMENT"]
+    return AzureOpenAIChatCompletionClient(
+        azure_deployment=deployment,
+        model=deployment,
+        api_version=os.environ["AZURE_OPENAI_API_VERSION"],
+        azure_endpoint=os.environ["AZURE_OPENAI_ENDPOINT"],
+        api_key=os.environ["AZURE_OPENAI_API_KEY"],
+        http_client=create_http_client(),
+    )
+
+
+def _build_fake_client(model: Optional[str]) -> ChatCompletionClient:
+    from Agents.fake_model_client import create_fake_client
+
+    return create_fake_client(model)
+
+
+PROVIDER_BUILDERS = {
+    "gemini": _build_gemini_client,
+    "azure": _build_azure_client,
+    "fake": _build_fake_client,
+}
+
+
+def default_model(provider: str) -> Optional[str]:
+    """Return the model a provider uses when the caller does not name one"""
+    if provider == "gemini":
+        return GEMINI_MODEL
+    if provider == "azure":
+        return os.environ.get("AZURE_OPENAI_DEPLOYMENT")
+    if provider == "fake":
+        return "fake"
+    return None
+
+
+class ModelClientRegistry:
+    """Process-wide pool of model clients keyed by (provider, model)"""
+
+    def __init__(self):
+        self._clients: Dict[Tuple[str, str], ChatCompletionClient] = {}
+        self._lock = threading.Lock()
+
+    def get(self, provider: str, model: Optional[str] = None) -> ChatCompletionClient:
+        """Return the shared client for provider/model, creating it on first use"""
+        if provider not in PROVIDER_BUILDERS:
+            raise ValueError(f"Unknown model provider: {provider}")
+        model = model or default_model(provider)
+        key = (provider, model or "")
+        client = self._clients.get(key)
+        if client is not None:
+            return client
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = PROVIDER_BUILDERS[provider](model)
+                self._clients[key] = client
+        return client
+
+    def open(self, providers) -> None:
+        """Eagerly create the default client of each provider (used at app startup)"""
+        for provider in providers:
+            try:
+                self.get(provider)
+            except Exception as e:
+                print(f"Model client for provider '{provider}' not created: {e}")
+
+    async def close(self) -> None:
+        """Close every pooled client and forget them"""
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            try:
+                await client.close()
+            except Exception as e:
+                print(f"Error closing model client: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "clients": [f"{provider}:{model}" for provider, model in self._clients],
+            "pool": {
+                "max_connections": POOL_MAX_CONNECTIONS,
+                "max_keepalive_connections": POOL_MAX_KEEPALIVE,
+                "keepalive_expiry": POOL_KEEPALIVE_EXPIRY,
+            },
+        }
+
+
+model_client_registry = ModelClientRegistry()
+
+
+def get_model_client(provider: str, model: Optional[str] = None) -> ChatCompletionClient:
+    """Borrow the shared client for provider/model. Callers must not close it."""
+    return model_client_registry.get(provider, model)
+
+
+def open_model_clients(providers=None) -> None:
+    if providers is None:
+        configured = os.environ.get("MODEL_PROVIDER")
+        providers = (configured,) if configured else ("gemini", "azure")
+    model_client_registry.open(providers)
+
+
+async def close_model_clients() -> None:
+    await model_client_registry.close()
+
+
+class DelegatingChatCompletionClient(ChatCompletionClient):
+    """
+    Base class for wrappers that add behaviour around a borrowed model client.
+
+    Everything not overridden is forwarded to the wrapped client. close() is a
+    no-op because the wrapped client belongs to the registry, not to the agent.
+    """
+
+    def __init__(self, client: ChatCompletionClient):
+        self._client = client
+
+    @property
+    def wrapped_client(self) -> ChatCompletionClient:
+        return self._client
+
+    async def create(self, messages, **kwargs):
+        return await self._client.create(messages, **kwargs)
+
+    def create_stream(self, messages, **kwargs):
+        return self._client.create_stream(messages, **kwargs)
+
+    async def close(self) -> None:
+        pass
+
+    def actual_usage(self):
+        return self._client.actual_usage()
+
+    def total_usage(self):
+        return self._client.total_usage()
+
+    def count_tokens(self, messages, **kwargs) -> int:
+        return self._client.count_tokens(messages, **kwargs)
+
+    def remaining_tokens(self, messages, **kwargs) -> int:
+        return self._client.remaining_tokens(messages, **kwargs)
+
+    @property
+    def capabilities(self):
+        return self._client.capabilities
+
+    @property
+    def model_info(self) -> ModelInfo:
+        return self._client.model_info
+
+
+def model_name(client: ChatCompletionClient) -> str:
+    """Best-effort model name of a (possibly wrapped) client"""
+    while isinstance(client, DelegatingChatCompletionClient):
+        client = client.wrapped_client
+    raw_config = getattr(client, "_raw_config", None) or {}
+    return str(raw_config.get("model", type(client).__name__))
@@ -0,0 +1,187 @@
+"""
+Model Failover - Health-weighted routing between providers (Gemini, Azure)
+
+v2 used to be hardwired to Gemini and v1 to Azure, so a degraded provider
+made every request on that API version slow or failing.
+FailoverChatCompletionClient holds one client stack per provider and, for
+each call:
+1. keeps only the providers whose ModelInfo supports what the call needs
+   (vision for image messages, structured_output for output_content_type,
+   json_output, function_calling for tools)
+2. orders them by live health: EWMA latency weighted by EWMA error rate,
+   with a small penalty for non-primary providers to avoid flapping
+3. skips providers whose circuit is open after repeated failures
+4. falls through to the next provider when a call fails
+
+Latency is tracked per call type (the agent making the call): a 60s plan
+generation and a 2s evaluator call are not comparable. A provider with no
+latency sample for a call type is scored as the slowest sampled provider, so
+it never outranks a healthy primary. Only transient errors (timeouts,
+connection errors, 429, 5xx) count against a provider's health; a request the
+provider rejects is still retried elsewhere but says nothing about its health.
+
+Health is tracked per provider for the whole process and exported on /metrics.
+
+Configuration (environment variables):
+- MODEL_FAILOVER_PROVIDERS: comma-separated providers to fail over between,
+  e.g. "gemini,azure" (default: no failover)
+- MODEL_FAILOVER_RETRIES: retries per provider before failing over (default 1)
+- MODEL_FAILOVER_SECONDARY_PENALTY: score multiplier for non-primary providers (default 1.5)
+- MODEL_FAILOVER_CIRCUIT_THRESHOLD: consecutive failures that open a circuit (default 3)
+- MODEL_FAILOVER_CIRCUIT_COOLDOWN: seconds a circuit stays open (default 30)
+"""
+
+import os
+import time
+from typing import Dict, List, Tuple
+
+from autogen_core import Image
+from pydantic import BaseModel
+
+from Agents.call_policy import TRANSIENT_ERRORS
+from Agents.metrics import Gauge
+from Agents.model_clients import DelegatingChatCompletionClient
+
+FAILOVER_PROVIDERS = [p.strip() for p in os.environ.get("MODEL_FAILOVER_PROVIDERS", "").split(",") if p.strip()]
+FAILOVER_RETRIES = int(os.environ.get("MODEL_FAILOVER_RETRIES", "1"))
+SECONDARY_PENALTY = float(os.environ.get("MODEL_FAILOVER_SECONDARY_PENALTY", "1.5"))
+CIRCUIT_THRESHOLD = int(os.environ.get("MODEL_FAILOVER_CIRCUIT_THRESHOLD", "3"))
+CIRCUIT_COOLDOWN = float(os.environ.get("MODEL_FAILOVER_CIRCUIT_COOLDOWN", "30"))
+EWMA_ALPHA = 0.2
+ERROR_WEIGHT = 10.0
+
+provider_latency = Gauge("nutrifit_provider_latency_ewma_seconds", "EWMA model call latency per provider and call type")
+provider_error_rate = Gauge("nutrifit_provider_error_rate_ewma", "EWMA model call error rate per provider")
+provider_circuit_open = Gauge("nutrifit_provider_circuit_open", "1 while a provider's circuit is open")
+
+
+class ProviderHealth:
+    """Live latency/error statistics of one provider"""
+
+    def __init__(self, provider: str):
+        self.provider = provider
+        self.latency: Dict[str, float] = {}
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+
+    def record_success(self, call_type: str, latency: float) -> None:
+        previous = self.latency.get(call_type)
+        self.latency[call_type] = latency if previous is None else EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * previous
+        self.error_rate *= 1 - EWMA_ALPHA
+        self.consecutive_failures = 0
+        provider_latency.set(self.latency[call_type], provider=self.provider, call_type=call_type)
+        provider_error_rate.set(self.error_rate, provider=self.provider)
+        provider_circuit_open.set(0, provider=self.provider)
+
+    def record_failure(self) -> None:
+        self.error_rate = EWMA_ALPHA + (1 - EWMA_ALPHA) * self.error_rate
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= CIRCUIT_THRESHOLD:
+            self.open_until = time.monotonic() + CIRCUIT_COOLDOWN
+            provider_circuit_open.set(1, provider=self.provider)
+        provider_error_rate.set(self.error_rate, provider=self.provider)
+
+    @property
+    def available(self) -> bool:
+        return time.monotonic() >= self.open_until
+
+    def score(self, call_type: str, unknown_latency: float) -> float:
+        latency = self.latency.get(call_type, unknown_latency)
+        return latency * (1 + ERROR_WEIGHT * self.error_rate)
+
+
+_health: Dict[str, ProviderHealth] = {}
+
+
+def provider_health(provider: str) -> ProviderHealth:
+    health = _health.get(provider)
+    if health is None:
+        health = _health[provider] = ProviderHealth(provider)
+    return health
+
+
+def required_capabilities(messages, **kwargs) -> List[str]:
+    """ModelInfo flags a call needs from the backend serving it"""
+    required = []
+    for message in messages:
+        content = getattr(message, "content", None)
+        if isinstance(content, list) and any(isinstance(part, Image) for part in content):
+            required.append("vision")
+            break
+    json_output = kwargs.get("json_output")
+    if isinstance(json_output, type) and issubclass(json_output, BaseModel):
+        required.append("structured_output")
+    elif json_output:
+        required.append("json_output")
+    if kwargs.get("tools"):
+        required.append("function_calling")
+    return required
+
+
+class FailoverChatCompletionClient(DelegatingChatCompletionClient):
+    """Send each call to the healthiest compatible provider, failing over on errors"""
+
+    def __init__(self, backends: List[Tuple[str, object]], call_type: str):
+        super().__init__(backends[0][1])
+        self._backends = backends
+        self._primary = backends[0][0]
+        self.call_type = call_type
+
+    def _candidates(self, messages, **kwargs):
+        required = required_capabilities(messages, **kwargs)
+        compatible = [
+            (provider, client) for provider, client in self._backends
+            if all(client.model_info.get(flag, False) for flag in required)
+        ] or self._backends
+
+        sampled = [
+            provider_health(provider).latency[self.call_type] for provider, _ in compatible
+            if self.call_type in provider_health(provider).latency
+        ]
+        # Unsampled providers count as the slowest known one (1.0 when none is sampled)
+        unknown_latency = max(sampled, default=1.0)
+
+        def rank(backend):
+            health = provider_health(backend[0])
+            penalty = 1.0 if backend[0] == self._primary else SECONDARY_PENALTY
+            return (not health.available, health.score(self.call_type, unknown_latency) * penalty)
+
+        return sorted(compatible, key=rank)
+
+    async def create(self, messages, **kwargs):
+        last_error = None
+        for provider, client in self._candidates(messages, **kwargs):
+            health = provider_health(provider)
+            start = time.monotonic()
+            try:
+                result = await client.create(messages, **kwargs)
+            except Exception as e:
+                if isinstance(e, TRANSIENT_ERRORS):
+                    health.record_failure()
+                last_error = e
+                print(f"Model provider '{provider}' failed, failing over: {e}")
+                continue
+            health.record_success(self.call_type, time.monotonic() - start)
+            return result
+        raise last_error
+
+    async def create_stream(self, messages, **kwargs):
+        candidates = self._candidates(messages, **kwargs)
+        for position, (provider, client) in enumerate(candidates):
+            health = provider_health(provider)
+            start = time.monotonic()
+            yielded = False
+            try:
+                async for chunk in client.create_stream(messages, **kwargs):
+                    yielded = True
+                    yield chunk
+            except Exception as e:
+                if isinstance(e, TRANSIENT_ERRORS):
+                    health.record_failure()
+                if yielded or position == len(candidates) - 1:
+                    raise
+                print(f"Model provider '{provider}' failed, failing over: {e}")
+                continue
+            health.record_success(self.call_type, time.monotonic() - start)
+            return
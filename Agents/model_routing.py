@@ -0,0 +1,156 @@
+"""
+Model Routing - Per-agent model tiers with escalation on failure
+
+The evaluators and the summarizer only emit short text ("approved" or a brief
+summary) yet used the same model as the plan generators. Every agent's model
+is now chosen here, in one place:
+
+- AGENT_MODEL_TIERS maps each agent to a tier ("fast" or "large")
+- each provider maps the tiers to concrete models
+- agents on the fast tier escalate to the large model only when the fast
+  model fails (error, empty answer or unparseable structured output)
+
+build_agent_client() assembles the full client stack an agent borrows:
+cache hit tracking + response cache (optional) -> provider failover (optional)
+-> escalation -> retry policy -> rate limiter -> usage tracking -> pooled
+provider client.
+
+Configuration (environment variables):
+- AGENT_MODEL_TIERS: JSON overrides, e.g. {"evaluator": "large"}
+- MODEL_TIER_FAST_<PROVIDER> / MODEL_TIER_LARGE_<PROVIDER>: model per tier
+  (Gemini defaults: gemini-2.5-flash-lite / gemini-2.5-flash;
+  Azure defaults: AZURE_OPENAI_FAST_DEPLOYMENT / AZURE_OPENAI_DEPLOYMENT)
+- MODEL_ESCALATION_ENABLED: "false" disables escalation to the large model
+"""
+
+import json
+import os
+from typing import List
+
+from Agents.call_policy import MAX_RETRIES, ResilientChatCompletionClient, is_valid_result
+from Agents.llm_cache import CachedChatCompletionClient
+from Agents.metrics import Counter
+from Agents.model_clients import DelegatingChatCompletionClient, default_model, get_model_client
+from Agents.model_failover import FAILOVER_PROVIDERS, FAILOVER_RETRIES, FailoverChatCompletionClient
+from Agents.rate_limiter import RateLimitedChatCompletionClient, get_rate_limiter
+from Agents.usage_tracking import CacheHitTrackingChatCompletionClient, UsageTrackingChatCompletionClient
+
+AGENT_MODEL_TIERS = {
+    "inbody_specialist": "large",
+    "nutritionist": "large",
+    "gym_trainer": "large",
+    "evaluator": "fast",
+    "gym_evaluator": "fast",
+    "summarizer": "fast",
+    **json.loads(os.environ.get("AGENT_MODEL_TIERS", "{}")),
+}
+ESCALATION_ENABLED = os.environ.get("MODEL_ESCALATION_ENABLED", "true").lower() == "true"
+
+DEFAULT_FAST_MODELS = {
+    "gemini": "gemini-2.5-flash-lite",
+    "azure": os.environ.get("AZURE_OPENAI_FAST_DEPLOYMENT"),
+    "fake": "fake-fast",
+}
+
+model_escalations = Counter("nutrifit_model_escalations_total", "Calls escalated from the fast to the large model by agent")
+
+
+def tier_model(provider: str, tier: str):
+    """Model serving a tier for a provider (falls back to the provider's default model)"""
+    env_name = f"MODEL_TIER_{tier.upper()}_{provider.upper()}"
+    if tier == "fast":
+        return os.environ.get(env_name) or DEFAULT_FAST_MODELS.get(provider) or default_model(provider)
+    return os.environ.get(env_name) or default_model(provider)
+
+
+def agent_models(provider: str, agent_name: str) -> List[str]:
+    """Models to try for an agent, in order: its tier's model, then the escalation target"""
+    tier = AGENT_MODEL_TIERS.get(agent_name, "large")
+    models = [tier_model(provider, tier)]
+    if tier != "large" and ESCALATION_ENABLED:
+        large = tier_model(provider, "large")
+        if large not in models:
+            models.append(large)
+    return models
+
+
+class EscalatingChatCompletionClient(DelegatingChatCompletionClient):
+    """Try each client in order and move to the next one only when a call fails"""
+
+    def __init__(self, clients, agent_name: str):
+        super().__init__(clients[0])
+        self._clients = clients
+        self.agent_name = agent_name
+
+    @staticmethod
+    def _usable(result, json_output) -> bool:
+        if isinstance(result.content, str) and not result.content.strip():
+            return False
+        return is_valid_result(result, json_output)
+
+    async def create(self, messages, **kwargs):
+        last_error = None
+        result = None
+        for position, client in enumerate(self._clients):
+            if position:
+                model_escalations.inc(agent=self.agent_name)
+            try:
+                result = await client.create(messages, **kwargs)
+            except Exception as e:
+                last_error = e
+                continue
+            if self._usable(result, kwargs.get("json_output")):
+                return result
+        if result is not None:
+            return result
+        raise last_error
+
+    async def create_stream(self, messages, **kwargs):
+        # Only escalate when the fast model failed before streaming anything
+        for position, client in enumerate(self._clients):
+            if position:
+                model_escalations.inc(agent=self.agent_name)
+            yielded = False
+            try:
+                async for chunk in client.create_stream(messages, **kwargs):
+                    yielded = True
+                    yield chunk
+                return
+            except Exception:
+                if yielded or position == len(self._clients) - 1:
+                    raise
+
+
+def _provider_client(provider: str, agent_name: str, max_retries: int):
+    """Tiered client stack for one agent on one provider"""
+    limiter = get_rate_limiter(provider)
+    clients = [
+        ResilientChatCompletionClient(
+            RateLimitedChatCompletionClient(
+                UsageTrackingChatCompletionClient(get_model_client(provider, model), agent_name), limiter
+            ),
+            max_retries=max_retries,
+        )
+        for model in agent_models(provider, agent_name)
+    ]
+    return clients[0] if len(clients) == 1 else EscalatingChatCompletionClient(clients, agent_name)
+
+
+def build_agent_client(provider: str, agent_name: str, cache=None):
+    """Assemble the client stack for one agent on top of the shared pooled clients"""
+    providers = [provider] + [p for p in FAILOVER_PROVIDERS if p != provider]
+    if len(providers) == 1:
+        client = _provider_client(provider, agent_name, MAX_RETRIES)
+    else:
+        backends = []
+        for candidate in providers:
+            try:
+                backends.append((candidate, _provider_client(candidate, agent_name, FAILOVER_RETRIES)))
+            except Exception as e:
+                print(f"Model provider '{candidate}' unavailable for failover: {e}")
+        if not backends:
+            raise RuntimeError(f"No model provider available for agent '{agent_name}'")
+        client = backends[0][1] if len(backends) == 1 else FailoverChatCompletionClient(backends, agent_name)
+    if cache is not None:
+        client = CacheHitTrackingChatCompletionClient(CachedChatCompletionClient(client, cache), agent_name)
+    return client
@@ -0,0 +1,172 @@
+"""
+Prompt Builder - Compact agent prompts under a per-agent token budget
+
+The plan prompts used to interpolate whole dicts (every InbodyData field,
+including all the None ones), the previous InBody data and the full last-plan
+summary. PromptBuilder instead:
+- drops empty values (None, "", empty lists/dicts) recursively
+- renders flat data as "key=value; key=value" and nested data as compact JSON
+- measures tokens with tiktoken and, when the prompt exceeds the agent's
+  budget, trims the lowest-priority optional sections (history first)
+
+Structured sections are trimmed by dropping whole trailing fields and list
+items (the last one kept may itself be trimmed the same way), so the JSON the
+model sees is always complete; only plain text is cut mid-string.
+
+Budgets (input tokens) are configured with PROMPT_BUDGET_<AGENT>, e.g.
+PROMPT_BUDGET_NUTRITIONIST=6000.
+"""
+
+import json
+import os
+import re
+from functools import lru_cache
+
+DEFAULT_BUDGETS = {
+    "nutritionist": 6000,
+    "gym_trainer": 4000,
+    "summarizer": 8000,
+}
+
+
+def input_budget(agent_name: str) -> int:
+    default = DEFAULT_BUDGETS.get(agent_name, 6000)
+    return int(os.environ.get(f"PROMPT_BUDGET_{agent_name.upper()}", str(default)))
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+def count_tokens(text: str) -> int:
+    encoding = _encoding()
+    if encoding is None:
+        return len(text) // 4
+    return len(encoding.encode(text))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    if max_tokens <= 0:
+        return ""
+    encoding = _encoding()
+    if encoding is None:
+        return text if len(text) <= max_tokens * 4 else text[: max_tokens * 4] + "..."
+    tokens = encoding.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens]) + "..."
+
+
+def compact_value(value):
+    """Drop empty values recursively; pydantic models become plain dicts, numbers are kept exact"""
+    if hasattr(value, "model_dump"):
+        value = value.model_dump()
+    if isinstance(value, dict):
+        compacted = {k: compact_value(v) for k, v in value.items()}
+        return {k: v for k, v in compacted.items() if v not in (None, "", [], {})}
+    if isinstance(value, (list, tuple)):
+        compacted = [compact_value(v) for v in value]
+        return [v for v in compacted if v not in (None, "", [], {})]
+    if isinstance(value, str):
+        return re.sub(r"\s+", " ", value).strip()
+    return value
+
+
+def format_compact(value) -> str:
+    """Render a value in as few tokens as possible"""
+    value = compact_value(value)
+    if value in (None, "", [], {}):
+        return ""
+    if isinstance(value, dict) and all(not isinstance(v, (dict, list)) for v in value.values()):
+        return "; ".join(f"{k}={v}" for k, v in value.items())
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+    return str(value)
+
+
+def _fit_entries(entries, max_tokens: int, rebuild):
+    """Longest prefix of entries (the last one possibly trimmed) whose rendering fits"""
+    def fits(kept):
+        return count_tokens(format_compact(rebuild(kept))) <= max_tokens
+
+    low, high = 0, len(entries)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if fits(entries[:middle]):
+            low = middle
+        else:
+            high = middle - 1
+    kept = list(entries[:low])
+    if low < len(entries):
+        room = max_tokens - count_tokens(format_compact(rebuild(kept))) if kept else max_tokens
+        entry = entries[low]
+        if isinstance(entry, tuple):
+            partial = fit_value(entry[1], room)
+            candidate = kept + [(entry[0], partial)] if partial is not None else None
+        else:
+            partial = fit_value(entry, room)
+            candidate = kept + [partial] if partial is not None else None
+        if candidate is not None and fits(candidate):
+            kept = candidate
+    return rebuild(kept) if kept else None
+
+
+def fit_value(value, max_tokens: int):
+    """
+    Trim a compacted value to max_tokens by dropping whole trailing dict
+    fields and list items; None when nothing fits.
+    """
+    if count_tokens(format_compact(value)) <= max_tokens:
+        return value
+    if isinstance(value, dict):
+        return _fit_entries(list(value.items()), max_tokens, dict)
+    if isinstance(value, list):
+        return _fit_entries(value, max_tokens, list)
+    return truncate_to_tokens(str(value), max_tokens - 1) or None
+
+
+class PromptBuilder:
+    """Assemble "label:value" lines and keep the prompt within a token budget"""
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self._sections = []
+
+    def add(self, label: str, value, priority: int = 0, required: bool = True, default: str = "") -> "PromptBuilder":
+        """
+        Add a section. Optional sections are trimmed first, lowest priority first,
+        when the prompt is over budget; required sections are never trimmed.
+        """
+        value = compact_value(value)
+        text = format_compact(value)
+        if not text:
+            value = text = default
+        if text or required:
+            self._sections.append({"label": label, "value": value, "text": text, "priority": priority, "required": required})
+        return self
+
+    def _render(self, footer: str) -> str:
+        lines = [f"{section['label']}:{section['text']}" for section in self._sections]
+        if footer:
+            lines.append(footer)
+        return "\n".join(lines)
+
+    def build(self, footer: str = "") -> str:
+        prompt = self._render(footer)
+        overflow = count_tokens(prompt) - self.budget
+        if overflow <= 0:
+            return prompt
+        for section in sorted((s for s in self._sections if not s["required"]), key=lambda s: s["priority"]):
+            section_tokens = count_tokens(section["text"])
+            fitted = fit_value(section["value"], section_tokens - overflow)
+            section["text"] = format_compact(fitted) if fitted is not None else ""
+            overflow -= section_tokens - count_tokens(section["text"])
+            if overflow <= 0:
+                break
+        return self._render(footer)
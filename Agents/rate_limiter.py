@@ -0,0 +1,326 @@
+"""
+Rate Limiter - Token-bucket limiter and concurrency governor for model calls
+
+The RoundRobinGroupChat teams fire model calls with no upper bound, so under
+load we used to hit 429 storms and every request slowed down in retries.
+Each provider gets one ProviderRateLimiter per process that:
+- enforces requests/min and tokens/min with token buckets
+- caps the number of in-flight calls with a semaphore
+- queues callers in FIFO order (asyncio.Lock is fair) and records queue wait
+- optionally also counts against a Redis fixed-window budget shared by all workers
+  (a call waiting for the next window leaves the queue meanwhile)
+- gives the reserved tokens back when a call fails or is cancelled
+
+Configuration (environment variables, PROVIDER is GEMINI or AZURE):
+- RATE_LIMIT_<PROVIDER>_RPM: requests per minute, 0 = unlimited (default 1000)
+- RATE_LIMIT_<PROVIDER>_TPM: tokens per minute, 0 = unlimited (default 1000000)
+- RATE_LIMIT_<PROVIDER>_MAX_CONCURRENCY: max in-flight calls (default 16)
+- RATE_LIMIT_BACKEND: "memory" or "redis" for the cross-worker budget (default "memory")
+- RATE_LIMIT_COMPLETION_ESTIMATE: completion tokens reserved per call (default 1024)
+"""
+
+import asyncio
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Tuple
+
+from autogen_core.models import CreateResult
+
+from Agents.metrics import Gauge, Histogram
+from Agents.model_clients import DelegatingChatCompletionClient
+
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory").lower()
+COMPLETION_ESTIMATE = int(os.environ.get("RATE_LIMIT_COMPLETION_ESTIMATE", "1024"))
+REDIS_URL = os.environ.get("REDIS_URL", "redis://redis:6379/0")
+
+queue_wait = Histogram("nutrifit_model_queue_wait_seconds", "Time model calls waited for the rate limiter")
+queue_depth = Gauge("nutrifit_model_queue_depth", "Model calls waiting for the rate limiter")
+inflight_calls = Gauge("nutrifit_model_inflight_calls", "Model calls currently in flight")
+
+
+class TokenBucket:
+    """Refills `per_minute` units every minute; per_minute <= 0 means unlimited"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.capacity <= 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` units are available (0 if available now)"""
+        if self.unlimited:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def consume(self, amount: float) -> None:
+        if not self.unlimited:
+            self._refill()
+            self.level -= amount
+
+    def refund(self, amount: float) -> None:
+        if not self.unlimited:
+            self._refill()
+            self.level = min(self.capacity, self.level + amount)
+
+
+class RedisWindowBudget:
+    """Per-minute request/token budget shared by every worker through Redis"""
+
+    def __init__(self, url: str, provider: str, rpm: int, tpm: int):
+        import redis.asyncio as redis  # optional dependency
+
+        self._redis = redis.from_url(url)
+        self.provider = provider
+        self.rpm = rpm
+        self.tpm = tpm
+
+    def _keys(self, window: int) -> Tuple[str, str]:
+        prefix = f"nutrifit:ratelimit:{self.provider}:{window}"
+        return f"{prefix}:requests", f"{prefix}:tokens"
+
+    def _clamp(self, tokens: int) -> int:
+        # A call larger than the whole budget would otherwise never fit in a window
+        return min(tokens, self.tpm) if self.tpm > 0 else tokens
+
+    async def reserve(self, tokens: int) -> Tuple[bool, Optional[int]]:
+        """
+        Count a request and `tokens` against the current window. Returns
+        (reserved, window); window is None when nothing was counted (Redis
+        unavailable), and reserved is False when the window is spent.
+        """
+        tokens = self._clamp(tokens)
+        window = int(time.time() // 60)
+        requests_key, tokens_key = self._keys(window)
+        try:
+            pipe = self._redis.pipeline()
+            pipe.incrby(requests_key, 1)
+            pipe.incrby(tokens_key, tokens)
+            pipe.expire(requests_key, 120)
+            pipe.expire(tokens_key, 120)
+            used_requests, used_tokens, _, _ = await pipe.execute()
+        except Exception as e:
+            print(f"Shared rate limit unavailable, using local limits only: {e}")
+            return True, None
+        if (self.rpm <= 0 or used_requests <= self.rpm) and (self.tpm <= 0 or used_tokens <= self.tpm):
+            return True, window
+        # Over the shared budget: give the reservation back
+        await self.refund(window, tokens, requests=1)
+        return False, None
+
+    async def refund(self, window: Optional[int], tokens: int, requests: int = 0) -> None:
+        if window is None:
+            return
+        requests_key, tokens_key = self._keys(window)
+        try:
+            if requests:
+                await self._redis.decrby(requests_key, requests)
+            await self._redis.decrby(tokens_key, self._clamp(tokens))
+        except Exception as e:
+            print(f"Error refunding shared rate limit: {e}")
+
+    @staticmethod
+    def next_window() -> float:
+        """Seconds until the next window, jittered so waiting workers don't all retry at once"""
+        return 60 - time.time() % 60 + random.uniform(0, 1)
+
+    async def close(self) -> None:
+        await self._redis.aclose()
+
+
+class ProviderRateLimiter:
+    """Fair FIFO limiter for one provider: RPM + TPM buckets and a concurrency cap"""
+
+    def __init__(self, provider: str, rpm: int, tpm: int, max_concurrency: int, shared_budget=None):
+        self.provider = provider
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_concurrency = max_concurrency
+        self._queue = asyncio.Lock()
+        self._concurrency = asyncio.Semaphore(max_concurrency)
+        self._shared_budget = shared_budget
+        self.queued = 0
+
+    async def _reserve(self, tokens: int) -> Tuple[bool, Optional[int]]:
+        """Take a request and `tokens` from the buckets (and the shared budget), in FIFO order"""
+        async with self._queue:
+            while True:
+                wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            self.requests.consume(1)
+            self.tokens.consume(tokens)
+            if self._shared_budget is None:
+                return True, None
+            reserved, window = await self._shared_budget.reserve(tokens)
+            if not reserved:
+                self.requests.refund(1)
+                self.tokens.refund(tokens)
+            return reserved, window
+
+    async def acquire(self, tokens: int) -> Optional[int]:
+        """Wait for a slot; returns the shared budget window it was counted in, if any"""
+        start = time.monotonic()
+        queue_depth.inc(provider=self.provider)
+        self.queued += 1
+        try:
+            while True:
+                reserved, window = await self._reserve(tokens)
+                if reserved:
+                    break
+                # The shared budget is spent: wait for the next window outside the
+                # queue, so calls behind this one are not held for up to a minute
+                await asyncio.sleep(self._shared_budget.next_window())
+            await self._concurrency.acquire()
+        finally:
+            self.queued -= 1
+            queue_depth.dec(provider=self.provider)
+        queue_wait.observe(time.monotonic() - start, provider=self.provider)
+        return window
+
+    def release(self) -> None:
+        self._concurrency.release()
+
+    @property
+    def congested(self) -> bool:
+        """True when calls are waiting or every concurrency slot is taken"""
+        return self.queued > 0 or self._concurrency.locked()
+
+    async def refund(self, tokens: int, window: Optional[int]) -> None:
+        """Give back the tokens reserved for a call that failed (the request still counts)"""
+        self.tokens.refund(tokens)
+        if self._shared_budget is not None:
+            await self._shared_budget.refund(window, tokens)
+
+    @asynccontextmanager
+    async def slot(self, tokens: int):
+        window = await self.acquire(tokens)
+        inflight_calls.inc(provider=self.provider)
+        try:
+            yield
+        except BaseException:
+            # Also on cancellation (timeouts, losing hedges)
+            await asyncio.shield(self.refund(tokens, window))
+            raise
+        finally:
+            inflight_calls.dec(provider=self.provider)
+            self.release()
+
+    def reconcile(self, estimated: int, usage) -> None:
+        """Correct the token bucket once the real usage of a call is known"""
+        if usage is None:
+            return
+        actual = usage.prompt_tokens + usage.completion_tokens
+        if actual > estimated:
+            self.tokens.consume(actual - estimated)
+        elif actual < estimated:
+            self.tokens.refund(estimated - actual)
+
+    async def close(self) -> None:
+        if self._shared_budget is not None:
+            await self._shared_budget.close()
+
+
+_limiters: Dict[str, ProviderRateLimiter] = {}
+
+
+def get_rate_limiter(provider: str) -> ProviderRateLimiter:
+    """Return the process-wide limiter for a provider, configured from the environment"""
+    limiter = _limiters.get(provider)
+    if limiter is not None:
+        return limiter
+    prefix = f"RATE_LIMIT_{provider.upper()}"
+    rpm = int(os.environ.get(f"{prefix}_RPM", "1000"))
+    tpm = int(os.environ.get(f"{prefix}_TPM", "1000000"))
+    max_concurrency = int(os.environ.get(f"{prefix}_MAX_CONCURRENCY", "16"))
+    shared_budget = None
+    if RATE_LIMIT_BACKEND == "redis":
+        try:
+            shared_budget = RedisWindowBudget(REDIS_URL, provider, rpm, tpm)
+        except Exception as e:
+            print(f"Shared rate limit for '{provider}' unavailable: {e}")
+    limiter = ProviderRateLimiter(provider, rpm, tpm, max_concurrency, shared_budget)
+    _limiters[provider] = limiter
+    return limiter
+
+
+async def close_rate_limiters() -> None:
+    for limiter in _limiters.values():
+        try:
+            await limiter.close()
+        except Exception as e:
+            print(f"Error closing rate limiter for '{limiter.provider}': {e}")
+
+
+class ReservedChatCompletionClient(DelegatingChatCompletionClient):
+    """A call made in a slot already held: skips the queue, corrects the token estimate"""
+
+    def __init__(self, client, limiter: ProviderRateLimiter, estimate: int):
+        super().__init__(client)
+        self._limiter = limiter
+        self._estimate = estimate
+
+    async def create(self, messages, **kwargs):
+        result = await self._client.create(messages, **kwargs)
+        self._limiter.reconcile(self._estimate, result.usage)
+        return result
+
+    async def create_stream(self, messages, **kwargs):
+        async for chunk in self._client.create_stream(messages, **kwargs):
+            if isinstance(chunk, CreateResult):
+                self._limiter.reconcile(self._estimate, chunk.usage)
+            yield chunk
+
+
+class RateLimitedChatCompletionClient(DelegatingChatCompletionClient):
+    """Route every model call through a provider's rate limiter"""
+
+    def __init__(self, client, limiter: ProviderRateLimiter):
+        super().__init__(client)
+        self._limiter = limiter
+
+    @property
+    def congested(self) -> bool:
+        return self._limiter.congested
+
+    def _estimate_tokens(self, messages, **kwargs) -> int:
+        try:
+            prompt_tokens = self._client.count_tokens(messages, tools=kwargs.get("tools", []))
+        except Exception:
+            prompt_tokens = sum(len(str(message.content)) for message in messages) // 4
+        return prompt_tokens + COMPLETION_ESTIMATE
+
+    @asynccontextmanager
+    async def slot(self, messages, **kwargs):
+        """
+        Wait for a slot for this call and yield the client to make it with.
+        Callers timing the call (call_policy) start their clock inside.
+        """
+        estimate = self._estimate_tokens(messages, **kwargs)
+        async with self._limiter.slot(estimate):
+            yield ReservedChatCompletionClient(self._client, self._limiter, estimate)
+
+    async def create(self, messages, **kwargs):
+        async with self.slot(messages, **kwargs) as client:
+            return await client.create(messages, **kwargs)
+
+    async def create_stream(self, messages, **kwargs):
+        async with self.slot(messages, **kwargs) as client:
+            async for chunk in client.create_stream(messages, **kwargs):
+                yield chunk
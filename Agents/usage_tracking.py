@@ -0,0 +1,244 @@
+"""
+Usage Tracking - Per-agent token, cost and latency accounting
+
+Each provider client of an agent's stack (see model_routing) is wrapped in a
+UsageTrackingChatCompletionClient, below escalation, failover and hedging, so
+every call is labelled with the model that actually served it. It captures the
+RequestUsage and latency of each call and:
+- exports them as Prometheus counters/histograms labelled by agent and model
+- records them on the UsageTracker of the current workflow (if any), tagged
+  with the workflow step that was running, so execute_complete_workflow can
+  report tokens/cost/latency per step in its workflow_steps
+
+Calls cancelled before they finished (losing hedges, timeouts) were still
+billed for their prompt: they are recorded with the estimated prompt tokens
+and counted on nutrifit_model_cancelled_calls_total. Answers replayed from
+the response cache never reach a provider client; the
+CacheHitTrackingChatCompletionClient on top of the stack records those.
+
+Both the tracker and the step name travel in context variables, so calls made
+from tasks spawned inside a step (e.g. a RoundRobinGroupChat run) are still
+attributed correctly.
+
+Streamed calls ask the provider to append usage to the stream
+(stream_options.include_usage); OpenAI-compatible APIs report no tokens for a
+stream otherwise. Streams that still end without usage are counted on
+nutrifit_model_missing_usage_total.
+
+Prices (USD per 1M tokens) can be overridden with MODEL_PRICES, a JSON object
+such as {"gemini-2.5-flash": {"input": 0.30, "output": 2.50}}.
+"""
+
+import asyncio
+import json
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from autogen_core.models import CreateResult
+
+from Agents.metrics import Counter, Histogram
+from Agents.model_clients import DelegatingChatCompletionClient, model_name
+
+DEFAULT_MODEL_PRICES = {
+    "gemini-2.5-flash": {"input": 0.30, "output": 2.50},
+    "gemini-2.5-flash-lite": {"input": 0.10, "output": 0.40},
+    "gemini-2.5-pro": {"input": 1.25, "output": 10.00},
+}
+MODEL_PRICES = {**DEFAULT_MODEL_PRICES, **json.loads(os.environ.get("MODEL_PRICES", "{}"))}
+
+model_tokens = Counter("nutrifit_model_tokens_total", "Tokens used by agent, model and kind (prompt/completion)")
+model_cost = Counter("nutrifit_model_cost_usd_total", "Estimated model spend in USD by agent and model")
+model_calls = Counter("nutrifit_model_calls_total", "Model calls by agent, model and cache status")
+model_cancelled_calls = Counter("nutrifit_model_cancelled_calls_total", "Model calls cancelled before they finished (losing hedges, timeouts)")
+model_missing_usage = Counter("nutrifit_model_missing_usage_total", "Uncached streamed model calls that reported no token usage")
+model_latency = Histogram("nutrifit_model_call_seconds", "Model call latency by agent and model")
+
+_current_tracker: ContextVar[Optional["UsageTracker"]] = ContextVar("usage_tracker", default=None)
+_current_step: ContextVar[str] = ContextVar("usage_step", default="")
+_served_models: ContextVar[Optional[Dict[int, str]]] = ContextVar("served_models", default=None)
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    prices = MODEL_PRICES.get(model)
+    if not prices:
+        return 0.0
+    return (prompt_tokens * prices["input"] + completion_tokens * prices["output"]) / 1_000_000
+
+
+class UsageTracker:
+    """Collects the model calls made while a workflow runs"""
+
+    def __init__(self):
+        self.calls: List[dict] = []
+
+    def record(self, step: str, agent: str, model: str, prompt_tokens: int, completion_tokens: int, latency: float, cached: bool) -> None:
+        self.calls.append({
+            "step": step,
+            "agent": agent,
+            "model": model,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "latency_seconds": latency,
+            "cost_usd": estimate_cost(model, prompt_tokens, completion_tokens),
+            "cached": cached,
+        })
+
+    def summary(self, step: Optional[str] = None) -> dict:
+        """Aggregate the calls of one step (or of the whole workflow when step is None)"""
+        calls = [call for call in self.calls if step is None or call["step"] == step]
+        by_agent: Dict[str, dict] = {}
+        for call in calls:
+            agent = by_agent.setdefault(call["agent"], {
+                "calls": 0, "cached_calls": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                "latency_seconds": 0.0, "cost_usd": 0.0,
+            })
+            agent["calls"] += 1
+            agent["cached_calls"] += int(call["cached"])
+            agent["prompt_tokens"] += call["prompt_tokens"]
+            agent["completion_tokens"] += call["completion_tokens"]
+            agent["latency_seconds"] = round(agent["latency_seconds"] + call["latency_seconds"], 3)
+            agent["cost_usd"] = round(agent["cost_usd"] + call["cost_usd"], 6)
+        return {
+            "calls": len(calls),
+            "prompt_tokens": sum(call["prompt_tokens"] for call in calls),
+            "completion_tokens": sum(call["completion_tokens"] for call in calls),
+            "latency_seconds": round(sum(call["latency_seconds"] for call in calls), 3),
+            "cost_usd": round(sum(call["cost_usd"] for call in calls), 6),
+            "by_agent": by_agent,
+        }
+
+
+@contextmanager
+def track_usage():
+    """Collect usage of every model call made inside the block"""
+    tracker = UsageTracker()
+    token = _current_tracker.set(tracker)
+    try:
+        yield tracker
+    finally:
+        _current_tracker.reset(token)
+
+
+@contextmanager
+def usage_step(step: str):
+    """Attribute model calls made inside the block to a workflow step"""
+    token = _current_step.set(step)
+    try:
+        yield
+    finally:
+        _current_step.reset(token)
+
+
+@contextmanager
+def served_models():
+    """Collect which model served each result (keyed by id(result)) of the calls made inside the block"""
+    served: Dict[int, str] = {}
+    token = _served_models.set(served)
+    try:
+        yield served
+    finally:
+        _served_models.reset(token)
+
+
+def _mark_served(result: CreateResult, model: str) -> None:
+    served = _served_models.get()
+    if served is not None:
+        served[id(result)] = model
+
+
+def _record(agent: str, model: str, prompt_tokens: int, completion_tokens: int, latency: float, cached: bool) -> None:
+    model_tokens.inc(prompt_tokens, agent=agent, model=model, kind="prompt")
+    model_tokens.inc(completion_tokens, agent=agent, model=model, kind="completion")
+    model_cost.inc(estimate_cost(model, prompt_tokens, completion_tokens), agent=agent, model=model)
+    model_calls.inc(agent=agent, model=model, cached=str(cached).lower())
+    model_latency.observe(latency, agent=agent, model=model)
+    tracker = _current_tracker.get()
+    if tracker is not None:
+        tracker.record(_current_step.get(), agent, model, prompt_tokens, completion_tokens, latency, cached)
+
+
+def record_usage(agent: str, model: str, result: CreateResult, latency: float) -> None:
+    usage = result.usage
+    prompt_tokens = usage.prompt_tokens if usage else 0
+    completion_tokens = usage.completion_tokens if usage else 0
+    _record(agent, model, prompt_tokens, completion_tokens, latency, bool(getattr(result, "cached", False)))
+
+
+def with_stream_usage(kwargs: dict) -> dict:
+    """create_stream kwargs asking the provider to include usage in the stream"""
+    extra_create_args = dict(kwargs.get("extra_create_args") or {})
+    extra_create_args.setdefault("stream_options", {"include_usage": True})
+    return {**kwargs, "extra_create_args": extra_create_args}
+
+
+class UsageTrackingChatCompletionClient(DelegatingChatCompletionClient):
+    """Record usage and latency of every call a provider client serves, under the agent's name"""
+
+    def __init__(self, client, agent_name: str):
+        super().__init__(client)
+        self.agent_name = agent_name
+
+    def _record_cancelled(self, messages, latency: float, **kwargs) -> None:
+        try:
+            prompt_tokens = self._client.count_tokens(messages, tools=kwargs.get("tools", []))
+        except Exception:
+            prompt_tokens = sum(len(str(message.content)) for message in messages) // 4
+        model = model_name(self._client)
+        model_cancelled_calls.inc(agent=self.agent_name, model=model)
+        _record(self.agent_name, model, prompt_tokens, 0, latency, False)
+
+    async def create(self, messages, **kwargs):
+        start = time.monotonic()
+        try:
+            result = await self._client.create(messages, **kwargs)
+        except asyncio.CancelledError:
+            self._record_cancelled(messages, time.monotonic() - start, **kwargs)
+            raise
+        model = model_name(self._client)
+        _mark_served(result, model)
+        record_usage(self.agent_name, model, result, time.monotonic() - start)
+        return result
+
+    async def create_stream(self, messages, **kwargs):
+        start = time.monotonic()
+        finished = False
+        try:
+            async for chunk in self._client.create_stream(messages, **with_stream_usage(kwargs)):
+                if isinstance(chunk, CreateResult):
+                    finished = True
+                    model = model_name(self._client)
+                    _mark_served(chunk, model)
+                    if not (chunk.usage and (chunk.usage.prompt_tokens or chunk.usage.completion_tokens)):
+                        model_missing_usage.inc(agent=self.agent_name, model=model)
+                        print(f"Warning: streamed call of agent '{self.agent_name}' ({model}) reported no token usage")
+                    record_usage(self.agent_name, model, chunk, time.monotonic() - start)
+                yield chunk
+        except (asyncio.CancelledError, GeneratorExit):
+            if not finished:
+                self._record_cancelled(messages, time.monotonic() - start, **kwargs)
+            raise
+
+
+class CacheHitTrackingChatCompletionClient(DelegatingChatCompletionClient):
+    """Record the answers the response cache below replays (provider calls are recorded further down)"""
+
+    def __init__(self, client, agent_name: str):
+        super().__init__(client)
+        self.agent_name = agent_name
+
+    async def create(self, messages, **kwargs):
+        start = time.monotonic()
+        result = await self._client.create(messages, **kwargs)
+        if result.cached:
+            record_usage(self.agent_name, model_name(self._client), result, time.monotonic() - start)
+        return result
+
+    async def create_stream(self, messages, **kwargs):
+        start = time.monotonic()
+        async for chunk in self._client.create_stream(messages, **kwargs):
+            if isinstance(chunk, CreateResult) and chunk.cached:
+                record_usage(self.agent_name, model_name(self._client), chunk, time.monotonic() - start)
+            yield chunk
@@ -1,9 +1,6 @@
-from autogen_ext.models.openai import AzureOpenAIChatCompletionClient
 import os
 from dotenv import load_dotenv
 from pathlib import Path
-from autogen_core.models import ModelInfo
-from autogen_ext.models.openai import OpenAIChatCompletionClient
 # Register message types to avoid server-side errors
 try:
     from autogen_agentchat.messages import register_message_type, StructuredMessage
@@ -15,27 +12,14 @@ except ImportError:
 env_path = Path(__file__).parent.parent.parent / '.env'
 load_dotenv(env_path)
 
-def initialize_azure_client():
-    """Initialize Azure OpenAI client with proper authentication"""
-    try:
-        # Azure configuration
-        endpoint   = os.environ["AZURE_OPENAI_ENDPOINT"]
-        api_key    = os.environ["AZURE_OPENAI_API_KEY"]
-        api_ver    = os.environ["AZURE_OPENAI_API_VERSION"]
-        deployment = os.environ["AZURE_OPENAI_DEPLOYMENT"]
-        
-        
-        client = AzureOpenAIChatCompletionClient(
-            azure_deployment=deployment,
-            model=deployment,
-            api_version=api_ver,
-            azure_endpoint=endpoint,
-            api_key=api_key, # For key-based authentication.
-        )
-        
-        
+from Agents.model_routing import build_agent_client
 
-        return client
+def initialize_azure_client(agent_name: str = "agent"):
+    """Return the agent's model client (tiered model, shared pool, rate limiter and retry policy)"""
+    # MODEL_PROVIDER=fake swaps in the deterministic local stand-in (load tests, profiling)
+    provider = os.environ.get("MODEL_PROVIDER", "azure")
+    try:
+        return build_agent_client(provider, agent_name)
     except Exception as e:
         print(f"Error initializing Azure client: {e}")
         return None 
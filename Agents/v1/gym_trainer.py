@@ -7,11 +7,11 @@ from autogen_core import Image as AGImage
 from PIL import Image
 from autogen_agentchat.messages import MultiModalMessage
 from io import BytesIO
-import requests
 import asyncio
 from pydantic import BaseModel
 from typing import List, Optional
 from . import initialize_azure_client
+from Agents.image_fetcher import fetch_ag_image
 from autogen_agentchat.conditions import TextMentionTermination
 from autogen_agentchat.teams import RoundRobinGroupChat
 # Create APIRouter for Gym Trainer
@@ -54,16 +54,8 @@ async def process_inbody_image(image_url):
         return None
     
     try:
-        response = requests.get(image_url)
-        response.raise_for_status()
-        
-        # Convert to PIL Image
-        image = Image.open(BytesIO(response.content))
-        
-        # Convert to AutoGen Image format
-        ag_image = AGImage(image)
-        
-        return ag_image
+        # Bounded, streamed async download; decoded off the event loop
+        return await fetch_ag_image(image_url)
     except Exception as e:
         print(f"Error processing InBody image: {e}")
         return None
@@ -71,7 +63,7 @@ async def process_inbody_image(image_url):
 
 def create_gym_trainer_agent():
     """Create and return the Gym Trainer agent"""
-    client = initialize_azure_client()
+    client = initialize_azure_client("gym_trainer")
     if not client:
         return None
     gym_system_message = f"""
@@ -101,7 +93,7 @@ def create_gym_trainer_agent():
 
 def create_gym_evalutor_agent():
     """Create and return the Gym Trainer agent"""
-    client = initialize_azure_client()
+    client = initialize_azure_client("gym_evaluator")
     if not client:
         return None
     GymTrainer_evaluator_system_message = f"""
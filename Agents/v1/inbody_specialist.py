@@ -6,11 +6,11 @@ from autogen_core import Image as AGImage
 from PIL import Image
 from autogen_agentchat.messages import MultiModalMessage
 from io import BytesIO
-import requests
 import asyncio
 from pydantic import BaseModel
 from typing import Optional
 from . import initialize_azure_client
+from Agents.image_fetcher import fetch_ag_image
 from pydantic import BaseModel, Field
 # Create APIRouter for Inbody Specialist
 router = APIRouter()
@@ -54,7 +54,7 @@ class ImageResponse(BaseModel):
 
 def create_inbody_agent():
     """Create and return the Inbody Specialist agent"""
-    client = initialize_azure_client()
+    client = initialize_azure_client("inbody_specialist")
     if not client:
         return None
     
@@ -79,16 +79,8 @@ async def process_inbody_image(image_url):
         return None
     
     try:
-        response = requests.get(image_url)
-        response.raise_for_status()
-        
-        # Convert to PIL Image
-        image = Image.open(BytesIO(response.content))
-        
-        # Convert to AutoGen Image format
-        ag_image = AGImage(image)
-        
-        return ag_image
+        # Bounded, streamed async download; decoded off the event loop
+        return await fetch_ag_image(image_url)
     except Exception as e:
         print(f"Error processing InBody image: {e}")
         return None
@@ -8,13 +8,13 @@ from autogen_agentchat.messages import MultiModalMessage
 from autogen_agentchat.conditions import TextMentionTermination
 from autogen_agentchat.teams import RoundRobinGroupChat
 from io import BytesIO
-import requests
 import asyncio
 from pydantic import BaseModel
 from typing import List, Optional
 
 from Agents.v1.gym_trainer import process_inbody_image
 from . import initialize_azure_client
+from Agents.image_fetcher import fetch_ag_image
 
 # Create APIRouter for Nutritionist
 router = APIRouter()
@@ -61,7 +61,7 @@ class NutritionResponse(BaseModel):
 
 def create_nutritionist_agent():
     """Create and return the main Nutritionist agent"""
-    client = initialize_azure_client()
+    client = initialize_azure_client("nutritionist")
     if not client:
         return None
     
@@ -89,7 +89,7 @@ def create_nutritionist_agent():
 
 def create_evaluator_agent():
     """Create and return the Evaluator agent"""
-    client = initialize_azure_client()
+    client = initialize_azure_client("evaluator")
     if not client:
         return None
     
@@ -140,16 +140,8 @@ async def process_food_image(image_url):
         return None
     
     try:
-        response = requests.get(image_url)
-        response.raise_for_status()
-        
-        # Convert to PIL Image
-        image = Image.open(BytesIO(response.content))
-        
-        # Convert to AutoGen Image format
-        ag_image = AGImage.from_pil_image(image)
-        
-        return ag_image
+        # Bounded, streamed async download; decoded off the event loop
+        return await fetch_ag_image(image_url)
     except Exception as e:
         print(f"Error processing food image: {e}")
         return None
@@ -19,7 +19,6 @@ import json
 from fastapi import APIRouter, Request
 from pydantic import BaseModel
 from typing import Optional
-import requests
 from PIL import Image
 from io import BytesIO
 
@@ -32,6 +31,7 @@ from autogen_agentchat.messages import MultiModalMessage
 from Agents.v1.gym_trainer import create_comprehensive_workout_plan
 from Agents.firebase_plans import get_user_plans, increment_used_requests, save_full_user_plan, send_plan_created_notification
 from Agents.v1.summerizer import summerize_workout_plan
+from Agents.image_fetcher import fetch_ag_image
 
 # Create APIRouter for Plan Workflow
 router = APIRouter()
@@ -69,12 +69,16 @@ async def execute_complete_workflow(
     user_id: str = None,
     language:str = "english",
     time:str = "",
-    type:str = ""
+    type:str = "",
+    image = None
 ) -> dict:
     """
     Execute the complete workflow: (history summary) -> InBody image -> gym plan -> nutrition plan
+
+    image is the already downloaded InBody image; it is fetched from inbody_image_url otherwise.
     """
-    image = await process_inbody_image(inbody_image_url)
+    if image is None:
+        image = await process_inbody_image(inbody_image_url)
     if not image:
             return {
                 "error": "Failed to process InBody image",
@@ -263,10 +267,9 @@ async def create_complete_plan(request: Request):
         language = data.get('lang', "english")
         time = data['time']
         type_ = data['type']
-        # Validate image URL
+        # Validate image URL: the single GET that downloads the image for the workflow
         try:
-            response = requests.head(inbody_image_url, timeout=10)
-            response.raise_for_status()
+            image = await fetch_ag_image(inbody_image_url)
         except Exception as e:
             return {"error": f"Invalid or inaccessible image URL: {str(e)}"}
        
@@ -282,7 +285,8 @@ async def create_complete_plan(request: Request):
                 user_id,
                 language,
                 time,
-                type_
+                type_,
+                image
             )
         
             
@@ -24,7 +24,7 @@ router = APIRouter()
 
 def create_summerizer_agent():
     """Create and return the summerizer agent"""
-    client = initialize_azure_client()
+    client = initialize_azure_client("summarizer")
     if not client:
         return None
     summerizer_system_message = f"""
@@ -1,9 +1,6 @@
-from autogen_ext.models.openai import AzureOpenAIChatCompletionClient
 import os
 from dotenv import load_dotenv
 from pathlib import Path
-from autogen_core.models import ModelInfo
-from autogen_ext.models.openai import OpenAIChatCompletionClient
 # Register message types to avoid server-side errors
 try:
     from autogen_agentchat.messages import register_message_type, StructuredMessage
@@ -15,21 +12,15 @@ except ImportError:
 env_path = Path(__file__).parent.parent.parent / '.env'
 load_dotenv(env_path)
 
-def initialize_azure_client():
-    """Initialize Azure OpenAI client with proper authentication"""
-    try:
-        # Azure configuration
-        
-        gemini_api_key = os.environ["GEMINI_API_KEY"]
-        
-    
-        gemini_client = OpenAIChatCompletionClient(
-        model="gemini-2.5-flash",
-        api_key=gemini_api_key,
-        model_info=ModelInfo(vision=True, function_calling=True, json_output=True, family="unknown", structured_output=True)
-        )
+from Agents.model_routing import build_agent_client
+from Agents.llm_cache import agent_response_cache
 
-        return gemini_client
+def initialize_azure_client(agent_name: str = "agent"):
+    """Return the agent's model client (tiered model, shared pool, response cache)"""
+    # MODEL_PROVIDER=fake swaps in the deterministic local stand-in (load tests, profiling)
+    provider = os.environ.get("MODEL_PROVIDER", "gemini")
+    try:
+        return build_agent_client(provider, agent_name, cache=agent_response_cache(agent_name))
     except Exception as e:
         print(f"Error initializing Azure client: {e}")
         return None 
@@ -8,11 +8,13 @@ from PIL import Image
 from autogen_agentchat.messages import MultiModalMessage
 from io import BytesIO
 
-import requests
 import asyncio
 from pydantic import BaseModel
 from typing import List, Optional
 from . import initialize_azure_client
+from .inbody_specialist import process_inbody_image
+from Agents.call_policy import TEAM_RUN_TIMEOUT
+from Agents.prompt_builder import PromptBuilder, input_budget
 from autogen_agentchat.conditions import TextMentionTermination
 from autogen_agentchat.teams import RoundRobinGroupChat
 # Create APIRouter for Gym Trainer
@@ -49,30 +51,9 @@ class FitnessResponse(BaseModel):
     status: str
 
 
-async def process_inbody_image(image_url):
-    """Process and analyze InBody scan image if provided"""
-    if not image_url:
-        return None
-    
-    try:
-        response = requests.get(image_url)
-        response.raise_for_status()
-        
-        # Convert to PIL Image
-        image = Image.open(BytesIO(response.content))
-        
-        # Convert to AutoGen Image format
-        ag_image = AGImage(image)
-        
-        return ag_image
-    except Exception as e:
-        print(f"Error processing InBody image: {e}")
-        return None
-
-
 def create_gym_trainer_agent():
     """Create and return the Gym Trainer agent"""
-    client = initialize_azure_client()
+    client = initialize_azure_client("gym_trainer")
     if not client:
         return None
     gym_system_message = f"""
@@ -102,7 +83,7 @@ def create_gym_trainer_agent():
 
 def create_gym_evalutor_agent():
     """Create and return the Gym Trainer agent"""
-    client = initialize_azure_client()
+    client = initialize_azure_client("gym_evaluator")
     if not client:
         return None
     GymTrainer_evaluator_system_message = f"""
@@ -130,8 +111,8 @@ def create_gym_evalutor_agent():
     return GymTrainer_evaluator
 
 
-async def create_comprehensive_workout_plan(inbody_data, injuries, goals, number_of_gym_days,lastgymPlan,last_plan_inbody_data,type,age,gender):
-    """Create a comprehensive workout plan"""
+async def create_comprehensive_workout_plan(inbody_data, injuries, goals, number_of_gym_days,lastgymPlan,last_plan_inbody_data,type,age,gender,calories=None):
+    """Create a comprehensive workout plan (calories: precomputed daily target to use as daily_calories)"""
     try:
         # Initialize Gym Trainer agent
         gym_trainer = create_gym_trainer_agent()
@@ -152,20 +133,25 @@ async def create_comprehensive_workout_plan(inbody_data, injuries, goals, number
         else:
             lastgymPlan="no history for that user"
         
-        user_message = f"""
-        age:{age}
-        gender:{gender}
-        last gym Plan:{lastgymPlan}
-        last inbody data:{last_plan_inbody_data}
-        current inbody data:{inbody_data}
-        Goals: {goals}
-        injuries: {injuries}
-        number of gym days: {number_of_gym_days},
-        workout type:{type}
-        """
+        # Only populated fields, compact format, history trimmed first if over the token budget
+        user_message = (
+            PromptBuilder(input_budget("gym_trainer"))
+            .add("age", age)
+            .add("gender", gender)
+            .add("last gym Plan", lastgymPlan, priority=0, required=False)
+            .add("last inbody data", last_plan_inbody_data, priority=1, required=False)
+            .add("current inbody data", inbody_data)
+            .add("Goals", goals)
+            .add("injuries", injuries)
+            .add("number of gym days", number_of_gym_days)
+            .add("workout type", type)
+            # Never trimmed when known: the nutrition plan uses the same target
+            .add("daily calories (use as daily_calories)", calories, required=calories is not None)
+            .build()
+        )
         message = MultiModalMessage(content=[user_message],source="User")
 
-        workout_plan_output = await gym_team.run(task=message)
+        workout_plan_output = await asyncio.wait_for(gym_team.run(task=message), timeout=TEAM_RUN_TIMEOUT)
         workout_output = workout_plan_output.messages[-2].content
         # Extract the response
         if workout_output:
@@ -175,6 +161,9 @@ async def create_comprehensive_workout_plan(inbody_data, injuries, goals, number
                 response = response.model_dump()
             elif hasattr(response, "dict"):
                 response = response.dict()
+            # Keep the gym and nutrition plans on the same calorie target
+            if calories and isinstance(response, dict):
+                response["daily_calories"] = calories
         else:
             response = "Unable to generate workout plan"
         
@@ -184,6 +173,11 @@ async def create_comprehensive_workout_plan(inbody_data, injuries, goals, number
             "status": "success"
         }
         
+    except asyncio.TimeoutError:
+        return {
+            "error": f"Error creating workout plan: gym team did not finish within {TEAM_RUN_TIMEOUT:.0f}s",
+            "status": "error"
+        }
     except Exception as e:
         return {
             "error": f"Error creating workout plan: {str(e)}",
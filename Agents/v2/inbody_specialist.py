@@ -1,4 +1,5 @@
 from fastapi import APIRouter, Request
+from fastapi.responses import StreamingResponse
 from autogen_agentchat.agents import AssistantAgent
 from autogen_core import CancellationToken
 from autogen_core.models import UserMessage
@@ -6,15 +7,30 @@ from autogen_core import Image as AGImage
 from PIL import Image
 from autogen_agentchat.messages import MultiModalMessage
 from io import BytesIO
-import requests
 import asyncio
+import hashlib
+import json
+import os
 from pydantic import BaseModel, Field
-from typing import Optional, Dict
+from typing import Optional, Dict, List
+from dataclasses import dataclass
 from . import initialize_azure_client
+from Agents.image_fetcher import ImageFetchError, fetch_ag_image, fetch_image, load_ag_image
+from Agents.inbody_ocr import extract_inbody_fields
+from Agents.inbody_cache import get_cached_analysis, get_url_entry, image_content_hash, store_analysis, store_url_entry
+from Agents.image_classifier import looks_like_document
+from Agents.image_hashing import compute_hashes, get_perceptual_index
+from Agents.image_preprocessing import preprocess_for_vision
+from Agents.image_upload import decode_base64_image, read_batch_image_request, read_image_request
+from Agents.usage_tracking import track_usage
 
 # Create APIRouter for Inbody Specialist
 router = APIRouter()
 
+# Batch analysis limits
+BATCH_MAX_ITEMS = int(os.environ.get("INBODY_BATCH_MAX_ITEMS", "20"))
+BATCH_CONCURRENCY = int(os.environ.get("INBODY_BATCH_CONCURRENCY", "4"))
+
 # Pydantic models for Inbody analysis
 
 
@@ -48,7 +64,7 @@ class ImageResponse(BaseModel):
 
 def create_inbody_agent():
     """Create and return the Inbody Specialist agent"""
-    client = initialize_azure_client()
+    client = initialize_azure_client("inbody_specialist")
     if not client:
         return None
     
@@ -67,74 +83,152 @@ def create_inbody_agent():
     
     return Inbody_Specialist
 
+@dataclass
+class InbodyImageInput:
+    """An InBody image to analyze; image is None when the URL's image is unchanged since its last analysis"""
+    image: Optional[AGImage]
+    url: Optional[str] = None
+    etag: Optional[str] = None
+    content_hash: Optional[str] = None
+
+
 async def process_inbody_image(image_url):
     """Process and analyze InBody scan image if provided"""
     if not image_url:
         return None
     
     try:
-        response = requests.get(image_url)
-        response.raise_for_status()
-        
-        # Convert to PIL Image
-        image = Image.open(BytesIO(response.content))
-        
-        # Convert to AutoGen Image format
-        ag_image = AGImage(image)
-        
-        return ag_image
+        # Single pooled async GET (no event-loop blocking, no separate HEAD)
+        return await fetch_ag_image(image_url)
     except Exception as e:
         print(f"Error processing InBody image: {e}")
         return None
 
-async def process_inbody_analysis(image) -> dict:
+async def load_inbody_image(image_url, conditional=True) -> InbodyImageInput:
+    """
+    Fetch an InBody image by URL. If the URL was analyzed before, the GET is
+    conditional on its ETag and an unchanged image is not downloaded again.
+    Raises ImageFetchError when the URL is invalid or not an image.
+    """
+    entry = await get_url_entry(image_url) if conditional else None
+    fetched = await fetch_image(image_url, etag=entry["etag"] if entry else None)
+    if fetched.not_modified:
+        return InbodyImageInput(image=None, url=image_url, etag=fetched.etag, content_hash=entry["hash"])
+    image = await load_ag_image(fetched.content)
+    return InbodyImageInput(image=image, url=image_url, etag=fetched.etag)
+
+async def load_inbody_upload(content: bytes) -> InbodyImageInput:
+    """Decode an uploaded InBody image; raises ImageFetchError when it is not a valid image"""
+    return InbodyImageInput(image=await load_ag_image(content))
+
+async def process_inbody_analysis(image, user_id: Optional[str] = None) -> dict:
     """
     Step 1: Process InBody image and extract body composition data
     
     Args:
-        image_url: URL of the InBody scan image
-        user_info: Additional user information
-        goals: User's health goals
+        image: AutoGen image or InbodyImageInput of the InBody scan
+        user_id: Owner of the scan, enables reuse of near-duplicate scans
     
     Returns:
-        dict: InBody analysis results
+        dict: InBody analysis results (served from the InBody cache when the
+        same image, or a near-duplicate of the user's recent scan, was
+        analyzed before)
     """
     try:
-        # Initialize InBody Specialist agent
-        inbody_agent = create_inbody_agent()
-        
-        if not inbody_agent:
-            return {
-                "error": "Failed to initialize InBody Specialist agent",
-                "status": "error"
-            }
-        
-        # Process InBody image
-        
-        # Prepare analysis message
-        analysis_message = f"""
-        Please check this image
-        """
-        
-        # Create multimodal message with image
-        message = MultiModalMessage(content=[image,analysis_message],source="User")
-        
-        # Get analysis from InBody Specialist
-        analysis_output = await inbody_agent.on_messages(
-            [message], 
-            cancellation_token=CancellationToken()
-        )
-        
-        # Extract the response
-        if analysis_output :
-            response = analysis_output.chat_message.content
-            response = response.model_dump()
+        inbody_input = image if isinstance(image, InbodyImageInput) else InbodyImageInput(image=image)
+
+        # Unchanged image behind a known URL: reuse the stored analysis
+        if inbody_input.image is None:
+            cached = await get_cached_analysis(inbody_input.content_hash)
+            if cached is not None:
+                return {"analysis": cached, "status": "success", "image_hash": inbody_input.content_hash, "cached": True, "extraction": "cache"}
+            inbody_input = await load_inbody_image(inbody_input.url, conditional=False)
+
+        # Process InBody image: orient, downscale, grayscale and re-encode off the event loop
+        image = await preprocess_for_vision(inbody_input.image)
+        content_hash = image_content_hash(image)
+
+        cached = await get_cached_analysis(content_hash)
+        hashes = None
+        perceptual_index = get_perceptual_index() if cached is None and user_id else None
+        if perceptual_index is not None:
+            # Re-photographed / re-compressed copy of a recent scan of this user
+            hashes = await compute_hashes(image.image)
+            match = await perceptual_index.find(user_id, hashes)
+            if match:
+                cached = await get_cached_analysis(match)
+                if cached is not None:
+                    await store_analysis(content_hash, cached)
+        if cached is not None:
+            response = cached
+            from_cache = True
+            extraction = "cache"
         else:
-            response = "Unable to generate InBody analysis"
+            # Reject obvious non-scans (selfies, food photos) locally before spending a vision call
+            precheck = await looks_like_document(inbody_input.image.image)
+            if not precheck.accepted:
+                return {
+                    "analysis": {"status": "not valid image", "results": None},
+                    "status": "success",
+                    "image_hash": content_hash,
+                    "cached": False,
+                    "precheck": precheck.to_dict()
+                }
+
+            # Known report layouts are read locally; the vision agent only handles the rest
+            ocr = await extract_inbody_fields(image.image)
+            if ocr is not None and ocr.accepted:
+                response = ImageResponse(status="success", results=InbodyData(**ocr.fields)).model_dump()
+                extraction = f"ocr:{ocr.layout}"
+            else:
+                # Initialize InBody Specialist agent
+                inbody_agent = create_inbody_agent()
+                
+                if not inbody_agent:
+                    return {
+                        "error": "Failed to initialize InBody Specialist agent",
+                        "status": "error"
+                    }
+                
+                # Prepare analysis message
+                analysis_message = f"""
+                Please check this image
+                """
+                
+                # Create multimodal message with image
+                message = MultiModalMessage(content=[image,analysis_message],source="User")
+                
+                # Get analysis from InBody Specialist
+                analysis_output = await inbody_agent.on_messages(
+                    [message], 
+                    cancellation_token=CancellationToken()
+                )
+                
+                # Extract the response
+                response = analysis_output.chat_message.content.model_dump() if analysis_output else None
+                extraction = "vision"
+                if ocr is not None and ocr.fields and response and response.get("results"):
+                    # Cross-checked OCR values stand; the vision agent fills the fields OCR could not verify
+                    response["results"].update(ocr.fields)
+                    extraction = f"vision+ocr:{ocr.layout}"
+            
+            if response is not None:
+                await store_analysis(content_hash, response)
+                if hashes is not None and response.get("results"):
+                    await perceptual_index.add(user_id, content_hash, hashes)
+            else:
+                response = "Unable to generate InBody analysis"
+            from_cache = False
+
+        if inbody_input.url and inbody_input.etag:
+            await store_url_entry(inbody_input.url, inbody_input.etag, content_hash)
         
         return {
             "analysis": response,
-            "status": "success"
+            "status": "success",
+            "image_hash": content_hash,
+            "cached": from_cache,
+            "extraction": extraction
         }
         
     except Exception as e:
@@ -142,40 +236,131 @@ async def process_inbody_analysis(image) -> dict:
             "error": f"Error in InBody analysis: {str(e)}",
             "status": "error"
         }
+async def _load_batch_item(item: dict):
+    """Download/decode one batch item; returns the SHA-256 of its bytes and the image input"""
+    if item.get("content") is not None:
+        content, url, etag = item["content"], None, None
+    elif item.get("inbody_image_base64"):
+        content, url, etag = decode_base64_image(item["inbody_image_base64"]), None, None
+    elif item.get("inbody_image_url"):
+        fetched = await fetch_image(item["inbody_image_url"])
+        content, url, etag = fetched.content, item["inbody_image_url"], fetched.etag
+    else:
+        raise ImageFetchError("No image provided")
+    image = await load_ag_image(content)
+    return hashlib.sha256(content).hexdigest(), InbodyImageInput(image=image, url=url, etag=etag)
+
+async def analyze_inbody_batch(items: List[dict], user_id: Optional[str] = None):
+    """
+    Analyze many InBody images, yielding each item's result as soon as it completes.
+
+    Images are downloaded and decoded concurrently; identical URLs are fetched
+    once and identical images are analyzed once. Analyses run at most
+    BATCH_CONCURRENCY at a time.
+    """
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    loads: Dict[str, asyncio.Future] = {}
+    analyses: Dict[str, asyncio.Future] = {}
+
+    async def analyze(inbody_input):
+        async with semaphore:
+            return await process_inbody_analysis(inbody_input, user_id=user_id)
+
+    async def run(index: int, item: dict) -> dict:
+        result = {"index": index, "id": item.get("id", index)}
+        with track_usage() as tracker:
+            source = item.get("inbody_image_url") or f"item:{index}"
+            if source not in loads:
+                loads[source] = asyncio.ensure_future(_load_batch_item(item))
+            try:
+                digest, inbody_input = await asyncio.shield(loads[source])
+            except Exception as e:
+                return {**result, "error": f"Invalid InBody image: {e}", "status": "error"}
+            duplicate = digest in analyses
+            if not duplicate:
+                analyses[digest] = asyncio.ensure_future(analyze(inbody_input))
+            analysis = await asyncio.shield(analyses[digest])
+            return {**result, **analysis, "duplicate": duplicate, "usage": tracker.summary()}
+
+    tasks = [asyncio.ensure_future(run(index, item)) for index, item in enumerate(items)]
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            yield await next_result
+    finally:
+        for task in [*tasks, *loads.values(), *analyses.values()]:
+            task.cancel()
+
 # Flask routes for Inbody Specialist
 @router.post('/analyze')
 async def analyze_inbody(request: Request):
     """Main endpoint for InBody analysis"""
     try:
-        data = await request.json()
+        # JSON (image URL or base64) or multipart with the image file
+        data, image_bytes = await read_image_request(request, "inbody_image")
         
         # Validate input
-        if not data:
+        if not data and image_bytes is None:
             return {"error": "No data provided"}
         
        
         # Extract data
         
         image_url = data.get('inbody_image_url', '')
+        user_id = data.get('user_id')
         image =None
         try:
-            image = await process_inbody_image(image_url)
+            if image_bytes is not None:
+                image = await load_inbody_upload(image_bytes)
+            else:
+                image = await load_inbody_image(image_url)
+        except ImageFetchError as e:
+            return {"error": f"Invalid InBody image: {str(e)}"}
         except Exception as e:
             print(f"Error processing InBody image: {e}")
             return {"error": f"Server error: {str(e)}"}
         
         # Perform InBody analysis
         try:
-            result = await process_inbody_analysis(image)
+            result = await process_inbody_analysis(image, user_id=user_id)
         except Exception as e:
             print(f"Error in InBody analysis: {str(e)}")
             return {"error": f"Server error: {str(e)}"}
         
         return result
         
+    except ImageFetchError as e:
+        return {"error": f"Invalid InBody image: {str(e)}"}
     except Exception as e:
         return {"error": f"Server error: {str(e)}"}
 
+@router.post('/analyze_batch')
+async def analyze_inbody_batch_endpoint(request: Request):
+    """
+    Batch InBody analysis: JSON {"user_id", "images": [{"id", "inbody_image_url" or
+    "inbody_image_base64"}]} or multipart with repeated "inbody_images" files.
+    Streams one JSON line per image as results complete (application/x-ndjson).
+    """
+    try:
+        data, uploads = await read_batch_image_request(request, "inbody_images")
+    except ImageFetchError as e:
+        return {"error": f"Invalid InBody image: {str(e)}"}
+    except Exception as e:
+        return {"error": f"Server error: {str(e)}"}
+
+    items = [{"id": f"upload-{index}", "content": content} for index, content in enumerate(uploads)]
+    for entry in data.get("images", []) if isinstance(data.get("images"), list) else []:
+        items.append({"inbody_image_url": entry} if isinstance(entry, str) else entry)
+    if not items:
+        return {"error": "No images provided"}
+    if len(items) > BATCH_MAX_ITEMS:
+        return {"error": f"Too many images: {len(items)} (limit {BATCH_MAX_ITEMS})"}
+
+    async def stream_results():
+        async for result in analyze_inbody_batch(items, user_id=data.get("user_id")):
+            yield json.dumps(result) + "\n"
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
 @router.get('/health')
 async def inbody_health_check():
     """Health check endpoint for Inbody Specialist"""
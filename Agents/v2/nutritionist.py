@@ -10,13 +10,22 @@ from autogen_agentchat.messages import MultiModalMessage
 from autogen_agentchat.conditions import TextMentionTermination
 from autogen_agentchat.teams import RoundRobinGroupChat
 from io import BytesIO
-import requests
 import asyncio
-from pydantic import BaseModel
+import inspect
+import os
+from pydantic import BaseModel, ValidationError
 from typing import Dict, List, Optional
+from autogen_agentchat.base import TaskResult
+from autogen_agentchat.messages import BaseChatMessage, ModelClientStreamingChunkEvent
 
 from Agents.v2.gym_trainer import process_inbody_image
+from Agents.image_fetcher import fetch_ag_image
 from . import initialize_azure_client
+from Agents.call_policy import TEAM_RUN_TIMEOUT
+from Agents.prompt_builder import PromptBuilder, input_budget
+
+# Stream the nutritionist's structured output and parse DayPlan entries as they arrive
+NUTRITION_STREAMING = os.environ.get("NUTRITION_STREAMING", "true").lower() == "true"
 
 # Create APIRouter for Nutritionist
 router = APIRouter()
@@ -48,39 +57,41 @@ class FourWeekDietPlan(BaseModel):
 # 🔁 Convert Flat → Nested
 # ----------------------------
 
-def convert_flat_to_nested(nutrition_result):
-    result = {"plan": []}
-    plan_entries = nutrition_result["plan"]
+# Arabic to English meal type map
+MEAL_TYPE_MAP = {
+    "فطور": "breakfast",
+    "غداء": "lunch",
+    "عشاء": "dinner",
+    "وجبة خفيفة": "snack"
+}
 
-    week_map = {}
 
-    # Arabic to English meal type map
-    
+class NestedPlanBuilder:
+    """Builds the nested week -> day -> meals plan one flat DayPlan entry at a time"""
 
-    meal_map = {
-        "فطور": "breakfast",
-        "غداء": "lunch",
-        "عشاء": "dinner",
-        "وجبة خفيفة": "snack"
-    }
+    def __init__(self):
+        self.result = {"plan": []}
+        self.entries = 0
+        self._weeks = {}
+        self._days = {}
 
-    for entry in plan_entries:
+    def add(self, entry):
         week = entry["week"]
         day = entry["day"]
-        meal_type = meal_map.get(entry["meal_type"], entry["meal_type"])
+        meal_type = MEAL_TYPE_MAP.get(entry["meal_type"], entry["meal_type"])
 
         # Create week if not exists
-        if week not in week_map:
+        week_obj = self._weeks.get(week)
+        if week_obj is None:
             week_obj = {"week": week, "days": []}
-            week_map[week] = week_obj
-            result["plan"].append(week_obj)
-
-        week_obj = week_map[week]
+            self._weeks[week] = week_obj
+            self.result["plan"].append(week_obj)
 
         # Check if day already added
-        day_obj = next((d for d in week_obj["days"] if d["day"] == day), None)
-        if not day_obj:
+        day_obj = self._days.get((week, day))
+        if day_obj is None:
             day_obj = {"day": day, "meals": {}}
+            self._days[(week, day)] = day_obj
             week_obj["days"].append(day_obj)
 
         # Add meal items
@@ -97,14 +108,72 @@ def convert_flat_to_nested(nutrition_result):
             })
 
         day_obj["meals"][meal_type] = meal_items
+        self.entries += 1
 
-    return result
+    @property
+    def days_completed(self):
+        return sum(1 for day in self._days.values() if len(day["meals"]) >= 4)
+
+
+def convert_flat_to_nested(nutrition_result):
+    builder = NestedPlanBuilder()
+    for entry in nutrition_result["plan"]:
+        builder.add(entry)
+    return builder.result
+
+
+class IncrementalDayPlanParser:
+    """
+    Pulls complete DayPlan objects out of a streamed FourWeekDietPlan JSON.
+
+    The structured output looks like {"plan": [{...}, {...}]}; every object
+    that opens at depth 3 is one DayPlan and is returned as soon as its
+    closing brace arrives.
+    """
+
+    def __init__(self):
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._capturing = False
+        self._buffer = []
+
+    def feed(self, text):
+        completed = []
+        for ch in text:
+            if self._capturing:
+                self._buffer.append(ch)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+            if ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+                if ch == "{" and self._depth == 3:
+                    self._capturing = True
+                    self._buffer = ["{"]
+            elif ch in "}]":
+                if ch == "}" and self._depth == 3 and self._capturing:
+                    try:
+                        completed.append(json.loads("".join(self._buffer)))
+                    except ValueError:
+                        pass
+                    self._capturing = False
+                    self._buffer = []
+                self._depth -= 1
+        return completed
     
 
 
-def create_nutritionist_agent():
-    """Create and return the main Nutritionist agent"""
-    client = initialize_azure_client()
+def create_nutritionist_agent(stream=False):
+    """Create and return the main Nutritionist agent (stream=True streams its output tokens)"""
+    client = initialize_azure_client("nutritionist")
     if not client:
         return None
     
@@ -124,14 +193,15 @@ def create_nutritionist_agent():
         Do not include any explanation, recommendations, or analysis — only provide the structured 4-week diet plan in a clean and clear format.
         return the response with the language the user give to you.
         """,
-      output_content_type= FourWeekDietPlan
+      output_content_type= FourWeekDietPlan,
+      model_client_stream=stream
    )
     
     return nutritionist
 
 def create_evaluator_agent():
     """Create and return the Evaluator agent"""
-    client = initialize_azure_client()
+    client = initialize_azure_client("evaluator")
     if not client:
         return None
     
@@ -182,25 +252,82 @@ async def process_food_image(image_url):
         return None
     
     try:
-        response = requests.get(image_url)
-        response.raise_for_status()
-        
-        # Convert to PIL Image
-        image = Image.open(BytesIO(response.content))
-        
-        # Convert to AutoGen Image format
-        ag_image = AGImage.from_pil_image(image)
-        
-        return ag_image
+        return await fetch_ag_image(image_url)
     except Exception as e:
         print(f"Error processing food image: {e}")
         return None
 
-async def create_comprehensive_nutrition_plan(language,inbody_data,calories,number_of_gym_days,client_country, goals, allergies,last_nutritionPlan,last_plan_inbody_data,age,gender):
+async def stream_nutrition_team(team, message, on_day_plan=None):
+    """
+    Run the nutrition team, handing each DayPlan to on_day_plan as soon as the
+    nutritionist has streamed it.
+
+    on_day_plan(entry, progress) may be sync or async; progress carries the
+    entries/days received so far, the partially built nested plan and the
+    revision (a rejected plan is regenerated from scratch by the nutritionist).
+
+    If the team fails after the nutritionist finished a plan (e.g. in the
+    evaluator's turn), that plan is returned instead of the error. Model
+    calls that fail before streaming anything are already retried by the
+    call policy, so the team is never run a second time.
+    """
+    parser = IncrementalDayPlanParser()
+    builder = NestedPlanBuilder()
+    revision = 0
+    plans = []
+    try:
+        async for event in team.run_stream(task=message):
+            if isinstance(event, TaskResult):
+                return event
+            if isinstance(event, ModelClientStreamingChunkEvent) and event.source == "nutritionist":
+                for entry in parser.feed(event.content):
+                    try:
+                        DayPlan.model_validate(entry)
+                    except ValidationError:
+                        continue
+                    builder.add(entry)
+                    if on_day_plan:
+                        outcome = on_day_plan(entry, {
+                            "entries_received": builder.entries,
+                            "days_completed": builder.days_completed,
+                            "weeks_started": len(builder.result["plan"]),
+                            "revision": revision,
+                            "partial_plan": builder.result,
+                        })
+                        if inspect.isawaitable(outcome):
+                            await outcome
+            elif isinstance(event, BaseChatMessage) and event.source == "nutritionist":
+                # Turn finished; if the evaluator rejects it the next turn starts a new plan
+                plans.append(event)
+                parser = IncrementalDayPlanParser()
+                builder = NestedPlanBuilder()
+                revision += 1
+    except Exception as e:
+        if not plans:
+            raise
+        print(f"Nutrition team failed after the plan was streamed, using the streamed plan: {e}")
+        return TaskResult(messages=plans, stop_reason=f"Error: {e}")
+    return None
+
+def nutritionist_plan(messages) -> Optional[dict]:
+    """The last plan the nutritionist produced in a team run, as a flat dict"""
+    for message in reversed(messages):
+        if getattr(message, "source", None) != "nutritionist":
+            continue
+        content = message.content
+        if hasattr(content, "model_dump"):
+            return content.model_dump()
+        try:
+            return FourWeekDietPlan.model_validate_json(content).model_dump()
+        except ValidationError:
+            return None
+    return None
+
+async def create_comprehensive_nutrition_plan(language,inbody_data,calories,number_of_gym_days,client_country, goals, allergies,last_nutritionPlan,last_plan_inbody_data,age,gender,on_day_plan=None):
     """Create a comprehensive nutrition plan using nutritionist and evaluator team"""
     try:
         # Initialize agents
-        nutritionist = create_nutritionist_agent()
+        nutritionist = create_nutritionist_agent(stream=NUTRITION_STREAMING)
         evaluator = create_evaluator_agent()
         
         if not nutritionist or not evaluator:
@@ -218,36 +345,38 @@ async def create_comprehensive_nutrition_plan(language,inbody_data,calories,numb
             last_nutritionPlan = last_nutritionPlan
         else:
             last_nutritionPlan="no history for that user"
-        user_message = f"""
-        age:{age}
-        gender:{gender}
-        last_nutritionPlan:{last_nutritionPlan}
-        last inbody data:{last_plan_inbody_data}
-        current inbody data:{inbody_data}
-        calories:{calories},
-        number_of_gym_days:{number_of_gym_days},
-        Client Country: {client_country}
-        Goals: {goals}
-        Allergies: {allergies}
-        language:{language}
-        Please create a comprehensive 4-week nutrition plan based on this data.
-        """
+        # Only populated fields, compact format, history trimmed first if over the token budget
+        user_message = (
+            PromptBuilder(input_budget("nutritionist"))
+            .add("age", age)
+            .add("gender", gender)
+            .add("last_nutritionPlan", last_nutritionPlan, priority=0, required=False)
+            .add("last inbody data", last_plan_inbody_data, priority=1, required=False)
+            .add("current inbody data", inbody_data)
+            .add("calories", calories)
+            .add("number_of_gym_days", number_of_gym_days)
+            .add("Client Country", client_country)
+            .add("Goals", goals)
+            .add("Allergies", allergies)
+            .add("language", language)
+            .build(footer="Please create a comprehensive 4-week nutrition plan based on this data.")
+        )
         
         # Create message
         
         message = MultiModalMessage(content=[user_message],source="User")
         # Get nutrition plan from team
-        diet_plan_output = await team.run(task=message)
+        if NUTRITION_STREAMING:
+            diet_plan_output = await asyncio.wait_for(
+                stream_nutrition_team(team, message, on_day_plan), timeout=TEAM_RUN_TIMEOUT
+            )
+        else:
+            diet_plan_output = await asyncio.wait_for(team.run(task=message), timeout=TEAM_RUN_TIMEOUT)
         
         # Extract the response
-        if diet_plan_output :
-            response = diet_plan_output.messages[-2].content
-            if hasattr(response, "model_dump"):
-                response_dict = response.model_dump()
-            else:
-                response_dict = response.dict()
+        response_dict = nutritionist_plan(diet_plan_output.messages) if diet_plan_output else None
+        if response_dict is not None:
             response = convert_flat_to_nested(response_dict)
-            
         else:
             response = "Unable to generate nutrition plan"
         
@@ -256,6 +385,11 @@ async def create_comprehensive_nutrition_plan(language,inbody_data,calories,numb
             "status": "success"
         }
         
+    except asyncio.TimeoutError:
+        return {
+            "error": f"Error creating nutrition plan: nutrition team did not finish within {TEAM_RUN_TIMEOUT:.0f}s",
+            "status": "error"
+        }
     except Exception as e:
         return {
             "error": f"Error creating nutrition plan: {str(e)}",
@@ -15,16 +15,19 @@ The workflow processes:
 """
 
 import asyncio
+import base64
 import json
+import os
 from fastapi import APIRouter, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import Optional
-import requests
+from typing import Callable, Dict, Optional
 from PIL import Image
 from io import BytesIO
 
 # Import agent functions
-from .inbody_specialist import create_inbody_agent, process_inbody_analysis, process_inbody_image
+from .inbody_specialist import create_inbody_agent, load_inbody_image, load_inbody_upload, process_inbody_analysis
 from .nutritionist import create_comprehensive_nutrition_plan, create_nutritionist_agent, create_evaluator_agent, create_nutrition_team
 from autogen_core import CancellationToken
 from autogen_core.models import UserMessage
@@ -32,10 +35,22 @@ from autogen_agentchat.messages import MultiModalMessage
 from .gym_trainer import create_comprehensive_workout_plan
 from Agents.firebase_plans import get_user_plans, increment_used_requests, save_full_user_plan, send_plan_created_notification
 from .summerizer import summerize_workout_plan
+from Agents.usage_tracking import track_usage, usage_step
+from Agents.calorie_engine import CALORIE_ENGINE_ENABLED, daily_calorie_target
+from Agents.job_queue import get_job_store, register_job_handler
+from Agents.idempotency import request_key, run_idempotent
+from Agents.workflow_dag import DagExecutor, DagFailed, DagNode, StepFailed, StepSkipped
+from Agents.image_fetcher import ImageFetchError
+from Agents.image_upload import read_image_request
 
 # Create APIRouter for Plan Workflow
 router = APIRouter()
 
+# Seconds between keep-alive comments on an idle progress stream
+SSE_KEEPALIVE_SECONDS = float(os.environ.get("WORKFLOW_SSE_KEEPALIVE", "15"))
+# Streamed workflows keep running after their client disconnects
+_streamed_workflows = set()
+
 # Pydantic models for workflow
 class WorkflowRequest(BaseModel):
     inbody_image_url: str
@@ -55,6 +70,30 @@ class WorkflowStep(BaseModel):
     status: str
     message: str
     data: Optional[dict] = None
+    usage: Optional[dict] = None
+
+
+# Message of each workflow step while it is processing / when it is skipped
+STEP_MESSAGES = {
+    "history_summary": "Fetching and summarizing last user plan",
+    "inbody_analysis": "Processing InBody image and extracting body composition data",
+    "calorie_target": "Computing daily calorie target from InBody data",
+    "gym_plan_creation": "Creating comprehensive gym plan",
+    "nutrition_planning": "Creating comprehensive nutrition plan with evaluation",
+}
+SKIPPED_MESSAGES = {
+    "history_summary": "No previous plan found to summarize",
+    "gym_plan_creation": "No gym days requested",
+}
+
+
+def serialize_steps(workflow_steps, tracker) -> list:
+    """Attach per-step model usage (tokens, cost, latency) and serialize the steps"""
+    for step in workflow_steps:
+        summary = tracker.summary(step.step)
+        if summary["calls"]:
+            step.usage = summary
+    return [step.dict() for step in workflow_steps]
 
 
 
@@ -72,145 +111,245 @@ async def execute_complete_workflow(
     type:str = "",
     age:str = "",
     gender = "",
+    inbody_image_bytes: Optional[bytes] = None,
+    on_step: Optional[Callable[[list], None]] = None,
 ) -> dict:
     """
-    Execute the complete workflow: (history summary) -> InBody image -> gym plan -> nutrition plan
+    Execute the complete workflow: (history summary || InBody image) -> calorie target -> (gym plan || nutrition plan)
+
+    Steps run as a dependency graph (see Agents.workflow_dag): the history
+    summary and the InBody analysis run concurrently, then the gym and
+    nutrition plans run concurrently on the computed calorie target.
+
+    The InBody image is downloaded from inbody_image_url unless its bytes
+    were uploaded directly (inbody_image_bytes). on_step, when given, is
+    called with the serialized workflow steps on every step change.
     """
-    image = await process_inbody_image(inbody_image_url)
-    if not image:
-            return {
+    with track_usage() as tracker:
+        return await _run_complete_workflow(
+            tracker, inbody_image_url, client_country, goals, allergies, injuries,
+            number_of_gym_days, user_id, language, time, type, age, gender, inbody_image_bytes, on_step
+        )
+
+
+async def _run_complete_workflow(
+    tracker,
+    inbody_image_url: str,
+    client_country: str,
+    goals: str,
+    allergies: str,
+    injuries: str,
+    number_of_gym_days: str,
+    user_id: str,
+    language: str,
+    time: str,
+    type: str,
+    age: str,
+    gender,
+    inbody_image_bytes: Optional[bytes] = None,
+    on_step: Optional[Callable[[list], None]] = None,
+) -> dict:
+    steps: Dict[str, WorkflowStep] = {}
+
+    def notify():
+        if on_step is not None:
+            try:
+                on_step([step.dict() for step in steps.values()])
+            except Exception as e:
+                print(f"Error reporting workflow steps: {e}")
+
+    def on_status(name, status, detail=None):
+        step = steps.get(name)
+        if step is None:
+            step = steps[name] = WorkflowStep(step=name, status=status, message=STEP_MESSAGES[name])
+        step.status = status
+        if status == "skipped":
+            step.message = detail or SKIPPED_MESSAGES.get(name, "Skipped")
+        elif status == "failed" and detail is not None:
+            step.message = str(detail)
+        elif status == "cancelled":
+            step.message = "Cancelled after another step failed"
+        notify()
+
+    async def history_summary(results):
+        # Step 0: Fetch and summarize last plan if exists
+        if not user_id:
+            raise StepSkipped("No previous plan found to summarize")
+        last_plan = await asyncio.to_thread(get_user_plans, user_id)
+        if not last_plan:
+            raise StepSkipped("No previous plan found to summarize")
+        plan_to_summarize = {
+            'gymPlan': last_plan.get('gymPlan'),
+            'nutritionPlan': last_plan.get('nutritionPlan')
+        }
+        with usage_step("history_summary"):
+            summary_result = await summerize_workout_plan(plan_to_summarize)
+        history = {
+            "summary": summary_result.get('summerizer_output') or "",
+            "inbody_data": last_plan.get('inbody_data', "")
+        }
+        if not history["summary"]:
+            raise StepSkipped("No previous plan found to summarize", result=history)
+        steps["history_summary"].message = "Summarized last user plan"
+        steps["history_summary"].data = {"summary": history["summary"]}
+        return history
+
+    async def inbody_analysis(results):
+        # Step 1: InBody Analysis
+        try:
+            if inbody_image_bytes is not None:
+                # Uploaded with the request: no storage round trip
+                image = await load_inbody_upload(inbody_image_bytes)
+            else:
+                # Conditional on the URL's last ETag: an unchanged scan is not downloaded again
+                image = await load_inbody_image(inbody_image_url)
+        except ImageFetchError as e:
+            # Same response as before the download moved into the workflow
+            if inbody_image_bytes is not None:
+                error = f"Invalid InBody image: {str(e)}"
+            else:
+                error = f"Invalid or inaccessible image URL: {str(e)}"
+            raise StepFailed(error, {"error": error})
+        except Exception as e:
+            print(f"Error processing InBody image: {e}")
+            raise StepFailed("Failed to process InBody image", {
                 "error": "Failed to process InBody image",
                 "status": "error"
-            }
-    workflow_steps = []
-    try:
-        # Step 0: Fetch and summarize last plan if exists
-        last_plan_summary = ""
-        last_plan_inbody_data=""
-        if user_id:
-            last_plan = get_user_plans(user_id)
-            if last_plan:
-               
-                plan_to_summarize = {
-                    'gymPlan': last_plan.get('gymPlan'),
-                    'nutritionPlan': last_plan.get('nutritionPlan')
-                }
-                summary_result = await summerize_workout_plan(plan_to_summarize)
-                last_plan_summary = summary_result.get('summerizer_output')
-                last_plan_inbody_data=last_plan.get('inbody_data',"")
-        workflow_steps.append(WorkflowStep(
-            step="history_summary",
-            status="completed" if last_plan_summary else "skipped",
-            message="Summarized last user plan" if last_plan_summary else "No previous plan found to summarize",
-            data={"summary": last_plan_summary} if last_plan_summary else None
-        ))
-        # 1: InBody Analysis
-        workflow_steps.append(WorkflowStep(
-            step="inbody_analysis",
-            status="processing",
-            message="Processing InBody image and extracting body composition data"
-        ))
-        inbody_result = await process_inbody_analysis(image)
+            })
+        with usage_step("inbody_analysis"):
+            inbody_result = await process_inbody_analysis(image, user_id=user_id)
         if inbody_result["status"] == "error":
-            workflow_steps[-1].status = "failed"
-            workflow_steps[-1].message = inbody_result.get("error", "InBody analysis failed")
-            return {
+            raise StepFailed(inbody_result.get("error", "InBody analysis failed"), {
                 "message": "Workflow failed at InBody analysis step",
-                "workflow_steps": [step.dict() for step in workflow_steps],
                 "status": "error"
-            }
+            })
         if (inbody_result["analysis"]["status"] == "not valid image"):
-            workflow_steps[-1].status = "failed"
-            workflow_steps[-1].message = inbody_result.get("error", "InBody analysis failed")
-            return {
+            raise StepFailed("InBody analysis failed", {
                 "message": "failed as the image is not InBody analysis",
                 "status": "error"
-            }
-        workflow_steps[-1].status = "completed"
-        workflow_steps[-1].message = "InBody analysis completed successfully"
-        workflow_steps[-1].data = {"analysis": inbody_result["analysis"]}
-        inbody_data=inbody_result["analysis"]["results"]
-        gym_result=None
-        calories = ""
-
-        if int(number_of_gym_days) > 0:
-            # Step 2: Gym Plan Creation
-            workflow_steps.append(WorkflowStep(
-                step="gym_plan_creation",
-                status="processing",
-                message="Creating comprehensive gym plan"
-            ))
+            })
+        steps["inbody_analysis"].message = "InBody analysis completed successfully"
+        steps["inbody_analysis"].data = {"analysis": inbody_result["analysis"], "cached": inbody_result["cached"]}
+        return inbody_result["analysis"]["results"]
+
+    def gym_plan_requested(results):
+        return int(number_of_gym_days) > 0
+
+    async def calorie_target(results):
+        # Deterministic target shared by the gym and nutrition plans
+        target = daily_calorie_target(results["inbody_analysis"], age, gender, goals, number_of_gym_days)
+        if target is None:
+            if gym_plan_requested(results):
+                raise StepSkipped("Not enough InBody data to compute a calorie target; calories taken from the gym plan")
+            raise StepSkipped("Not enough InBody data to compute a calorie target; the nutrition plan sets the calories")
+        steps["calorie_target"].message = f"Daily calorie target: {target['daily_calories']} kcal"
+        steps["calorie_target"].data = target
+        return target
+
+    async def gym_plan_creation(results):
+        # Step 2: Gym Plan Creation
+        history = results.get("history_summary") or {}
+        target = results.get("calorie_target")
+        with usage_step("gym_plan_creation"):
             gym_result = await create_comprehensive_workout_plan(
-                inbody_data,
+                results["inbody_analysis"],
                 injuries,
                 goals,
                 number_of_gym_days,
-                last_plan_summary,
-                last_plan_inbody_data,
+                history.get("summary", ""),
+                history.get("inbody_data", ""),
                 type,
                 age,
-                gender
-                
+                gender,
+                calories=target["daily_calories"] if target else None
             )
-            if gym_result["status"] == "error":
-                workflow_steps[-1].status = "failed"
-                workflow_steps[-1].message = gym_result.get("error", "Gym plan creation failed")
-                return {
-                    "message": "Workflow failed at gym plan creation step",
-                    "workflow_steps": [step.dict() for step in workflow_steps],
-                    "status": "error"
-                }
-            workflow_steps[-1].status = "completed"
-            workflow_steps[-1].message = "Gym plan created successfully"
-            workflow_steps[-1].data = {"gym_plan": gym_result["workout_plan"]}
-
-        # Extract calories from gym plan
-            
+        if gym_result["status"] == "error":
+            raise StepFailed(gym_result.get("error", "Gym plan creation failed"), {
+                "message": "Workflow failed at gym plan creation step",
+                "status": "error"
+            })
+        steps["gym_plan_creation"].message = "Gym plan created successfully"
+        steps["gym_plan_creation"].data = {"gym_plan": gym_result["workout_plan"]}
+        return gym_result
+
+    async def nutrition_planning(results):
+        # Step 3: Nutrition Plan Creation
+        history = results.get("history_summary") or {}
+        target = results.get("calorie_target")
+        gym_result = None
+        if not target:
+            # No computed target: the calories come from the gym plan, so wait for it
+            gym_result = await workflow.wait_for("gym_plan_creation")
+
+        # Computed target, otherwise the calories of the gym plan
+        calories = target["daily_calories"] if target else ""
+        if not calories and gym_result:
             plan = gym_result["workout_plan"]
             if hasattr(plan, "daily_calories"):
                 calories = plan.daily_calories
             elif isinstance(plan, dict) and "daily_calories" in plan:
                 calories = plan["daily_calories"]
 
-        # Step 3: Nutrition Plan Creation
-        workflow_steps.append(WorkflowStep(
-            step="nutrition_planning",
-            status="processing",
-            message="Creating comprehensive nutrition plan with evaluation"
-        ))
-        nutrition_result = await create_comprehensive_nutrition_plan(
-            language,
-            inbody_data,
-            calories ,
-            number_of_gym_days,
-            client_country,
-            goals,
-            allergies,
-            last_plan_summary,
-            last_plan_inbody_data,
-            age,
-            gender
-        )
+        nutrition_step = steps["nutrition_planning"]
+
+        def report_nutrition_progress(entry, progress):
+            nutrition_step.message = (
+                f"Received {progress['entries_received']} meal entries "
+                f"({progress['days_completed']} complete days)"
+            )
+            nutrition_step.data = {"progress": {k: v for k, v in progress.items() if k != "partial_plan"}}
+            notify()
+
+        with usage_step("nutrition_planning"):
+            nutrition_result = await create_comprehensive_nutrition_plan(
+                language,
+                results["inbody_analysis"],
+                calories ,
+                number_of_gym_days,
+                client_country,
+                goals,
+                allergies,
+                history.get("summary", ""),
+                history.get("inbody_data", ""),
+                age,
+                gender,
+                on_day_plan=report_nutrition_progress
+            )
         if nutrition_result["status"] == "error":
-            workflow_steps[-1].status = "failed"
-            workflow_steps[-1].message = nutrition_result.get("error", "Nutrition planning failed")
-            return {
+            raise StepFailed(nutrition_result.get("error", "Nutrition planning failed"), {
                 "message": "Workflow failed at nutrition planning step",
-                "workflow_steps": [step.dict() for step in workflow_steps],
                 "status": "error"
-            }
-        workflow_steps[-1].status = "completed"
-        workflow_steps[-1].message = "Nutrition plan created and evaluated successfully"
-        workflow_steps[-1].data = {"diet_plan": nutrition_result["diet_plan"]}
+            })
+        nutrition_step.message = "Nutrition plan created and evaluated successfully"
+        nutrition_step.data = {"diet_plan": nutrition_result["diet_plan"]}
+        return nutrition_result
 
-        # Step 4: Workflow Completion
-        workflow_steps.append(WorkflowStep(
-            step="workflow_completion",
-            status="completed",
-            message="Complete workflow finished successfully"
-        ))
+    # History summary and InBody analysis are independent and run concurrently;
+    # with a computed calorie target the gym and nutrition teams do too.
+    # Without the calorie engine there is no calorie_target step at all.
+    plan_deps = ("history_summary", "inbody_analysis") + (("calorie_target",) if CALORIE_ENGINE_ENABLED else ())
+    workflow = DagExecutor([
+        DagNode("history_summary", history_summary),
+        DagNode("inbody_analysis", inbody_analysis),
+        *([DagNode("calorie_target", calorie_target, deps=("inbody_analysis",))] if CALORIE_ENGINE_ENABLED else []),
+        DagNode("gym_plan_creation", gym_plan_creation, deps=plan_deps, when=gym_plan_requested),
+        # Waits for the gym plan itself when there is no computed calorie target
+        DagNode("nutrition_planning", nutrition_planning, deps=plan_deps),
+    ], on_status=on_status)
+
+    try:
+        results = await workflow.run()
+        inbody_data = results["inbody_analysis"]
+        gym_result = results["gym_plan_creation"]
+        nutrition_result = results["nutrition_planning"]
         # Save plan to DB if user_id is provided
         if user_id:
+            db_step = steps["db_save"] = WorkflowStep(
+                step="db_save",
+                status="processing",
+                message="Saving plan to DB"
+            )
+            notify()
             try:
                 save_full_user_plan(
                     user_id=user_id,
@@ -224,18 +363,42 @@ async def execute_complete_workflow(
                 )
                 increment_used_requests(user_id)
                 send_plan_created_notification(user_id)
+                db_step.status = "completed"
+                db_step.message = "Plan saved to DB"
             except Exception as e:
-                # Optionally log or append to workflow_steps
-                workflow_steps.append(WorkflowStep(
-                    step="db_save",
-                    status="failed",
-                    message=f"Failed to save plan to DB: {str(e)}"
-                ))
+                db_step.status = "failed"
+                db_step.message = f"Failed to save plan to DB: {str(e)}"
+            notify()
+        workflow_steps = list(steps.values())
+
+        # Step 4: Workflow Completion
+        workflow_steps.append(WorkflowStep(
+            step="workflow_completion",
+            status="completed",
+            message="Complete workflow finished successfully"
+        ))
         return {
             "nutrition_result":nutrition_result,
+            "workflow_steps": serialize_steps(workflow_steps, tracker),
+            "usage": tracker.summary(),
             "status": "success"
         }
+    except DagFailed as e:
+        workflow_steps = list(steps.values())
+        if isinstance(e.error, StepFailed):
+            return {**e.error.response, "workflow_steps": serialize_steps(workflow_steps, tracker)}
+        workflow_steps.append(WorkflowStep(
+            step="workflow_error",
+            status="failed",
+            message=f"Workflow failed with error: {str(e.error)}"
+        ))
+        return {
+            "message": f"Workflow execution failed: {str(e.error)}",
+            "workflow_steps": serialize_steps(workflow_steps, tracker),
+            "status": "error"
+        }
     except Exception as e:
+        workflow_steps = list(steps.values())
         workflow_steps.append(WorkflowStep(
             step="workflow_error",
             status="failed",
@@ -243,60 +406,210 @@ async def execute_complete_workflow(
         ))
         return {
             "message": f"Workflow execution failed: {str(e)}",
-            "workflow_steps": [step.dict() for step in workflow_steps],
+            "workflow_steps": serialize_steps(workflow_steps, tracker),
             "status": "error"
         }
 
+async def read_workflow_request(request: Request):
+    """Workflow arguments of a create_complete_plan request; returns (kwargs, error response)"""
+    # JSON (image URL or base64) or multipart with the image file
+    data, inbody_image_bytes = await read_image_request(request, "inbody_image")
+    if not data:
+        return None, {"error": "No data provided"}
+    required_fields = ['age','gender','type','time','user_id', 'client_country', 'goals', 'injuries', 'number_of_gym_days']
+    if inbody_image_bytes is None:
+        required_fields.append('inbody_image_url')
+    for field in required_fields:
+        if field not in data:
+            return None, {"error": f"Missing required field: {field}"}
+    # The image URL is validated by the single GET that downloads it in the workflow
+    return {
+        "inbody_image_url": data.get('inbody_image_url', ''),
+        "client_country": data['client_country'],
+        "goals": data['goals'],
+        "allergies": data.get('allergies', ''),
+        "injuries": data['injuries'],
+        "number_of_gym_days": data['number_of_gym_days'],
+        "user_id": data.get('user_id', None),
+        "language": data.get('lang', "english"),
+        "time": data['time'],
+        "type": data['type'],
+        "age": data['age'],
+        "gender": data['gender'],
+        "inbody_image_bytes": inbody_image_bytes,
+    }, None
+
+def workflow_request_key(request: Request, workflow_args: dict) -> str:
+    """Idempotency key of a workflow request (Idempotency-Key header or derived from its inputs)"""
+    inputs = {name: value for name, value in workflow_args.items() if name != "inbody_image_bytes"}
+    return request_key(
+        workflow_args["user_id"],
+        request.headers.get("idempotency-key"),
+        workflow_args["inbody_image_bytes"],
+        inputs
+    )
+
+async def execute_workflow_once(key: str, workflow_args: dict, on_step=None) -> dict:
+    """Run the workflow unless an identical request is running or already finished"""
+    result, outcome = await run_idempotent(key, lambda: execute_complete_workflow(**workflow_args, on_step=on_step))
+    return {**result, "idempotency": outcome}
+
 # Flask routes for Plan Workflow
 @router.post('/create_complete_plan')
 async def create_complete_plan(request: Request):
     """Main endpoint for complete nutrition and gym planning workflow"""
     try:
-        data = await request.json()
-        if not data:
-            return {"error": "No data provided"}
-        required_fields = ['age','gender','type','time','user_id','inbody_image_url', 'client_country', 'goals', 'injuries', 'number_of_gym_days']
-        for field in required_fields:
-            if field not in data:
-                return {"error": f"Missing required field: {field}"}
-        inbody_image_url = data['inbody_image_url']
-        client_country = data['client_country']
-        goals = data['goals']
-        allergies = data.get('allergies', '')
-        injuries = data['injuries']
-        number_of_gym_days = data['number_of_gym_days']
-        user_id = data.get('user_id', None)
-        language = data.get('lang', "english")
-        time = data['time']
-        type_ = data['type']
-        age = data['age']
-        gender = data['gender']
-        # Validate image URL
-        try:
-            response = requests.head(inbody_image_url, timeout=10)
-            response.raise_for_status()
-        except Exception as e:
-            return {"error": f"Invalid or inaccessible image URL: {str(e)}"}
-       
-        
-        result = await execute_complete_workflow(
-                
-                inbody_image_url,
-                client_country,
-                goals,
-                allergies,
-                injuries,
-                number_of_gym_days,
-                user_id,
-                language,
-                time,
-                type_,
-                age,
-                gender
-            )
+        workflow_args, error = await read_workflow_request(request)
+        if error:
+            return error
+        # A double-submitted request awaits or replays the first one
+        result = await execute_workflow_once(workflow_request_key(request, workflow_args), workflow_args)
         
             
         return result
+    except ImageFetchError as e:
+        return {"error": f"Invalid InBody image: {str(e)}"}
+    except Exception as e:
+        return {"error": f"Server error: {str(e)}"}
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+
+class StepUpdates:
+    """Step snapshots of a streamed workflow, kept only while its client listens"""
+
+    def __init__(self):
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self.closed = False
+
+    def put(self, snapshot) -> None:
+        # The workflow outlives a dropped connection: stop queuing what nobody reads
+        if not self.closed:
+            self._queue.put_nowait(snapshot)
+
+    async def get(self):
+        return await self._queue.get()
+
+    def close(self) -> None:
+        self.closed = True
+        while not self._queue.empty():
+            self._queue.get_nowait()
+
+
+async def stream_workflow_events(workflow: asyncio.Task, updates: StepUpdates):
+    """
+    Server-sent events for a running workflow:
+    - step: a workflow step changed (status, message or progress)
+    - gym_plan: the gym plan, as soon as it is created
+    - result: the final workflow response, after which the stream ends
+    Comment lines keep idle connections open through proxies.
+    """
+    sent: Dict[str, dict] = {}
+    try:
+        while True:
+            try:
+                snapshot = await asyncio.wait_for(updates.get(), SSE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if snapshot is None:
+                break
+            for step in snapshot:
+                if sent.get(step["step"]) == step:
+                    continue
+                sent[step["step"]] = step
+                if step["step"] == "gym_plan_creation" and step["status"] == "completed" and step.get("data"):
+                    yield sse_event("gym_plan", step["data"])
+                    step = {**step, "data": None}
+                yield sse_event("step", step)
+        try:
+            result = workflow.result()
+        except asyncio.CancelledError:
+            # Cancelled by the server shutting down
+            result = {"message": "Workflow execution failed: the server is shutting down", "status": "error"}
+        except Exception as e:
+            result = {"message": f"Workflow execution failed: {str(e)}", "status": "error"}
+        yield sse_event("result", result)
+    finally:
+        updates.close()
+
+@router.post('/create_complete_plan/stream')
+async def create_complete_plan_stream(request: Request):
+    """Complete workflow with its step transitions streamed as server-sent events"""
+    try:
+        workflow_args, error = await read_workflow_request(request)
+        if error:
+            return error
+    except ImageFetchError as e:
+        return {"error": f"Invalid InBody image: {str(e)}"}
+    except Exception as e:
+        return {"error": f"Server error: {str(e)}"}
+
+    updates = StepUpdates()
+    # Not tied to the connection: a client that drops still gets its plan saved
+    # A duplicate of a running request only gets the final result event
+    workflow = asyncio.create_task(execute_workflow_once(
+        workflow_request_key(request, workflow_args), workflow_args, on_step=updates.put
+    ))
+    _streamed_workflows.add(workflow)
+    workflow.add_done_callback(_streamed_workflows.discard)
+    workflow.add_done_callback(lambda _: updates.put(None))
+    return StreamingResponse(
+        stream_workflow_events(workflow, updates),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def run_complete_plan_job(payload: dict, report_steps) -> dict:
+    """Background job handler: run the complete workflow for a queued request"""
+    key = payload.pop("idempotency_key", None)
+    image = payload.pop("inbody_image_base64", None)
+    if image:
+        payload["inbody_image_bytes"] = base64.b64decode(image)
+    if key is None:
+        # Queued before requests were keyed
+        return await execute_complete_workflow(**payload, on_step=report_steps)
+    return await execute_workflow_once(key, payload, on_step=report_steps)
+
+register_job_handler("complete_plan", run_complete_plan_job)
+
+@router.post('/jobs/complete_plan')
+async def submit_complete_plan_job(request: Request):
+    """Queue a complete plan workflow; returns a job id to poll instead of holding the connection"""
+    try:
+        workflow_args, error = await read_workflow_request(request)
+        if error:
+            return error
+        key = workflow_request_key(request, workflow_args)
+        image = workflow_args.pop("inbody_image_bytes")
+        if image is not None:
+            workflow_args["inbody_image_base64"] = base64.b64encode(image).decode("ascii")
+        job_store = get_job_store()
+        if job_store is None:
+            return {"error": "Background jobs are unavailable"}
+        job_id = await job_store.create("complete_plan", {**workflow_args, "idempotency_key": key})
+        return {
+            "job_id": job_id,
+            "status": "queued",
+            "status_url": f"{request.url.path.rsplit('/', 1)[0]}/{job_id}"
+        }
+    except ImageFetchError as e:
+        return {"error": f"Invalid InBody image: {str(e)}"}
+    except Exception as e:
+        return {"error": f"Server error: {str(e)}"}
+
+@router.get('/jobs/{job_id}')
+async def get_complete_plan_job(job_id: str):
+    """Status, step progress and (once finished) result of a queued workflow"""
+    try:
+        job_store = get_job_store()
+        if job_store is None:
+            return {"error": "Background jobs are unavailable"}
+        job = await job_store.get(job_id)
+        if job is None:
+            return {"error": "Job not found"}
+        return job
     except Exception as e:
         return {"error": f"Server error: {str(e)}"}
 
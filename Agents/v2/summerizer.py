@@ -12,6 +12,7 @@ import asyncio
 from pydantic import BaseModel
 from typing import List, Optional
 from . import initialize_azure_client
+from Agents.prompt_builder import PromptBuilder, input_budget
 from autogen_agentchat.conditions import TextMentionTermination
 from autogen_agentchat.teams import RoundRobinGroupChat
 
@@ -26,7 +27,7 @@ router = APIRouter()
 
 def create_summerizer_agent():
     """Create and return the summerizer agent"""
-    client = initialize_azure_client()
+    client = initialize_azure_client("summarizer")
     if not client:
         return None
     summerizer_system_message = f"""
@@ -60,9 +61,8 @@ async def summerize_workout_plan(plan):
         
         # Prepare workout plan message
         
-        user_message = f"""
-        plans: {plan}
-        """
+        # The plans are the whole prompt: trimmable, so oversized plans are cut to the budget
+        user_message = PromptBuilder(input_budget("summarizer")).add("plans", plan, required=False).build()
         message = TextMessage(content=user_message, source="user")
         
         Inbody_Speciallist_response = await summerizer.on_messages([message], cancellation_token=CancellationToken())
@@ -0,0 +1,160 @@
+"""
+Workflow DAG - Run workflow steps as a dependency graph
+
+execute_complete_workflow used to await every step in sequence although some
+of them (the history summary and the InBody analysis) do not depend on each
+other. Steps are now declared as DagNode objects with their dependencies and
+DagExecutor runs each node as soon as all of its dependencies have finished,
+so independent nodes run concurrently.
+
+- a node receives the results of all finished nodes (keyed by node name)
+- `when` skips a node (e.g. no gym days requested); dependents still run
+- a node that only sometimes needs another node awaits it with wait_for()
+  instead of declaring the dependency
+- a node can skip itself with StepSkipped or fail with StepFailed
+- the first failure cancels every running node and is raised as DagFailed
+- every status change (processing, completed, skipped, failed, cancelled) is
+  reported through on_status, which the workflow maps onto WorkflowStep
+
+Node durations are exported on /metrics.
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+from Agents.metrics import Histogram
+
+step_seconds = Histogram("nutrifit_workflow_step_seconds", "Duration of workflow DAG nodes by step and status")
+
+
+class StepSkipped(Exception):
+    """Raised by a node that has nothing to do; `result` is still passed to dependents"""
+
+    def __init__(self, message: str, result: Any = None):
+        super().__init__(message)
+        self.result = result
+
+
+class StepFailed(Exception):
+    """Raised by a node to fail the workflow with a specific response"""
+
+    def __init__(self, message: str, response: Optional[dict] = None):
+        super().__init__(message)
+        self.response = response or {"message": message, "status": "error"}
+
+
+class DagFailed(Exception):
+    """A node failed; the remaining nodes were cancelled"""
+
+    def __init__(self, node: str, error: Exception):
+        super().__init__(f"Step '{node}' failed: {error}")
+        self.node = node
+        self.error = error
+
+
+@dataclass
+class DagNode:
+    name: str
+    run: Callable[[Dict[str, Any]], Awaitable[Any]]
+    deps: Sequence[str] = ()
+    when: Optional[Callable[[Dict[str, Any]], bool]] = None
+
+
+StatusCallback = Callable[[str, str, Optional[Any]], None]
+
+
+def topological_order(nodes: List[DagNode]) -> List[DagNode]:
+    """Nodes ordered so that every node comes after its dependencies (declaration order otherwise)"""
+    by_name = {node.name: node for node in nodes}
+    if len(by_name) != len(nodes):
+        raise ValueError("Duplicate workflow step names")
+    ordered, visiting, done = [], set(), set()
+
+    def visit(node: DagNode):
+        if node.name in done:
+            return
+        if node.name in visiting:
+            raise ValueError(f"Dependency cycle at workflow step '{node.name}'")
+        visiting.add(node.name)
+        for dep in node.deps:
+            if dep not in by_name:
+                raise ValueError(f"Workflow step '{node.name}' depends on unknown step '{dep}'")
+            visit(by_name[dep])
+        visiting.discard(node.name)
+        done.add(node.name)
+        ordered.append(node)
+
+    for node in nodes:
+        visit(node)
+    return ordered
+
+
+class DagExecutor:
+    """Run DagNodes concurrently in dependency order"""
+
+    def __init__(self, nodes: List[DagNode], on_status: Optional[StatusCallback] = None):
+        self.nodes = topological_order(nodes)
+        self.on_status = on_status or (lambda name, status, detail: None)
+        self.results: Dict[str, Any] = {}
+        self.statuses: Dict[str, str] = {node.name: "pending" for node in self.nodes}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def _set_status(self, name: str, status: str, detail: Any = None) -> None:
+        self.statuses[name] = status
+        try:
+            self.on_status(name, status, detail)
+        except Exception as e:
+            print(f"Error reporting workflow step status for '{name}': {e}")
+
+    async def _run_node(self, node: DagNode, tasks: Dict[str, asyncio.Task]) -> None:
+        if node.deps:
+            await asyncio.gather(*(tasks[dep] for dep in node.deps))
+        if node.when is not None and not node.when(self.results):
+            self.results[node.name] = None
+            self._set_status(node.name, "skipped")
+            return
+        self._set_status(node.name, "processing")
+        start = time.monotonic()
+        try:
+            result = await node.run(self.results)
+        except StepSkipped as e:
+            self.results[node.name] = e.result
+            step_seconds.observe(time.monotonic() - start, step=node.name, status="skipped")
+            self._set_status(node.name, "skipped", str(e))
+            return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            step_seconds.observe(time.monotonic() - start, step=node.name, status="failed")
+            self._set_status(node.name, "failed", e)
+            raise DagFailed(node.name, e) from e
+        self.results[node.name] = result
+        step_seconds.observe(time.monotonic() - start, step=node.name, status="completed")
+        self._set_status(node.name, "completed")
+
+    async def wait_for(self, name: str) -> Any:
+        """Result of a node, once it has finished (for use inside another running node)"""
+        await asyncio.shield(self._tasks[name])
+        return self.results.get(name)
+
+    async def run(self) -> Dict[str, Any]:
+        """Run the graph; returns the node results or raises DagFailed"""
+        tasks = self._tasks
+        for node in self.nodes:
+            tasks[node.name] = asyncio.ensure_future(self._run_node(node, tasks))
+        try:
+            done, pending = await asyncio.wait(tasks.values(), return_when=asyncio.FIRST_EXCEPTION)
+            failures = [task.exception() for task in done if not task.cancelled() and task.exception()]
+            if failures:
+                # DagFailed names the node that failed (dependents re-raise the same error)
+                raise next((f for f in failures if isinstance(f, DagFailed)), failures[0])
+            return self.results
+        finally:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            for name, status in list(self.statuses.items()):
+                if status in ("pending", "processing"):
+                    self._set_status(name, "cancelled")
@@ -0,0 +1,79 @@
+"""
+Benchmark Script for the Complete Plan Workflow
+
+Runs execute_complete_workflow against the deterministic fake model client
+(MODEL_PROVIDER=fake) so the pipeline can be benchmarked and profiled offline
+without spending provider quota. The LLM cache, the InBody result cache and
+the perceptual-hash index are disabled so every run does the same work.
+
+Usage:
+    python benchmark_workflow.py --image-file inbody.jpg --runs 20 --concurrency 5
+    python benchmark_workflow.py --image-url https://example.com/inbody.jpg --runs 20
+    FAKE_MODEL_LATENCY=lognormal:0.5,0.4 python benchmark_workflow.py --image-file ...
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+os.environ.setdefault("MODEL_PROVIDER", "fake")
+os.environ.setdefault("LLM_CACHE_ENABLED", "false")
+os.environ.setdefault("INBODY_CACHE_ENABLED", "false")
+os.environ.setdefault("INBODY_PHASH_ENABLED", "false")
+
+from Agents.v2.plan_workflow import execute_complete_workflow
+
+
+async def run_once(image_url, image_bytes=None):
+    start = time.perf_counter()
+    result = await execute_complete_workflow(
+        image_url,
+        client_country="Egypt",
+        goals="Weight loss and muscle building",
+        allergies="",
+        injuries="none",
+        number_of_gym_days="4",
+        user_id=None,
+        age="30",
+        gender="male",
+        type="gym",
+        inbody_image_bytes=image_bytes,
+    )
+    return time.perf_counter() - start, result.get("status")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark execute_complete_workflow with the fake model client")
+    image = parser.add_mutually_exclusive_group(required=True)
+    image.add_argument("--image-file", help="local InBody image (no network access needed)")
+    image.add_argument("--image-url", help="InBody image URL, downloaded on every run")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=1)
+    args = parser.parse_args()
+
+    image_bytes = None
+    if args.image_file:
+        with open(args.image_file, "rb") as f:
+            image_bytes = f.read()
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def bounded():
+        async with semaphore:
+            return await run_once(args.image_url or "", image_bytes)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(bounded() for _ in range(args.runs)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for latency, _ in results)
+    failures = sum(1 for _, status in results if status != "success")
+    print(f"runs={args.runs} concurrency={args.concurrency} failures={failures} wall={elapsed:.2f}s")
+    print(f"mean={statistics.mean(latencies):.3f}s p50={latencies[len(latencies) // 2]:.3f}s "
+          f"p95={latencies[int(0.95 * (len(latencies) - 1))]:.3f}s max={latencies[-1]:.3f}s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
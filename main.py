@@ -1,4 +1,6 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 import os
@@ -18,6 +20,12 @@ from Agents.v1.inbody_specialist import router as inbody_router_v1
 from Agents.v1.plan_workflow import router as workflow_router_v1
 from Agents.v1.notification import router as notification_router_v1
 from Agents.v1.summerizer import router as summerizer_router_v1  # if needed
+from Agents.model_clients import open_model_clients, close_model_clients
+from Agents.llm_cache import close_caches
+from Agents.rate_limiter import close_rate_limiters
+from Agents.image_fetcher import close_image_fetcher
+from Agents.metrics import render_metrics
+from Agents.job_queue import start_job_workers, stop_job_workers
 
 # Load environment variables
 load_dotenv()
@@ -40,7 +48,19 @@ cred = credentials.Certificate(service_account_info)
 firebase_admin.initialize_app(cred)
 db = firestore.client()
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Shared model clients (one pooled HTTP client per provider/model)
+    open_model_clients()
+    start_job_workers()
+    yield
+    await stop_job_workers()
+    await close_model_clients()
+    await close_caches()
+    await close_rate_limiters()
+    await close_image_fetcher()
+
+app = FastAPI(lifespan=lifespan)
 
 # Enable CORS for all routes
 app.add_middleware(
@@ -87,6 +107,10 @@ def ping():
         "message": "NutriFit Agents API is running"
     }
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return render_metrics()
+
 @app.get("/status")
 def status():
     # You may want to implement agent checks here as in Flask, or simplify
@@ -108,7 +132,8 @@ def documentation():
             "main": {
                 "GET /": "This documentation",
                 "GET /health": "Main health check",
-                "GET /status": "Detailed agent status"
+                "GET /status": "Detailed agent status",
+                "GET /metrics": "Prometheus metrics (per-agent tokens/cost/latency, cache hit/miss, rate limiter queue wait, ...)"
             },
             "inbody_specialist": {
                 "POST /inbody/analyze": "Comprehensive body composition analysis",
@@ -191,7 +216,8 @@ def documentation():
                 "outputs": [
                     "inbody_analysis: Extracted body composition data",
                     "nutrition_plan: 4-week validated diet plan",
-                    "workflow_steps: Detailed execution status"
+                    "workflow_steps: Detailed execution status with per-step token/cost/latency usage",
+                    "usage: Token, cost and latency totals for the whole workflow"
                 ]
             }
         }
@@ -0,0 +1,17 @@
+"""
+Test configuration: every persistent store and cache points at a temporary
+directory (or memory) before the Agents modules are imported, and model calls
+go to the deterministic fake client.
+"""
+
+import os
+import tempfile
+
+_data_dir = tempfile.mkdtemp(prefix="nutrifit-tests-")
+
+os.environ.setdefault("MODEL_PROVIDER", "fake")
+for prefix in ("LLM", "INBODY", "IDEMPOTENCY"):
+    os.environ.setdefault(f"{prefix}_CACHE_BACKEND", "memory")
+os.environ.setdefault("INBODY_PHASH_PATH", os.path.join(_data_dir, "inbody_phash.sqlite3"))
+os.environ.setdefault("JOB_STORE_PATH", os.path.join(_data_dir, "jobs.sqlite3"))
+os.environ.setdefault("IDEMPOTENCY_CLAIM_PATH", os.path.join(_data_dir, "idempotency_claims.sqlite3"))
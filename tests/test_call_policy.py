@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("autogen_core")
+pytest.importorskip("openai")
+
+from autogen_core.models import UserMessage
+
+from Agents.call_policy import ResilientChatCompletionClient
+from Agents.fake_model_client import FakeChatCompletionClient
+from Agents.rate_limiter import ProviderRateLimiter, RateLimitedChatCompletionClient
+
+MESSAGES = [UserMessage(content="hello", source="user")]
+
+
+def limited_client(latency: float, max_concurrency: int):
+    limiter = ProviderRateLimiter("test", 0, 0, max_concurrency)
+    fake = FakeChatCompletionClient(latency=f"fixed:{latency}")
+    return RateLimitedChatCompletionClient(fake, limiter), fake
+
+
+def test_time_queued_in_the_limiter_does_not_count_against_the_timeout():
+    limited, _ = limited_client(0.15, max_concurrency=1)
+    client = ResilientChatCompletionClient(limited, timeout=0.25, max_retries=0, hedge=False)
+
+    async def scenario():
+        # The second call waits ~0.15s for the single slot, then runs 0.15s
+        return await asyncio.gather(client.create(MESSAGES), client.create(MESSAGES))
+
+    results = asyncio.run(scenario())
+
+    assert len(results) == 2
+
+
+def test_slow_attempts_still_time_out():
+    limited, _ = limited_client(0.3, max_concurrency=1)
+    client = ResilientChatCompletionClient(limited, timeout=0.1, max_retries=0, hedge=False)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(client.create(MESSAGES))
+
+
+def count_calls(fake):
+    calls = []
+    original = fake.create
+
+    async def create(messages, **kwargs):
+        calls.append(1)
+        return await original(messages, **kwargs)
+
+    fake.create = create
+    return calls
+
+
+def test_slow_primary_is_hedged():
+    limited, fake = limited_client(0.2, max_concurrency=4)
+    calls = count_calls(fake)
+    client = ResilientChatCompletionClient(limited, timeout=5, max_retries=0, hedge=True, hedge_delay=0.05)
+
+    asyncio.run(client.create(MESSAGES))
+
+    assert len(calls) == 2
+
+
+def test_no_hedge_while_calls_are_queued_in_the_limiter():
+    limited, fake = limited_client(0.2, max_concurrency=1)
+    calls = count_calls(fake)
+    client = ResilientChatCompletionClient(limited, timeout=5, max_retries=0, hedge=True, hedge_delay=0.05)
+
+    async def scenario():
+        await asyncio.gather(client.create(MESSAGES), client.create(MESSAGES))
+
+    asyncio.run(scenario())
+
+    # Neither call is hedged: the first has the second queued behind it and
+    # the second holds the only slot
+    assert len(calls) == 2
+    assert not limited.congested
@@ -0,0 +1,82 @@
+import pytest
+
+from Agents.calorie_engine import basal_metabolic_rate, daily_calorie_target, goal_type
+
+
+def test_measured_bmr_comes_first():
+    inbody = {"basal_metabolic_rate": 1700, "fat_free_mass": 50, "weight": 80, "height": 180}
+
+    assert basal_metabolic_rate(inbody, 30, "male") == (1700, "inbody")
+
+
+def test_bmr_from_fat_free_mass():
+    assert basal_metabolic_rate({"fat_free_mass": 60}, 30, "male") == (pytest.approx(1666), "katch_mcardle")
+
+
+def test_bmr_from_weight_and_body_fat_percentage():
+    bmr, method = basal_metabolic_rate({"weight": "80", "body_fat_percentage": "25"}, 30, "male")
+
+    assert method == "katch_mcardle"
+    assert bmr == pytest.approx(370 + 21.6 * 60)
+
+
+@pytest.mark.parametrize("gender, expected", [("male", 1780), ("F", 1614), ("أنثى", 1614)])
+def test_bmr_from_weight_height_age_and_gender(gender, expected):
+    bmr, method = basal_metabolic_rate({"weight": 80, "height": 180, "body_fat_percentage": None}, "30", gender)
+
+    assert method == "mifflin_st_jeor"
+    assert bmr == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("inbody, age, gender", [
+    ({"weight": 80, "height": 180}, "", "male"),
+    ({"weight": 80, "height": 180}, 30, "other"),
+    ({"weight": 80}, 30, "male"),
+    ({"basal_metabolic_rate": 0, "fat_free_mass": "n/a"}, 30, "male"),
+])
+def test_no_bmr_without_enough_data(inbody, age, gender):
+    assert basal_metabolic_rate(inbody, age, gender) is None
+    assert daily_calorie_target(inbody, age, gender, "lose fat", 3) is None
+
+
+@pytest.mark.parametrize("goals, expected", [
+    ("Lose fat", "loss"),
+    ("weight loss before summer", "loss"),
+    ("build muscle", "gain"),
+    ("Bulking", "gain"),
+    ("lose fat and gain muscle", "recomposition"),
+    ("خسارة الوزن", "loss"),
+    ("بناء العضلات", "gain"),
+    ("تنشيف وبناء العضلات", "recomposition"),
+    ("stay healthy", "maintenance"),
+    ("", "maintenance"),
+    (None, "maintenance"),
+])
+def test_goal_type(goals, expected):
+    assert goal_type(goals) == expected
+
+
+@pytest.mark.parametrize("goals", [
+    "feel good again",
+    "less fatigue",
+    "weekly massage",
+    "close to my cuticle",
+    "stay in shape for the buildup to the season",
+])
+def test_goal_keywords_match_whole_words(goals):
+    assert goal_type(goals) == "maintenance"
+
+
+def test_daily_target_applies_activity_and_goal():
+    target = daily_calorie_target({"basal_metabolic_rate": 1800}, 30, "male", "lose fat", "3")
+
+    assert target["activity_factor"] == 1.55
+    assert target["tdee"] == 2790
+    assert target["goal"] == "loss"
+    assert target["daily_calories"] == 2250
+
+
+def test_daily_target_never_below_the_floor():
+    target = daily_calorie_target({"basal_metabolic_rate": 1000}, 30, "female", "lose fat", 0)
+
+    assert target["daily_calories"] == 1200
@@ -0,0 +1,97 @@
+import asyncio
+import uuid
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+from Agents import idempotency
+from Agents.idempotency import ClaimStore, request_key, run_idempotent
+
+
+def unique_key() -> str:
+    return request_key("user", explicit_key=uuid.uuid4().hex)
+
+
+def test_derived_key_depends_on_user_image_and_inputs():
+    key = request_key("u1", image_bytes=b"image", inputs={"goals": "lose fat"})
+
+    assert key.startswith("derived:")
+    assert key == request_key("u1", image_bytes=b"image", inputs={"goals": "lose fat"})
+    assert key != request_key("u2", image_bytes=b"image", inputs={"goals": "lose fat"})
+    assert key != request_key("u1", image_bytes=b"other", inputs={"goals": "lose fat"})
+    assert key != request_key("u1", image_bytes=b"image", inputs={"goals": "gain"})
+
+
+def test_explicit_key_is_scoped_to_the_user():
+    assert request_key("u1", explicit_key="k").startswith("explicit:")
+    assert request_key("u1", explicit_key="k") != request_key("u2", explicit_key="k")
+
+
+def test_concurrent_duplicates_share_one_run_and_late_ones_replay():
+    key = unique_key()
+    calls = []
+
+    async def run():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"status": "success", "run": len(calls)}
+
+    async def scenario():
+        concurrent = await asyncio.gather(*(run_idempotent(key, run) for _ in range(3)))
+        late = await run_idempotent(key, run)
+        return concurrent, late
+
+    concurrent, late = asyncio.run(scenario())
+
+    assert len(calls) == 1
+    assert sorted(outcome for _, outcome in concurrent) == ["coalesced", "coalesced", "executed"]
+    assert late == ({"status": "success", "run": 1}, "replayed")
+
+
+def test_failed_runs_are_not_stored():
+    key = unique_key()
+    results = iter([{"status": "error"}, {"status": "success"}])
+
+    async def run():
+        return next(results)
+
+    assert asyncio.run(run_idempotent(key, run)) == ({"status": "error"}, "executed")
+    assert asyncio.run(run_idempotent(key, run)) == ({"status": "success"}, "executed")
+
+
+def test_waits_for_the_result_of_a_run_claimed_by_another_worker(monkeypatch):
+    monkeypatch.setattr(idempotency, "POLL_INTERVAL", 0.02)
+    key = unique_key()
+
+    async def other_worker():
+        claims = idempotency.get_claim_store()
+        assert await claims.claim(key)
+        await asyncio.sleep(0.1)
+        await idempotency.store_result(key, {"status": "success", "owner": "other"})
+        await claims.release(key)
+
+    async def run():
+        raise AssertionError("the duplicate must not run")
+
+    async def scenario():
+        owner = asyncio.create_task(other_worker())
+        await asyncio.sleep(0.01)
+        result = await run_idempotent(key, run)
+        await owner
+        return result
+
+    assert asyncio.run(scenario()) == ({"status": "success", "owner": "other"}, "replayed")
+
+
+def test_claims_are_exclusive_until_released_or_expired(tmp_path, monkeypatch):
+    claims = ClaimStore(str(tmp_path / "claims.sqlite3"))
+
+    assert claims._claim("k")
+    assert not claims._claim("k")
+    claims._release("k")
+    assert claims._claim("k")
+
+    monkeypatch.setattr(idempotency, "CLAIM_SECONDS", -1)
+    assert claims._claim("expiring")
+    assert claims._claim("expiring")
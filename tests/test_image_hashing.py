@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+np = pytest.importorskip("numpy")
+PIL = pytest.importorskip("PIL")
+
+from io import BytesIO
+
+from PIL import Image, ImageDraw
+
+from Agents.image_hashing import ImageHashes, PerceptualIndex, hamming
+
+
+def sheet(seed: int) -> Image.Image:
+    """A synthetic report sheet: rows of dark bars at seed-dependent lengths"""
+    rng = np.random.default_rng(seed)
+    image = Image.new("L", (600, 800), 255)
+    draw = ImageDraw.Draw(image)
+    for row in range(20):
+        length = int(rng.integers(100, 550))
+        draw.rectangle([30, 30 + row * 37, 30 + length, 50 + row * 37], fill=int(rng.integers(0, 120)))
+    return image
+
+
+def recompressed(image: Image.Image) -> Image.Image:
+    buffer = BytesIO()
+    image.convert("RGB").resize((540, 720)).save(buffer, format="JPEG", quality=60)
+    return Image.open(BytesIO(buffer.getvalue()))
+
+
+def test_hamming_counts_differing_bits():
+    assert hamming(0b1011, 0b0001) == 2
+    assert hamming(0, 0) == 0
+
+
+def test_recompressed_copy_is_near_and_other_sheet_is_far():
+    original = ImageHashes.of(sheet(1))
+
+    assert original.distance(ImageHashes.of(recompressed(sheet(1)))) <= 3
+    assert original.distance(ImageHashes.of(sheet(2))) > 3
+
+
+def test_index_matches_only_the_same_users_recent_scans(tmp_path):
+    index = PerceptualIndex(str(tmp_path / "phash.sqlite3"))
+    hashes = ImageHashes.of(sheet(1))
+    asyncio.run(index.add("user-a", "hash-1", hashes))
+
+    near = ImageHashes.of(recompressed(sheet(1)))
+    assert asyncio.run(index.find("user-a", near)) == "hash-1"
+    assert asyncio.run(index.find("user-b", near)) is None
+    assert asyncio.run(index.find("user-a", ImageHashes.of(sheet(2)))) is None
+
+
+def test_index_keeps_the_newest_scans_per_user(tmp_path, monkeypatch):
+    monkeypatch.setattr("Agents.image_hashing.PHASH_MAX_PER_USER", 2)
+    index = PerceptualIndex(str(tmp_path / "phash.sqlite3"))
+    for seed in (1, 2, 3):
+        asyncio.run(index.add("user-a", f"hash-{seed}", ImageHashes.of(sheet(seed))))
+
+    assert asyncio.run(index.find("user-a", ImageHashes.of(sheet(1)))) is None
+    assert asyncio.run(index.find("user-a", ImageHashes.of(sheet(3)))) == "hash-3"
+
+
+def test_index_is_opened_on_first_use_and_falls_back_when_unusable(tmp_path, monkeypatch):
+    from Agents import image_hashing
+
+    blocker = tmp_path / "not-a-directory"
+    blocker.write_text("")
+    monkeypatch.setattr(image_hashing, "PHASH_PATH", str(blocker / "phash.sqlite3"))
+    monkeypatch.setattr(image_hashing, "_index", None)
+    monkeypatch.setattr(image_hashing, "_index_error", None)
+
+    assert image_hashing.get_perceptual_index() is None
+    assert image_hashing._index_error
+
+    path = tmp_path / "data" / "phash.sqlite3"
+    monkeypatch.setattr(image_hashing, "PHASH_PATH", str(path))
+    monkeypatch.setattr(image_hashing, "_index_error", None)
+    assert not path.exists()
+    assert image_hashing.get_perceptual_index() is image_hashing.get_perceptual_index()
+    assert path.exists()
@@ -0,0 +1,53 @@
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("autogen_core")
+pytest.importorskip("PIL")
+
+from PIL import Image, ImageDraw
+
+from Agents.image_preprocessing import find_table_region
+
+# Sheet sections of a 1200x1600 photo: (left, top, right, bottom)
+HEADER = (200, 150, 1000, 240)
+COMPOSITION_TABLE = (200, 300, 650, 900)
+RESEARCH_COLUMN = (800, 300, 1000, 700)
+SEGMENTAL_ANALYSIS = (200, 1150, 1000, 1400)
+
+
+def photographed_sheet(sections, specks=()):
+    """A white sheet with printed text blocks, photographed on a dark desk"""
+    image = Image.new("L", (1200, 1600), 60)
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((150, 100, 1050, 1500), fill=245)
+    for left, top, right, bottom in sections:
+        for y in range(top, bottom, 20):
+            for x in range(left, right, 42):
+                draw.rectangle((x, y, min(x + 30, right), y + 6), fill=20)
+    for x, y in specks:
+        draw.rectangle((x, y, x + 4, y + 4), fill=20)
+    return image
+
+
+def contains(box, section):
+    return box[0] <= section[0] and box[1] <= section[1] and box[2] >= section[2] and box[3] >= section[3]
+
+
+def test_crop_keeps_every_section_of_the_sheet():
+    sections = [HEADER, COMPOSITION_TABLE, RESEARCH_COLUMN, SEGMENTAL_ANALYSIS]
+
+    box = find_table_region(photographed_sheet(sections))
+
+    assert box is not None
+    for section in sections:
+        assert contains(box, section)
+    # The desk around the sheet is still cropped away
+    assert box[0] > 60 and box[1] > 40 and box[2] < 1140 and box[3] < 1560
+
+
+def test_crop_drops_stray_marks():
+    box = find_table_region(photographed_sheet([HEADER, COMPOSITION_TABLE], specks=[(170, 1470)]))
+
+    assert box is not None
+    assert contains(box, HEADER) and contains(box, COMPOSITION_TABLE)
+    assert box[3] < 1200
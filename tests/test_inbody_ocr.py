@@ -0,0 +1,76 @@
+import os
+
+import pytest
+
+pytest.importorskip("PIL")
+
+from Agents.inbody_ocr import OcrLine, extract_fields
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def sheet_lines(name, replace=None):
+    with open(os.path.join(FIXTURES, name)) as f:
+        text = f.read()
+    for old, new in (replace or {}).items():
+        text = text.replace(old, new)
+    return [OcrLine(line, 91.0) for line in text.splitlines() if line.strip()]
+
+
+def test_inbody_770_sheet_reads_the_value_columns():
+    extraction = extract_fields(sheet_lines("inbody_770.txt"))
+
+    assert extraction.layout == "inbody_770"
+    assert extraction.fields == {
+        "weight": 78.5, "height": 175.0, "body_fat_percentage": 21.5, "body_fat_mass": 16.9,
+        "muscle_mass": 35.1, "fat_free_mass": 61.6, "bmi": 25.6, "basal_metabolic_rate": 1700.0,
+        "protein": 12.2, "minerals": 4.21, "body_water": 45.2, "visceral_fat_level": 7.0, "inbody_score": 80,
+    }
+    assert extraction.unverified == []
+    assert extraction.accepted
+
+
+def test_inbody_270_bar_values_next_to_scale_ticks():
+    extraction = extract_fields(sheet_lines("inbody_270.txt"))
+
+    assert extraction.layout == "inbody_270"
+    assert extraction.fields["muscle_mass"] == 22.1
+    assert extraction.fields["body_fat_percentage"] == 38.4
+    assert extraction.fields["bmi"] == 25.0
+    assert extraction.accepted
+
+
+def test_bar_chart_scale_is_not_read_as_the_value():
+    # Weight table missing and the bar value not read: only the scale is left
+    lines = sheet_lines("inbody_770.txt", {
+        "Weight (kg) 78.5 ( 59.9 ~ 81.1 )\n": "",
+        "205 % 78.5": "205 %",
+        "Target Weight 74.1 kg\n": "",
+    })
+
+    extraction = extract_fields(lines)
+
+    assert "weight" not in extraction.fields
+    assert "weight" not in extraction.unverified
+    assert not extraction.accepted
+
+
+def test_value_failing_the_consistency_checks_is_left_to_the_vision_agent():
+    lines = sheet_lines("inbody_770.txt", {"Basal Metabolic Rate 1700": "Basal Metabolic Rate 1780"})
+
+    extraction = extract_fields(lines)
+
+    assert extraction.unverified == ["basal_metabolic_rate"]
+    assert "basal_metabolic_rate" not in extraction.fields
+    assert extraction.fields["fat_free_mass"] == 61.6
+    assert not extraction.accepted
+
+
+def test_unanchored_value_needs_a_consistency_check():
+    # "Height 175cm" has no value column: it stands only through the BMI check
+    lines = [line for line in sheet_lines("inbody_770.txt") if not line.text.startswith("BMI")]
+
+    extraction = extract_fields(lines)
+
+    assert "bmi" not in extraction.fields
+    assert "height" in extraction.unverified
@@ -0,0 +1,24 @@
+import pytest
+
+pytest.importorskip("autogen_agentchat")
+pytest.importorskip("fastapi")
+pytest.importorskip("httpx")
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from Agents.image_fetcher import ImageFetchError
+from Agents.v2 import inbody_specialist
+
+
+def test_analyze_reports_an_unusable_image_as_invalid(monkeypatch):
+    async def load_inbody_image(url):
+        raise ImageFetchError("URL did not return an image (text/html)")
+
+    monkeypatch.setattr(inbody_specialist, "load_inbody_image", load_inbody_image)
+    app = FastAPI()
+    app.include_router(inbody_specialist.router)
+
+    response = TestClient(app).post("/analyze", json={"inbody_image_url": "https://example.com/page"})
+
+    assert response.json() == {"error": "Invalid InBody image: URL did not return an image (text/html)"}
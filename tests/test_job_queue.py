@@ -0,0 +1,85 @@
+import asyncio
+import os
+import tempfile
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+from Agents import job_queue
+from Agents.job_queue import JobWorkerPool, SQLiteJobStore, register_job_handler
+
+
+@pytest.fixture
+def store():
+    return SQLiteJobStore(os.path.join(tempfile.mkdtemp(prefix="nutrifit-jobs-"), "jobs.sqlite3"))
+
+
+def test_jobs_are_claimed_once_in_creation_order(store):
+    first = store._create("plan", {"n": 1})
+    second = store._create("plan", {"n": 2})
+
+    assert store._claim()["id"] == first
+    assert store._claim()["id"] == second
+    assert store._claim() is None
+    assert store._get(first)["status"] == "running"
+
+
+def test_expired_lease_is_claimed_again_until_attempts_run_out(store, monkeypatch):
+    monkeypatch.setattr(job_queue, "JOB_LEASE_SECONDS", -1)
+    monkeypatch.setattr(job_queue, "JOB_MAX_ATTEMPTS", 2)
+    job_id = store._create("plan", {})
+
+    assert store._claim()["id"] == job_id
+    # Its worker died: the lease lapsed, so the job runs again
+    assert store._claim()["id"] == job_id
+    assert store._get(job_id)["attempts"] == 2
+    # Out of attempts: failed instead of claimed a third time
+    assert store._claim() is None
+    job = store._get(job_id)
+    assert job["status"] == "failed" and job["error"]
+
+
+class FlakyStore:
+    """Store whose writes fail, to check that workers survive store errors"""
+
+    def __init__(self, job):
+        self.jobs = [job]
+
+    async def claim(self):
+        return self.jobs.pop() if self.jobs else None
+
+    async def purge(self):
+        raise OSError("disk full")
+
+    async def set_steps(self, job_id, steps):
+        raise OSError("disk full")
+
+    async def renew(self, job_id):
+        raise OSError("disk full")
+
+    async def finish(self, job_id, status, result=None, error=None):
+        raise OSError("disk full")
+
+
+def test_workers_survive_store_errors(monkeypatch):
+    monkeypatch.setattr(job_queue, "JOB_POLL_INTERVAL", 0.01)
+    runs = []
+
+    async def handler(payload, report_steps):
+        report_steps([{"step": "one"}])
+        runs.append(payload)
+        return {"status": "success"}
+
+    register_job_handler("flaky", handler)
+
+    async def scenario():
+        pool = JobWorkerPool(FlakyStore({"id": "j1", "kind": "flaky", "payload": {"n": 1}, "created_at": 0}), 1)
+        pool.start()
+        await asyncio.sleep(0.1)
+        alive = not pool._tasks[0].done()
+        await pool.stop()
+        return alive
+
+    assert asyncio.run(scenario())
+    assert runs == [{"n": 1}]
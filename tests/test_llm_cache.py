@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("autogen_core")
+
+from autogen_core.models import CreateResult, RequestUsage, UserMessage
+from pydantic import BaseModel
+
+from Agents import llm_cache
+from Agents.llm_cache import CachedChatCompletionClient, DiskCacheTier, MemoryCacheTier, TieredCache, agent_response_cache, request_cache_key
+from Agents.fake_model_client import FakeChatCompletionClient
+from Agents.model_routing import EscalatingChatCompletionClient
+from Agents.usage_tracking import UsageTrackingChatCompletionClient
+
+
+class Plan(BaseModel):
+    days: int
+
+
+class FixedClient(FakeChatCompletionClient):
+    """Returns the queued contents in order and counts the calls"""
+
+    def __init__(self, contents, model="fake"):
+        super().__init__(model=model)
+        self.contents = list(contents)
+        self.calls = 0
+
+    async def create(self, messages, **kwargs):
+        self.calls += 1
+        content = self.contents.pop(0)
+        return CreateResult(finish_reason="stop", content=content, usage=RequestUsage(prompt_tokens=5, completion_tokens=5), cached=False)
+
+
+def tracked(client):
+    return UsageTrackingChatCompletionClient(client, "evaluator")
+
+
+def memory_cache() -> TieredCache:
+    return TieredCache("test", MemoryCacheTier(16, 60))
+
+
+MESSAGES = [UserMessage(content="hello", source="user")]
+
+
+def test_cache_key_covers_model_messages_and_output_type():
+    key = request_cache_key("m", MESSAGES, json_output=Plan)
+
+    assert key == request_cache_key("m", MESSAGES, json_output=Plan)
+    assert key != request_cache_key("other", MESSAGES, json_output=Plan)
+    assert key != request_cache_key("m", [UserMessage(content="bye", source="user")], json_output=Plan)
+    assert key != request_cache_key("m", MESSAGES)
+
+
+def test_valid_results_are_replayed_with_zero_usage():
+    client = FixedClient(['{"days": 3}'])
+    cached = CachedChatCompletionClient(tracked(client), memory_cache())
+
+    first = asyncio.run(cached.create(MESSAGES, json_output=Plan))
+    second = asyncio.run(cached.create(MESSAGES, json_output=Plan))
+
+    assert client.calls == 1
+    assert second.content == first.content
+    assert second.cached and second.usage.prompt_tokens == 0
+
+
+def test_invalid_structured_output_is_not_cached():
+    client = FixedClient(['{"days": "many"}', '{"days": 3}'])
+    cached = CachedChatCompletionClient(tracked(client), memory_cache())
+
+    asyncio.run(cached.create(MESSAGES, json_output=Plan))
+    retry = asyncio.run(cached.create(MESSAGES, json_output=Plan))
+
+    assert client.calls == 2
+    assert retry.content == '{"days": 3}'
+
+
+def test_answers_from_an_escalated_model_are_not_stored():
+    fast = FixedClient(['{"days": "many"}', '{"days": "many"}'], model="fake-fast")
+    large = FixedClient(['{"days": 3}', '{"days": 4}'], model="fake-large")
+    cached = CachedChatCompletionClient(EscalatingChatCompletionClient([tracked(fast), tracked(large)], "evaluator"), memory_cache())
+
+    first = asyncio.run(cached.create(MESSAGES, json_output=Plan))
+    second = asyncio.run(cached.create(MESSAGES, json_output=Plan))
+
+    assert (first.content, second.content) == ('{"days": 3}', '{"days": 4}')
+    assert not second.cached
+
+
+def test_plan_generators_are_not_cached(monkeypatch):
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_ENABLED", True)
+
+    assert agent_response_cache("summarizer") is llm_cache.llm_response_cache
+    assert agent_response_cache("evaluator") is llm_cache.llm_response_cache
+    assert agent_response_cache("nutritionist") is None
+    assert agent_response_cache("gym_trainer") is None
+
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_ENABLED", False)
+    assert agent_response_cache("summarizer") is None
+
+
+def test_disk_tier_creates_its_file_on_first_use(tmp_path):
+    path = tmp_path / "cache" / "inbody_cache.sqlite3"
+    cache = TieredCache("test", MemoryCacheTier(16, 60), DiskCacheTier(str(path), "test", 60))
+
+    assert not path.parent.exists()
+    asyncio.run(cache.set("key", "value"))
+    assert path.exists()
+    assert asyncio.run(DiskCacheTier(str(path), "test", 60).get("key")) == "value"
+
+
+def test_unusable_disk_path_falls_back_to_memory(tmp_path):
+    blocker = tmp_path / "not-a-directory"
+    blocker.write_text("")
+    cache = TieredCache("test", MemoryCacheTier(16, 60), DiskCacheTier(str(blocker / "cache.sqlite3"), "test", 60))
+
+    asyncio.run(cache.set("key", "value"))
+
+    assert asyncio.run(cache.get("key")) == "value"
+    assert asyncio.run(cache.shared.get("key")) is None
@@ -0,0 +1,69 @@
+import asyncio
+import uuid
+
+import pytest
+
+pytest.importorskip("autogen_core")
+pytest.importorskip("openai")
+
+from autogen_core.models import UserMessage
+
+from Agents.fake_model_client import FakeChatCompletionClient
+from Agents.model_failover import FailoverChatCompletionClient, provider_health
+
+MESSAGES = [UserMessage(content="hello", source="user")]
+
+
+class FailingClient(FakeChatCompletionClient):
+    def __init__(self, error):
+        super().__init__()
+        self.error = error
+
+    async def create(self, messages, **kwargs):
+        raise self.error
+
+
+def providers():
+    suffix = uuid.uuid4().hex[:8]
+    return f"primary-{suffix}", f"secondary-{suffix}"
+
+
+def order(client):
+    return [provider for provider, _ in client._candidates(MESSAGES)]
+
+
+def test_unsampled_secondary_never_outranks_a_healthy_primary():
+    primary, secondary = providers()
+    client = FailoverChatCompletionClient([(primary, FakeChatCompletionClient()), (secondary, FakeChatCompletionClient())], "evaluator")
+
+    assert order(client) == [primary, secondary]
+    # A slow call of another type does not count against the evaluator's latency
+    provider_health(primary).record_success("nutritionist", 60.0)
+    assert order(client) == [primary, secondary]
+    provider_health(primary).record_success("evaluator", 8.0)
+    assert order(client) == [primary, secondary]
+
+
+def test_faster_secondary_wins_only_for_its_call_type():
+    primary, secondary = providers()
+    client = FailoverChatCompletionClient([(primary, FakeChatCompletionClient()), (secondary, FakeChatCompletionClient())], "evaluator")
+    provider_health(primary).record_success("evaluator", 8.0)
+    provider_health(secondary).record_success("evaluator", 2.0)
+
+    assert order(client) == [secondary, primary]
+
+
+def test_only_transient_errors_count_against_health():
+    primary, secondary = providers()
+    client = FailoverChatCompletionClient(
+        [(primary, FailingClient(ValueError("schema rejected"))), (secondary, FakeChatCompletionClient())], "evaluator"
+    )
+
+    asyncio.run(client.create(MESSAGES))
+    assert provider_health(primary).error_rate == 0
+
+    client = FailoverChatCompletionClient(
+        [(primary, FailingClient(asyncio.TimeoutError())), (secondary, FakeChatCompletionClient())], "evaluator"
+    )
+    asyncio.run(client.create(MESSAGES))
+    assert provider_health(primary).error_rate > 0
@@ -0,0 +1,106 @@
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip("autogen_agentchat")
+pytest.importorskip("fastapi")
+
+from autogen_agentchat.messages import ModelClientStreamingChunkEvent, StructuredMessage
+
+from Agents.v2.nutritionist import (
+    FourWeekDietPlan,
+    IncrementalDayPlanParser,
+    NestedPlanBuilder,
+    convert_flat_to_nested,
+    nutritionist_plan,
+    stream_nutrition_team,
+)
+
+
+def day_plan(week, day, meal_type, name="Oats"):
+    return {
+        "week": week,
+        "day": day,
+        "meal_type": meal_type,
+        "ingredients": [{"name": name, "quantity": "50 g", "alternatives": {"name": "Bread", "quantity": "1 piece"}}],
+    }
+
+
+def test_parser_returns_each_day_plan_when_its_object_closes():
+    entries = [day_plan("Week 1", "Monday", "breakfast"), day_plan("Week 1", "Monday", "lunch", name='Rice "white" {cooked}')]
+    text = json.dumps({"plan": entries})
+    parser = IncrementalDayPlanParser()
+
+    received = []
+    for i in range(0, len(text), 7):
+        received.extend(parser.feed(text[i:i + 7]))
+
+    assert received == entries
+
+
+def test_parser_ignores_incomplete_trailing_object():
+    text = json.dumps({"plan": [day_plan("Week 1", "Monday", "breakfast")]})
+    parser = IncrementalDayPlanParser()
+
+    assert parser.feed(text[:-10]) == []
+
+
+def test_builder_nests_entries_and_counts_complete_days():
+    builder = NestedPlanBuilder()
+    for meal in ("breakfast", "lunch", "snack", "dinner"):
+        builder.add(day_plan("Week 1", "Monday", meal))
+    builder.add(day_plan("Week 1", "Tuesday", "فطور"))
+
+    assert builder.entries == 5
+    assert builder.days_completed == 1
+    week = builder.result["plan"][0]
+    assert [day["day"] for day in week["days"]] == ["Monday", "Tuesday"]
+    # Arabic meal types are normalized
+    assert "breakfast" in week["days"][1]["meals"]
+
+
+def test_convert_flat_to_nested_matches_incremental_builder():
+    flat = {"plan": [day_plan("Week 1", "Monday", "breakfast"), day_plan("Week 2", "Monday", "dinner")]}
+
+    nested = convert_flat_to_nested(flat)
+
+    assert [week["week"] for week in nested["plan"]] == ["Week 1", "Week 2"]
+    assert nested["plan"][1]["days"][0]["meals"]["dinner"][0]["alternatives"]["name"] == "Bread"
+
+
+class FailingTeam:
+    """Streams the given events, then fails like a team whose evaluator call errors"""
+
+    def __init__(self, events):
+        self.events = events
+        self.runs = 0
+
+    async def run_stream(self, task):
+        self.runs += 1
+        for event in self.events:
+            yield event
+        raise RuntimeError("evaluator call failed")
+
+
+def test_streamed_plan_survives_a_later_team_error():
+    plan = FourWeekDietPlan.model_validate({"plan": [day_plan("Week 1", "Monday", "breakfast")]})
+    team = FailingTeam([
+        ModelClientStreamingChunkEvent(content=plan.model_dump_json(), source="nutritionist"),
+        StructuredMessage[FourWeekDietPlan](content=plan, source="nutritionist"),
+    ])
+    received = []
+
+    result = asyncio.run(stream_nutrition_team(team, "task", lambda entry, progress: received.append(entry)))
+
+    assert team.runs == 1
+    assert received == plan.model_dump()["plan"]
+    assert nutritionist_plan(result.messages) == plan.model_dump()
+
+
+def test_team_error_before_any_plan_is_raised():
+    team = FailingTeam([])
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(stream_nutrition_team(team, "task"))
+    assert team.runs == 1
@@ -0,0 +1,137 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("autogen_agentchat")
+pytest.importorskip("fastapi")
+pytest.importorskip("firebase_admin")
+
+from Agents.image_fetcher import ImageFetchError
+from Agents.v2 import plan_workflow
+
+WORKFLOW_ARGS = dict(
+    inbody_image_url="https://example.com/missing.jpg",
+    client_country="Egypt",
+    goals="lose fat",
+    injuries="",
+    number_of_gym_days="3",
+    age="30",
+    gender="male",
+)
+
+
+def test_unreachable_image_url_returns_the_invalid_url_error(monkeypatch):
+    async def load_inbody_image(url):
+        raise ImageFetchError("404 Not Found")
+
+    monkeypatch.setattr(plan_workflow, "load_inbody_image", load_inbody_image)
+
+    result = asyncio.run(plan_workflow.execute_complete_workflow(**WORKFLOW_ARGS))
+
+    assert result["error"] == "Invalid or inaccessible image URL: 404 Not Found"
+    assert result.get("status") != "success"
+
+
+async def collect(events):
+    return [event async for event in events]
+
+
+def test_cancelled_workflow_still_ends_the_stream_with_a_result():
+    async def scenario():
+        updates = plan_workflow.StepUpdates()
+        workflow = asyncio.create_task(asyncio.sleep(60))
+        workflow.add_done_callback(lambda _: updates.put(None))
+        events = asyncio.create_task(collect(plan_workflow.stream_workflow_events(workflow, updates)))
+        await asyncio.sleep(0)
+        workflow.cancel()
+        return await events
+
+    events = asyncio.run(scenario())
+
+    assert len(events) == 1
+    assert events[0].startswith("event: result\n")
+    assert '"status": "error"' in events[0]
+
+
+def test_step_updates_are_dropped_once_the_client_disconnects():
+    async def scenario():
+        updates = plan_workflow.StepUpdates()
+        workflow = asyncio.get_running_loop().create_future()
+        stream = plan_workflow.stream_workflow_events(workflow, updates)
+        updates.put([{"step": "inbody_analysis", "status": "processing"}])
+        await stream.__anext__()
+        await stream.aclose()
+        updates.put([{"step": "inbody_analysis", "status": "completed"}])
+        return updates
+
+    updates = asyncio.run(scenario())
+
+    assert updates.closed
+    assert updates._queue.empty()
+
+
+def fake_plan_steps(monkeypatch, inbody_results):
+    """Replace the model-backed steps; returns the calories given to the nutrition plan"""
+    calories = []
+
+    async def load_inbody_image(url):
+        return object()
+
+    async def process_inbody_analysis(image, user_id=None):
+        return {"status": "success", "analysis": {"status": "success", "results": inbody_results}, "cached": False}
+
+    async def create_comprehensive_workout_plan(*args, calories=None):
+        return {"status": "success", "workout_plan": {"daily_calories": calories or 2400}}
+
+    async def create_comprehensive_nutrition_plan(language, inbody_data, plan_calories, *args, **kwargs):
+        calories.append(plan_calories)
+        return {"status": "success", "diet_plan": {}}
+
+    monkeypatch.setattr(plan_workflow, "load_inbody_image", load_inbody_image)
+    monkeypatch.setattr(plan_workflow, "process_inbody_analysis", process_inbody_analysis)
+    monkeypatch.setattr(plan_workflow, "create_comprehensive_workout_plan", create_comprehensive_workout_plan)
+    monkeypatch.setattr(plan_workflow, "create_comprehensive_nutrition_plan", create_comprehensive_nutrition_plan)
+    return calories
+
+
+def steps_by_name(result):
+    return {step["step"]: step for step in result["workflow_steps"]}
+
+
+def test_disabled_calorie_engine_has_no_calorie_step(monkeypatch):
+    calories = fake_plan_steps(monkeypatch, {"basal_metabolic_rate": 1800})
+    monkeypatch.setattr(plan_workflow, "CALORIE_ENGINE_ENABLED", False)
+
+    result = asyncio.run(plan_workflow.execute_complete_workflow(**WORKFLOW_ARGS))
+
+    assert result["status"] == "success"
+    assert "calorie_target" not in steps_by_name(result)
+    assert calories == [2400]
+
+
+def test_computed_calorie_target_is_shared_by_both_plans(monkeypatch):
+    calories = fake_plan_steps(monkeypatch, {"basal_metabolic_rate": 1800})
+    monkeypatch.setattr(plan_workflow, "CALORIE_ENGINE_ENABLED", True)
+
+    result = asyncio.run(plan_workflow.execute_complete_workflow(**WORKFLOW_ARGS))
+
+    steps = steps_by_name(result)
+    assert steps["calorie_target"]["status"] == "completed"
+    assert steps["gym_plan_creation"]["data"]["gym_plan"]["daily_calories"] == 2250
+    assert calories == [2250]
+
+
+@pytest.mark.parametrize("gym_days, message, nutrition_calories", [
+    ("3", "Not enough InBody data to compute a calorie target; calories taken from the gym plan", 2400),
+    ("0", "Not enough InBody data to compute a calorie target; the nutrition plan sets the calories", ""),
+])
+def test_skipped_calorie_target_names_the_calorie_source(monkeypatch, gym_days, message, nutrition_calories):
+    calories = fake_plan_steps(monkeypatch, {"weight": 80})
+    monkeypatch.setattr(plan_workflow, "CALORIE_ENGINE_ENABLED", True)
+
+    result = asyncio.run(plan_workflow.execute_complete_workflow(**{**WORKFLOW_ARGS, "number_of_gym_days": gym_days}))
+
+    step = steps_by_name(result)["calorie_target"]
+    assert step["status"] == "skipped"
+    assert step["message"] == message
+    assert calories == [nutrition_calories]
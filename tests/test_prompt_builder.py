@@ -0,0 +1,53 @@
+import json
+
+from Agents.prompt_builder import PromptBuilder, compact_value, count_tokens, fit_value, format_compact
+
+
+def test_empty_values_are_dropped_and_numbers_kept_exact():
+    value = {"weight": 81.25, "fat": None, "notes": "  lean   bulk ", "segments": [], "scores": {"bmr": 1742}}
+
+    assert compact_value(value) == {"weight": 81.25, "notes": "lean bulk", "scores": {"bmr": 1742}}
+    assert format_compact({"weight": 81.25, "age": 30}) == "weight=81.25; age=30"
+
+
+def test_prompt_within_budget_is_unchanged():
+    prompt = PromptBuilder(1000).add("age", 30).add("history", "short", required=False).build(footer="Go")
+
+    assert prompt == "age:30\nhistory:short\nGo"
+
+
+def history(days):
+    return {"plan": [{"day": f"Day {i}", "meals": ["oats with milk", "rice and chicken", "salad"]} for i in range(days)]}
+
+
+def test_structured_history_is_trimmed_by_whole_items_and_stays_valid_json():
+    builder = PromptBuilder(120).add("calories", 2200).add("last plan", history(40), priority=0, required=False)
+
+    prompt = builder.build()
+    last_plan = prompt.split("last plan:", 1)[1]
+
+    assert count_tokens(prompt) <= 120
+    trimmed = json.loads(last_plan)
+    assert 0 < len(trimmed["plan"]) < 40
+    # Whole days are kept; only the last one kept may be cut short (by whole fields)
+    kept = len(trimmed["plan"])
+    assert trimmed["plan"][:-1] == history(40)["plan"][: kept - 1]
+    assert trimmed["plan"][-1].items() <= history(40)["plan"][kept - 1].items()
+    assert "calories:2200" in prompt
+
+
+def test_lowest_priority_section_is_trimmed_first():
+    prompt = (
+        PromptBuilder(250)
+        .add("current", history(3))
+        .add("previous inbody", history(5), priority=1, required=False)
+        .add("last plan", history(40), priority=0, required=False)
+        .build()
+    )
+
+    assert json.loads(prompt.split("previous inbody:", 1)[1].split("\n")[0]) == history(5)
+
+
+def test_fit_value_drops_what_cannot_fit():
+    assert fit_value(history(40), 1) is None
+    assert fit_value("a long sentence " * 50, 10).endswith("...")
@@ -0,0 +1,149 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("autogen_core")
+
+from Agents.rate_limiter import ProviderRateLimiter, RedisWindowBudget, TokenBucket
+
+
+def test_token_bucket_waits_for_refill_and_refunds():
+    bucket = TokenBucket(60)
+
+    assert bucket.wait_time(60) == 0
+    bucket.consume(60)
+    assert bucket.wait_time(1) == pytest.approx(1, abs=0.05)
+    bucket.refund(30)
+    assert bucket.wait_time(30) == 0
+    # Never more than the capacity, so a huge call waits for a full bucket only
+    assert bucket.wait_time(1000) == pytest.approx(30, abs=0.1)
+
+
+def test_unlimited_bucket_never_waits():
+    bucket = TokenBucket(0)
+    bucket.consume(10**9)
+    assert bucket.wait_time(10**9) == 0
+
+
+class FakeRedis:
+    """The few commands RedisWindowBudget uses, kept in a dict"""
+
+    def __init__(self):
+        self.values = {}
+        self.queued = []
+
+    def pipeline(self):
+        self.queued = []
+        return self
+
+    def incrby(self, key, amount):
+        self.queued.append((key, amount))
+
+    def expire(self, key, seconds):
+        self.queued.append(None)
+
+    async def execute(self):
+        results = []
+        for op in self.queued:
+            if op is None:
+                results.append(True)
+            else:
+                key, amount = op
+                self.values[key] = self.values.get(key, 0) + amount
+                results.append(self.values[key])
+        return results
+
+    async def decrby(self, key, amount):
+        self.values[key] = self.values.get(key, 0) - amount
+
+    def used(self, kind):
+        return sum(value for key, value in self.values.items() if key.endswith(kind))
+
+
+def redis_budget(rpm, tpm):
+    pytest.importorskip("redis")
+    budget = RedisWindowBudget("redis://localhost:6379/0", "test", rpm, tpm)
+    budget._redis = FakeRedis()
+    return budget
+
+
+def test_shared_budget_clamps_oversized_calls_to_the_window():
+    budget = redis_budget(rpm=10, tpm=100)
+
+    reserved, window = asyncio.run(budget.reserve(5000))
+
+    assert reserved and window is not None
+    assert budget._redis.used("tokens") == 100
+
+
+def test_spent_shared_budget_is_given_back():
+    budget = redis_budget(rpm=1, tpm=1000)
+
+    async def scenario():
+        first = await budget.reserve(10)
+        second = await budget.reserve(10)
+        return first, second
+
+    (first_ok, _), (second_ok, second_window) = asyncio.run(scenario())
+
+    assert first_ok and not second_ok and second_window is None
+    assert budget._redis.used("requests") == 1
+    assert budget._redis.used("tokens") == 10
+
+
+class SpentOnceBudget:
+    """Shared budget that is spent for the first call only"""
+
+    def __init__(self):
+        self.calls = 0
+        self.refunded = []
+
+    async def reserve(self, tokens):
+        self.calls += 1
+        return self.calls > 1, 7
+
+    async def refund(self, window, tokens):
+        self.refunded.append((window, tokens))
+
+    @staticmethod
+    def next_window():
+        return 0.2
+
+
+def test_waiting_for_the_shared_window_does_not_hold_the_queue():
+    limiter = ProviderRateLimiter("test", 0, 0, 4, shared_budget=SpentOnceBudget())
+
+    async def scenario():
+        order = []
+
+        async def call(name):
+            async with limiter.slot(10):
+                order.append((name, time.monotonic()))
+
+        start = time.monotonic()
+        await asyncio.gather(call("blocked"), call("next"))
+        return start, dict(order)
+
+    start, finished = asyncio.run(scenario())
+
+    assert finished["next"] - start < 0.1
+    assert finished["blocked"] - start >= 0.2
+
+
+def test_failed_calls_give_their_tokens_back():
+    budget = SpentOnceBudget()
+    budget.calls = 1
+    limiter = ProviderRateLimiter("test", 100, 1000, 4, shared_budget=budget)
+
+    async def scenario():
+        with pytest.raises(RuntimeError):
+            async with limiter.slot(400):
+                raise RuntimeError("provider error")
+
+    asyncio.run(scenario())
+
+    assert limiter.tokens.wait_time(1000) == 0
+    assert budget.refunded == [(7, 400)]
+    # The request was sent, so it still counts
+    assert limiter.requests.level < 100
@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("autogen_core")
+pytest.importorskip("openai")
+
+from autogen_core.models import UserMessage
+
+from Agents.call_policy import ResilientChatCompletionClient
+from Agents.fake_model_client import FakeChatCompletionClient
+from Agents.model_routing import EscalatingChatCompletionClient
+from Agents.usage_tracking import UsageTrackingChatCompletionClient, track_usage
+
+MESSAGES = [UserMessage(content="hello", source="user")]
+
+
+class FailingClient(FakeChatCompletionClient):
+    async def create(self, messages, **kwargs):
+        raise RuntimeError("fast model failed")
+
+
+def tracked(client, agent="evaluator"):
+    return UsageTrackingChatCompletionClient(client, agent)
+
+
+def test_escalated_calls_are_recorded_under_the_model_that_served_them():
+    client = EscalatingChatCompletionClient(
+        [tracked(FailingClient(model="fake-fast")), tracked(FakeChatCompletionClient(model="fake-large"))],
+        "evaluator",
+    )
+
+    with track_usage() as tracker:
+        asyncio.run(client.create(MESSAGES))
+
+    assert [call["model"] for call in tracker.calls] == ["fake-large"]
+    assert tracker.calls[0]["prompt_tokens"] > 0
+
+
+def test_losing_hedges_are_recorded_with_their_prompt():
+    inner = tracked(FakeChatCompletionClient(latency="fixed:0.2", model="fake-large"), agent="nutritionist")
+    client = ResilientChatCompletionClient(inner, timeout=5, max_retries=0, hedge=True, hedge_delay=0.05)
+
+    with track_usage() as tracker:
+        asyncio.run(client.create(MESSAGES))
+
+    assert len(tracker.calls) == 2
+    winner, loser = sorted(tracker.calls, key=lambda call: -call["completion_tokens"])
+    assert winner["completion_tokens"] > 0
+    assert loser["completion_tokens"] == 0 and loser["prompt_tokens"] > 0
@@ -0,0 +1,134 @@
+import asyncio
+
+import pytest
+
+from Agents.workflow_dag import DagExecutor, DagFailed, DagNode, StepFailed, StepSkipped, topological_order
+
+
+async def noop(results):
+    return None
+
+
+def names(nodes):
+    return [node.name for node in nodes]
+
+
+def test_topological_order_puts_dependencies_first():
+    nodes = [
+        DagNode("plan", noop, deps=("target", "history")),
+        DagNode("history", noop),
+        DagNode("target", noop, deps=("inbody",)),
+        DagNode("inbody", noop),
+    ]
+
+    assert names(topological_order(nodes)) == ["inbody", "target", "history", "plan"]
+
+
+def test_topological_order_keeps_declaration_order_of_independent_nodes():
+    nodes = [DagNode("b", noop), DagNode("a", noop), DagNode("c", noop, deps=("a",))]
+
+    assert names(topological_order(nodes)) == ["b", "a", "c"]
+
+
+@pytest.mark.parametrize("nodes, error", [
+    ([DagNode("a", noop, deps=("b",)), DagNode("b", noop, deps=("a",))], "Dependency cycle"),
+    ([DagNode("a", noop, deps=("missing",))], "unknown step 'missing'"),
+    ([DagNode("a", noop), DagNode("a", noop)], "Duplicate"),
+])
+def test_topological_order_rejects_invalid_graphs(nodes, error):
+    with pytest.raises(ValueError, match=error):
+        topological_order(nodes)
+
+
+def run_graph(nodes):
+    statuses = []
+    executor = DagExecutor(nodes, on_status=lambda name, status, detail: statuses.append((name, status)))
+    return executor, statuses
+
+
+def test_independent_nodes_run_concurrently():
+    async def scenario():
+        started = {"a": asyncio.Event(), "b": asyncio.Event()}
+
+        def node(name, other):
+            async def run(results):
+                started[name].set()
+                # Deadlocks (and times out) unless both run at the same time
+                await asyncio.wait_for(started[other].wait(), 1)
+                return name
+            return run
+
+        executor, _ = run_graph([
+            DagNode("a", node("a", "b")),
+            DagNode("b", node("b", "a")),
+            DagNode("both", lambda results: asyncio.sleep(0, [results["a"], results["b"]]), deps=("a", "b")),
+        ])
+        return await executor.run()
+
+    assert asyncio.run(scenario())["both"] == ["a", "b"]
+
+
+def test_skipped_nodes_still_let_their_dependents_run():
+    async def skip_with_result(results):
+        raise StepSkipped("nothing to summarize", result={"summary": ""})
+
+    async def plan(results):
+        return (results["history"], results["gym"])
+
+    executor, statuses = run_graph([
+        DagNode("history", skip_with_result),
+        DagNode("gym", noop, when=lambda results: False),
+        DagNode("plan", plan, deps=("history", "gym")),
+    ])
+
+    results = asyncio.run(executor.run())
+
+    assert results["plan"] == ({"summary": ""}, None)
+    assert ("history", "skipped") in statuses and ("gym", "skipped") in statuses
+    assert statuses[-1] == ("plan", "completed")
+
+
+def test_wait_for_awaits_a_node_that_is_not_a_dependency():
+    async def scenario():
+        async def gym(results):
+            await asyncio.sleep(0.01)
+            return 2400
+
+        async def nutrition(results):
+            return await executor.wait_for("gym")
+
+        executor, _ = run_graph([DagNode("gym", gym), DagNode("nutrition", nutrition)])
+        return await executor.run()
+
+    assert asyncio.run(scenario())["nutrition"] == 2400
+
+
+def test_first_failure_cancels_the_running_nodes():
+    async def scenario():
+        cancelled = asyncio.Event()
+
+        async def slow(results):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        async def fail(results):
+            raise StepFailed("InBody analysis failed", {"error": "bad image"})
+
+        executor, statuses = run_graph([
+            DagNode("history", slow),
+            DagNode("inbody", fail),
+            DagNode("plan", noop, deps=("history", "inbody")),
+        ])
+        with pytest.raises(DagFailed) as failure:
+            await executor.run()
+        return failure.value, cancelled.is_set(), executor.statuses
+
+    error, cancelled, statuses = asyncio.run(scenario())
+
+    assert error.node == "inbody"
+    assert error.error.response == {"error": "bad image"}
+    assert cancelled
+    assert statuses == {"history": "cancelled", "inbody": "failed", "plan": "cancelled"}